@@ -0,0 +1,75 @@
+from array import array
+
+from obis_codes import CODE, OBIS_TABLE, STATE_CLASS, describe
+
+# Codes with state_class measurement: power, voltage and current
+MEASUREMENT_CODES = tuple(row[CODE] for row in OBIS_TABLE if row[STATE_CLASS] == 'measurement')
+
+STATISTICS = ('min', 'max', 'mean')
+
+
+class Aggregator:
+    """Running min, max, mean and count per OBIS code over a publish window.
+
+    Statistics live in fixed size arrays indexed by the position of the code,
+    the derived sensor ids and attributes are built once from the describe
+    function of the meter, see obis_codes.describer().
+    """
+
+    def __init__(self, obis_codes=MEASUREMENT_CODES, describe=describe):
+        self.obis_codes = obis_codes
+        descriptors = tuple(describe(obis_code) for obis_code in obis_codes)
+        self.sensor_ids = tuple(sensor_id for sensor_id, attributes in descriptors)
+        n = len(obis_codes)
+        self.minimum = array('f', [0] * n)
+        self.maximum = array('f', [0] * n)
+        self.total = array('f', [0] * n)
+        self.count = array('I', [0] * n)
+        self.derived = []
+        for sensor_id, attributes in descriptors:
+            self.derived.append(tuple((f'{sensor_id}_{statistic}', self.derived_attributes(attributes, statistic))
+                                      for statistic in STATISTICS))
+
+    @staticmethod
+    def derived_attributes(attributes, statistic):
+        derived = dict(attributes)
+        derived["friendly_name"] = f'{attributes["friendly_name"]} {statistic}'
+        return derived
+
+    def reset(self):
+        for i in range(len(self.count)):
+            self.count[i] = 0
+
+    def add(self, sensors):
+        for i, sensor_id in enumerate(self.sensor_ids):
+            sensor = sensors.get(sensor_id)
+            if sensor is None:
+                continue
+            try:
+                value = float(sensor["state"])
+            except ValueError:
+                continue
+            if self.count[i] == 0:
+                self.minimum[i] = self.maximum[i] = self.total[i] = value
+            else:
+                if value < self.minimum[i]:
+                    self.minimum[i] = value
+                if value > self.maximum[i]:
+                    self.maximum[i] = value
+                self.total[i] += value
+            self.count[i] += 1
+
+    def sensors(self):
+        """Derived _min/_max/_mean sensors for every code seen in the window"""
+        sensors = {}
+        for i, derived in enumerate(self.derived):
+            count = self.count[i]
+            if not count:
+                continue
+            values = (self.minimum[i], self.maximum[i], self.total[i] / count)
+            for (sensor_id, attributes), value in zip(derived, values):
+                sensors[sensor_id] = {
+                    "state": f'{value:.3f}',
+                    "attributes": attributes
+                }
+        return sensors
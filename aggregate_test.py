@@ -0,0 +1,51 @@
+import unittest
+
+from aggregate import MEASUREMENT_CODES, Aggregator
+from p1meter import read_p1_meter
+from p1meter_test import p1_test_readline
+
+
+def power(state):
+    return {'sensor.dsmr_current_power_l1': {"state": state, "attributes": {}}}
+
+
+class AggregatorTest(unittest.TestCase):
+
+    def test_measurement_codes(self):
+        self.assertIn('1-0:21.7.0', MEASUREMENT_CODES)
+        self.assertIn('1-0:32.7.0', MEASUREMENT_CODES)
+        self.assertNotIn('1-0:1.8.0', MEASUREMENT_CODES)
+
+    def test_min_max_mean(self):
+        aggregator = Aggregator()
+        for state in ('0000.200', '0001.400', '0000.100', '0000.300'):
+            aggregator.add(power(state))
+        sensors = aggregator.sensors()
+        self.assertEqual(len(sensors), 3)
+        self.assertEqual(sensors['sensor.dsmr_current_power_l1_min']['state'], '0.100')
+        self.assertEqual(sensors['sensor.dsmr_current_power_l1_max']['state'], '1.400')
+        self.assertEqual(sensors['sensor.dsmr_current_power_l1_mean']['state'], '0.500')
+        attributes = sensors['sensor.dsmr_current_power_l1_max']['attributes']
+        self.assertEqual(attributes['friendly_name'], 'Current Power L1 max')
+        self.assertEqual(attributes['unit_of_measurement'], 'kW')
+        self.assertEqual(attributes['state_class'], 'measurement')
+
+    def test_reset(self):
+        aggregator = Aggregator()
+        aggregator.add(power('0001.000'))
+        aggregator.reset()
+        self.assertEqual(aggregator.sensors(), {})
+        aggregator.add(power('0002.000'))
+        self.assertEqual(aggregator.sensors()['sensor.dsmr_current_power_l1_min']['state'], '2.000')
+
+    def test_telegram(self):
+        aggregator = Aggregator()
+        s, error_type = read_p1_meter(p1_test_readline())
+        aggregator.add(s)
+        sensors = aggregator.sensors()
+        self.assertEqual(len(sensors), 3 * len(MEASUREMENT_CODES))
+        self.assertEqual(sensors['sensor.dsmr_current_voltage_l1_mean']['state'], '228.900')
+
+
+if __name__ == '__main__':
+    unittest.main()
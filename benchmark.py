@@ -0,0 +1,393 @@
+"""Benchmarks of the telegram and publish hot paths, on CPython and the MicroPython unix port.
+
+    python3 benchmark.py                    human readable results
+    python3 benchmark.py --json > new.jsonl  one JSON result per line
+    python3 benchmark.py --compare old.jsonl new.jsonl [--threshold 0.1]
+    micropython benchmark.py --json          same on the unix port
+
+--compare prints the change per benchmark and exits with status 1 when a
+benchmark got more than 10% slower or bigger (--threshold 0.25 for 25%),
+so results can be compared between commits. Every timing is the best of 5
+runs after a warm up call.
+"""
+import gc
+import io
+import json
+import re
+import sys
+
+from compat import ticks_us, ticks_diff
+from http_client import HttpClient, Response
+from log import DEBUG, WARNING, logger
+from p1meter import TelegramParser, calculate_crc, obis_to_description, parse_line, read_p1_meter
+from publish import PayloadTemplates, post_sensor, post_sensor_request, sensor_payload, snapshot_payload
+from pull_server import BufferedWriter, render_json, render_prometheus
+from p1meter_test import meter_sample, bitwise_crc, p1_test_readline
+from scheduler import POWER_OBIS_CODE
+from snapshot import Snapshot
+from uart_reader import FrameReader
+from uart_reader_test import FileUart
+
+try:
+    from contextlib import redirect_stdout
+except ImportError:
+    redirect_stdout = None
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+class NullWriter:
+
+    def write(self, text):
+        return len(text)
+
+
+class SinkClient(HttpClient):
+    """HttpClient serialising requests into a NullWriter instead of a socket"""
+
+    def exchange(self, target, write, timeout):
+        self.stream = NullWriter()
+        write()
+        return Response(200, b'')
+
+
+def quiet(func):
+    """Run func with the per line parser output suppressed where possible"""
+    if redirect_stdout is None:
+        return func()
+    with redirect_stdout(NullWriter()):
+        return func()
+
+
+def allocated(func):
+    """Bytes allocated while running func"""
+    if tracemalloc:
+        tracemalloc.start()
+        func()
+        size, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return peak
+    gc.collect()
+    gc.disable()
+    before = gc.mem_alloc()
+    func()
+    used = gc.mem_alloc() - before
+    gc.enable()
+    return used
+
+
+# Results as dicts, printed as text or as JSON lines
+JSON_OUTPUT = '--json' in sys.argv
+results = []
+
+
+def report(bench, value, unit, telegram=None, **fields):
+    result = {"bench": bench, "telegram": telegram, "value": round(value, 1), "unit": unit,
+              "implementation": sys.implementation.name}
+    result.update(fields)
+    results.append(result)
+    if JSON_OUTPUT:
+        print(json.dumps(result))
+    else:
+        name = f'{bench} [{telegram}]' if telegram else bench
+        print(f'{name:<34} {value:>10.1f} {unit}')
+
+
+def run(func, iterations, repeats=5):
+    """Average us per call of func over iterations, the best of repeats runs to filter out noise"""
+    best = None
+    func()  # warm up caches
+    for _ in range(repeats):
+        gc.collect()
+        start = ticks_us()
+        for _ in range(iterations):
+            result = func()
+        elapsed = ticks_diff(ticks_us(), start)
+        best = elapsed if best is None else min(best, elapsed)
+    return best / iterations, result
+
+
+def telegram_crc(crc_func, lines):
+    crc = 0
+    for line in lines:
+        crc = crc_func(crc, line)
+    return crc
+
+
+# Regex based parse_line this tokenizer replaced, kept as reference
+PARSE_TIMESTAMP = re.compile(r'([\d\.\-:]+)\((\d+[SW]?)\)\(([\w.]*)\*?([\w%]*)\)')
+PARSE_NO_TIMESTAMP = re.compile(r'([\d\.\-:]+)\(([\w.]*)\*?([\w%]*)\)')
+
+
+def regex_parse_line(line):
+    match = PARSE_TIMESTAMP.match(line)
+    if match:
+        return match.group(1), match.group(3), match.group(4), match.group(2)
+
+    match = PARSE_NO_TIMESTAMP.match(line)
+    if match:
+        return match.group(1), match.group(2), match.group(3), None
+
+    return None, None, None, None
+
+
+def parse_lines(parse_func, lines):
+    return [parse_func(line) for line in lines]
+
+
+def bench_crc(iterations=100):
+    lines = [line.encode('utf-8') for line in meter_sample]
+    table_us, table_crc = run(lambda: telegram_crc(calculate_crc, lines), iterations)
+    bitwise_us, bitwise_crc_value = run(lambda: telegram_crc(bitwise_crc, lines), iterations)
+    assert table_crc == bitwise_crc_value, f'{table_crc:04X} != {bitwise_crc_value:04X}'
+    report('crc_bitwise', bitwise_us, 'us/telegram')
+    report('crc_table', table_us, 'us/telegram')
+
+
+def bench_parse_line(iterations=100):
+    lines = [line.strip() for line in meter_sample if line.strip()[:1].isdigit()]
+    tokenizer_us, tokens = run(lambda: parse_lines(parse_line, lines), iterations)
+    regex_us, regex_tokens = run(lambda: parse_lines(regex_parse_line, lines), iterations)
+    assert tokens == regex_tokens
+    report('parse_regex', regex_us, 'us/telegram')
+    report('parse_tokenizer', tokenizer_us, 'us/telegram')
+
+
+def read_all(read):
+    telegrams = 0
+    while True:
+        data, error_type = read()
+        if error_type == "timeout":
+            return telegrams
+        assert error_type is None, error_type
+        telegrams += 1
+
+
+def bench_ingestion(telegrams=20, iterations=5):
+    capture = ''.join(meter_sample).encode('utf-8') * telegrams
+
+    def readline_path():
+        file = io.BytesIO(capture)
+        return read_all(lambda: read_p1_meter(lambda: file.readline() or None))
+
+    def readinto_path():
+        return read_all(FrameReader(FileUart(io.BytesIO(capture))).read_telegram)
+
+    readline_us, count = quiet(lambda: run(readline_path, iterations))
+    readinto_us, readinto_count = quiet(lambda: run(readinto_path, iterations))
+    assert count == readinto_count == telegrams
+    report('ingest_readline', readline_us / telegrams, 'us/telegram')
+    report('ingest_readinto', readinto_us / telegrams, 'us/telegram')
+
+
+def replay(telegrams, full_parse_every):
+    """Parse a capture of one telegram per second, tokenising everything only every full_parse_every telegrams"""
+    parser = TelegramParser()
+    for i in range(telegrams):
+        parser.wanted = None if i % full_parse_every == 0 else (POWER_OBIS_CODE,)
+        data, error_type = read_p1_meter(p1_test_readline(), parser)
+        assert error_type is None, error_type
+
+
+def bench_scheduler(telegrams=60):
+    full_us, _ = quiet(lambda: run(lambda: replay(telegrams, 1), 1))
+    scheduled_us, _ = quiet(lambda: run(lambda: replay(telegrams, telegrams), 1))
+    report('replay_full_parse', full_us / telegrams, 'us/telegram')
+    report('replay_scheduled', scheduled_us / telegrams, 'us/telegram')
+
+
+def bench_snapshot(telegrams=10):
+    def parse(parser):
+        def parse_all():
+            for i in range(telegrams):
+                data, error_type = read_p1_meter(p1_test_readline(), parser)
+                assert error_type is None, error_type
+            return data
+        return parse_all
+
+    snapshot_parser = TelegramParser(snapshot=Snapshot())
+    quiet(parse(snapshot_parser))  # warm up
+    report('memory_parse_dict', quiet(lambda: allocated(parse(TelegramParser()))), 'bytes')
+    report('memory_parse_snapshot', quiet(lambda: allocated(parse(snapshot_parser))), 'bytes')
+    report('memory_render_snapshot', allocated(lambda: dict(snapshot_parser.snapshot.items())), 'bytes')
+
+
+def bench_payloads(iterations=10):
+    sensors, error_type = quiet(lambda: read_p1_meter(p1_test_readline()))
+    api = 'http://homeassistant.local:8123/api/states'
+    client = SinkClient()
+    templates = PayloadTemplates(api, 'token')
+
+    def dumps_cycle():
+        for sensor_id, sensor_data in sensors.items():
+            post_sensor(client.post, api, 'token', sensor_id, sensor_data)
+
+    def template_cycle():
+        for sensor_id, sensor_data in sensors.items():
+            post_sensor_request(client, templates, sensor_id, sensor_data)
+
+    template_cycle()  # templates are built on the first cycle
+    dumps_us, _ = run(dumps_cycle, iterations)
+    template_us, _ = run(template_cycle, iterations)
+    report('publish_dumps', dumps_us, 'us/cycle')
+    report('publish_templates', template_us, 'us/cycle')
+    report('memory_publish_dumps', allocated(dumps_cycle), 'bytes')
+    report('memory_publish_templates', allocated(template_cycle), 'bytes')
+
+
+def bench_pull_server(iterations=10):
+    sensors, error_type = quiet(lambda: read_p1_meter(p1_test_readline(), TelegramParser(snapshot=Snapshot())))
+    sink = NullWriter()
+    sink.sendall = sink.write
+
+    def dumps_document():
+        sink.sendall(json.dumps(snapshot_payload(sensors)).encode())
+
+    def render(render_func):
+        def render_document():
+            writer = BufferedWriter(sink)
+            render_func(writer.write, (sensors,))
+            writer.flush()
+        return render_document
+
+    dumps_us, _ = run(dumps_document, iterations)
+    json_us, _ = run(render(render_json), iterations)
+    prometheus_us, _ = run(render(render_prometheus), iterations)
+    report('pull_dumps', dumps_us, 'us/scrape')
+    report('pull_json', json_us, 'us/scrape')
+    report('pull_prometheus', prometheus_us, 'us/scrape')
+    report('memory_pull_dumps', allocated(dumps_document), 'bytes')
+    report('memory_pull_json', allocated(render(render_json)), 'bytes')
+    report('memory_pull_prometheus', allocated(render(render_prometheus)), 'bytes')
+
+
+def synthetic_telegram(phases=3, mbus_channels=0):
+    """DSMR 5 style telegram lines with a valid CRC, for 1 or 3 phases and up to 4 M-Bus channels"""
+    lines = [
+        '/ISK5\\2M550T-1012\r\n',
+        '\r\n',
+        '1-3:0.2.8(50)\r\n',
+        '0-0:1.0.0(241030120019W)\r\n',
+        '0-0:96.1.1(4B384547303034303436333935353037)\r\n',
+        '1-0:1.8.1(00021370.512*kWh)\r\n',
+        '1-0:1.8.2(00021370.616*kWh)\r\n',
+        '1-0:2.8.1(00000000.001*kWh)\r\n',
+        '1-0:2.8.2(00000000.000*kWh)\r\n',
+        '0-0:96.14.0(0002)\r\n',
+        '1-0:1.7.0(0000.268*kW)\r\n',
+        '1-0:2.7.0(0000.000*kW)\r\n',
+        '0-0:96.7.21(00010)\r\n',
+        '0-0:96.7.9(00003)\r\n',
+        '1-0:99.97.0(2)(0-0:96.7.19)(101208152415W)(0000000240*s)(101208151004W)(0000000301*s)\r\n',
+    ]
+    for phase in range(phases):
+        offset = 20 * phase
+        lines += [
+            f'1-0:{32 + offset}.32.0(00002)\r\n',
+            f'1-0:{32 + offset}.36.0(00001)\r\n',
+            f'1-0:{32 + offset}.7.0(228.9*V)\r\n',
+            f'1-0:{31 + offset}.7.0(001.0*A)\r\n',
+            f'1-0:{21 + offset}.7.0(0000.200*kW)\r\n',
+            f'1-0:{22 + offset}.7.0(0000.000*kW)\r\n',
+        ]
+    for channel in range(1, mbus_channels + 1):
+        lines += [
+            f'0-{channel}:24.1.0(003)\r\n',
+            f'0-{channel}:96.1.0(3232323241424344313233343536373{channel})\r\n',
+            f'0-{channel}:24.2.1(241030120000W)(12785.123*m3)\r\n',
+        ]
+    crc = calculate_crc(0, (''.join(lines) + '!').encode('utf-8'))
+    return lines + [f'!{crc:04X}\r\n']
+
+
+SYNTHETIC_TELEGRAMS = (
+    ('1-phase', synthetic_telegram(1)),
+    ('3-phase', synthetic_telegram(3)),
+    ('3-phase+4-mbus', synthetic_telegram(3, 4)),
+)
+
+
+def bench_hot_paths(iterations=50):
+    """calculate_crc, parse_line, obis_to_description, read_p1_meter and payloads per synthetic telegram"""
+    for name, telegram in SYNTHETIC_TELEGRAMS:
+        encoded = [line.encode('utf-8') for line in telegram]
+        data_lines = [line.strip() for line in telegram if line[:1].isdigit()]
+        codes = [parse_line(line)[0] for line in data_lines]
+        size = {"lines": len(telegram), "bytes": sum(len(line) for line in encoded)}
+
+        sensors, error_type = quiet(lambda: read_p1_meter(p1_test_readline(telegram)))
+        assert error_type is None, error_type
+
+        def payloads():
+            return [json.dumps(sensor_payload(sensor_data)) for sensor_data in sensors.values()]
+
+        crc_us, _ = run(lambda: telegram_crc(calculate_crc, encoded), iterations)
+        parse_us, _ = run(lambda: parse_lines(parse_line, data_lines), iterations)
+        describe_us, _ = run(lambda: parse_lines(obis_to_description, codes), iterations)
+        read_us, _ = quiet(lambda: run(lambda: read_p1_meter(p1_test_readline(telegram)), iterations))
+        payload_us, _ = run(payloads, iterations)
+        report('calculate_crc', crc_us, 'us/telegram', name, **size)
+        report('parse_line', parse_us, 'us/telegram', name, **size)
+        report('obis_to_description', describe_us, 'us/telegram', name, **size)
+        report('read_p1_meter', read_us, 'us/telegram', name, **size)
+        report('payloads', payload_us, 'us/telegram', name, sensors=len(sensors), **size)
+
+
+# read_p1_meter with the debug line per UART line printed, only kept in the
+# ring buffer, and filtered out by the level. Printing goes to a NullWriter on
+# CPython, on the board it also pays for the REPL output.
+LOG_SETTINGS = (
+    ('log_print', DEBUG, True),
+    ('log_buffer', DEBUG, False),
+    ('log_off', WARNING, False),
+)
+
+
+def bench_logging(iterations=50):
+    for name, telegram in SYNTHETIC_TELEGRAMS:
+        for setting, level, echo in LOG_SETTINGS:
+            logger.configure(level, 32, 0, echo)
+            read_us, _ = quiet(lambda: run(lambda: read_p1_meter(p1_test_readline(telegram)), iterations))
+            report(f'read_p1_meter_{setting}', read_us, 'us/telegram', name, lines=len(telegram))
+    logger.configure(DEBUG, 32, 0, True)
+
+
+def load_results(path):
+    with open(path) as f:
+        return {(result["bench"], result["telegram"]): result for result in map(json.loads, f) if result}
+
+
+def compare(old_path, new_path, threshold=0.1):
+    """Print the change per benchmark, returns False when one got worse by more than threshold"""
+    old = load_results(old_path)
+    new = load_results(new_path)
+    ok = True
+    for key, result in new.items():
+        if key not in old or not old[key]["value"]:
+            continue
+        change = result["value"] / old[key]["value"] - 1
+        regressed = change > threshold
+        ok = ok and not regressed
+        name = f'{key[0]} [{key[1]}]' if key[1] else key[0]
+        print(f'{name:<34} {old[key]["value"]:>10.1f} -> {result["value"]:>10.1f} {result["unit"]} '
+              f'{100 * change:+.0f}%{"  REGRESSION" if regressed else ""}')
+    return ok
+
+
+if __name__ == '__main__':
+    if '--compare' in sys.argv:
+        paths = sys.argv[sys.argv.index('--compare') + 1:]
+        threshold = float(sys.argv[sys.argv.index('--threshold') + 1]) if '--threshold' in sys.argv else 0.1
+        sys.exit(0 if compare(paths[0], paths[1], threshold) else 1)
+    bench_hot_paths()
+    bench_crc()
+    bench_parse_line()
+    bench_ingestion()
+    bench_scheduler()
+    bench_snapshot()
+    bench_payloads()
+    bench_pull_server()
+    bench_logging()
@@ -0,0 +1,70 @@
+"""Precompile the device modules to .mpy bytecode for a faster boot.
+
+MicroPython compiles every imported .py file to bytecode on the device at
+every reset. The .mpy files written to build/ are loaded as they are. The
+loop in main.py moves to p1meter_app.mpy and build/main.py only imports it,
+because MicroPython runs main.py from source. config.py stays source so it
+can be edited on the device. Copy the contents of build/ to the board, e.g.
+
+    python3 build.py && mpremote cp -r build/ :
+
+mpy-cross must match the MicroPython version of the firmware, e.g. pip
+install mpy-cross==1.22.2 for v1.22.2. For firmware with the modules frozen
+into flash see manifest.py.
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Everything main.py may import, the host-only tools and tests are left out
+DEVICE_MODULES = ('aggregate', 'compat', 'delta', 'dual_core', 'http_client', 'instrument', 'log', 'meters', 'mqtt',
+                  'obis_codes', 'p1meter', 'pio_uart', 'publish', 'pull_server', 'ring_log', 'runtime', 'scheduler',
+                  'snapshot', 'thin', 'uart_reader', 'wifi')
+APP_MODULE = 'p1meter_app'
+MAIN_STUB = f'import {APP_MODULE}\n'
+
+
+def find_mpy_cross():
+    """The mpy-cross command line, from the mpy-cross package or the PATH"""
+    try:
+        import mpy_cross
+        return [sys.executable, '-m', 'mpy_cross']
+    except ImportError:
+        pass
+    path = shutil.which('mpy-cross')
+    if path is None:
+        sys.exit("mpy-cross not found, install it with pip install mpy-cross==<firmware version>")
+    return [path]
+
+
+def compile_module(mpy_cross, source, target, march):
+    subprocess.run(mpy_cross + ['-march=' + march, '-o', target, source], check=True)
+
+
+def build(out_dir, march='armv6m'):
+    mpy_cross = find_mpy_cross()
+    os.makedirs(out_dir, exist_ok=True)
+    for module in DEVICE_MODULES:
+        compile_module(mpy_cross, os.path.join(HERE, module + '.py'), os.path.join(out_dir, module + '.mpy'), march)
+    compile_module(mpy_cross, os.path.join(HERE, 'main.py'), os.path.join(out_dir, APP_MODULE + '.mpy'), march)
+    with open(os.path.join(out_dir, 'main.py'), 'w') as f:
+        f.write(MAIN_STUB)
+    shutil.copy(os.path.join(HERE, 'config.py'), out_dir)
+    return sorted(os.listdir(out_dir))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--out', default=os.path.join(HERE, 'build'))
+    parser.add_argument('--march', default='armv6m', help='armv6m for the RP2040 of the Pico W')
+    args = parser.parse_args()
+    for name in build(args.out, args.march):
+        print(name)
+
+
+if __name__ == '__main__':
+    main()
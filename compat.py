@@ -0,0 +1,23 @@
+import time
+
+# MicroPython tick functions, emulated with monotonic time on CPython
+try:
+    ticks_ms = time.ticks_ms
+    ticks_us = time.ticks_us
+    ticks_diff = time.ticks_diff
+except AttributeError:
+    def ticks_ms():
+        return time.monotonic_ns() // 1000000
+
+    def ticks_us():
+        return time.monotonic_ns() // 1000
+
+    def ticks_diff(end, start):
+        return end - start
+
+# Compile time constants on MicroPython, plain values on CPython
+try:
+    from micropython import const
+except ImportError:
+    def const(value):
+        return value
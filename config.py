@@ -1,5 +1,133 @@
 WIFI_SSID = ''
 WIFI_PASSWORD = ''
 
+# Reconnect WiFi with a state machine polled from the main loop, backing off
+# exponentially between attempts, instead of blocking for up to 10 s per
+# attempt. Telegrams keep being read and readings that cannot be published
+# go to the offline log meanwhile.
+WIFI_NONBLOCKING = False
+
 HOME_ASSISTANT_SENSOR_API = ''
 HOME_ASSISTANT_ACCESS_TOKEN = ''
+
+# 'sensor' posts every sensor to HOME_ASSISTANT_SENSOR_API/<sensor_id>,
+# 'bulk' posts the whole snapshot in one request to HOME_ASSISTANT_BULK_API
+# (e.g. a Home Assistant webhook, http://<host>:8123/api/webhook/<webhook_id>)
+# and falls back to 'sensor' when the bulk endpoint rejects the request,
+# 'mqtt' publishes retained states with Home Assistant discovery to
+# MQTT_BROKER, on one JSON state topic when MQTT_BATCHED is set. MQTT_CLIENT_ID
+# is the client id, base topic and Home Assistant device of this board and
+# must differ between boards on one broker, by default p1meter_<unique id>
+PUBLISH_MODE = 'sensor'
+HOME_ASSISTANT_BULK_API = ''
+MQTT_BROKER = ''
+MQTT_PORT = 1883
+MQTT_USER = ''
+MQTT_PASSWORD = ''
+MQTT_BATCHED = False
+MQTT_CLIENT_ID = ''
+
+# Reuse one HTTP/1.1 connection for all requests instead of a new one per sensor
+# with urequests. https certificates are checked as urequests checks them.
+HTTP_KEEP_ALIVE = False
+
+# Serialise the request headers and sensor attributes once per sensor and only
+# splice in the state at publish time (requires HTTP_KEEP_ALIVE)
+PAYLOAD_TEMPLATES = False
+
+# Only publish sensors whose state moved beyond the deadband in OBIS_TABLE,
+# with a full refresh of every sensor each FULL_REFRESH_CYCLES publish cycles
+PUBLISH_CHANGES_ONLY = False
+FULL_REFRESH_CYCLES = 10
+
+# 'sync' reads and publishes in one loop, 'async' runs the UART reader,
+# publisher, watchdog and LED as separate asyncio tasks so telegrams keep
+# being read while a publish cycle is in progress, 'dual_core' reads and
+# parses telegrams on the second RP2040 core and publishes from the first
+RUNTIME = 'sync'
+
+# Read the UART with readinto into a preallocated buffer instead of readline
+# (sync runtime only)
+UART_READINTO = False
+
+# Publish every PUBLISH_INTERVAL_MS. In the sync runtime the interval halves
+# down to PUBLISH_INTERVAL_MIN_MS while the instantaneous power moves more
+# than POWER_SWING_KW away from the last published value, and doubles back
+# while it is steady. SKIP_PARSE_BETWEEN_PUBLISHES only CRC checks telegrams
+# read between publishes and tokenises just the instantaneous power, when the
+# telegram due for a publish fails the publish waits for the next telegram.
+PUBLISH_INTERVAL_MS = 60000
+PUBLISH_INTERVAL_MIN_MS = 60000
+POWER_SWING_KW = 0.5
+SKIP_PARSE_BETWEEN_PUBLISHES = False
+
+# Publish <sensor>_min, _max and _mean over every telegram of the publish
+# window for the power, voltage and current codes
+AGGREGATE_MEASUREMENTS = False
+
+# Keep the latest telegram in fixed slots with the numbers as scaled integers
+# instead of building a new dict of strings per telegram (sync and async
+# runtimes)
+COMPACT_SNAPSHOT = False
+
+# Store the cumulative registers of every cycle that failed to publish in a
+# ring log on flash holding OFFLINE_LOG_CAPACITY cycles, and forward them in
+# batches once publishing works again, at most OFFLINE_BACKFILL_BATCHES
+# batches per cycle. Readings go to the MQTT backfill topic in mqtt mode and
+# are posted to OFFLINE_BACKFILL_API (e.g. a Home Assistant webhook) otherwise.
+# Readings taken before the clock was set from NTP have a null timestamp.
+OFFLINE_LOG = False
+OFFLINE_LOG_CAPACITY = 1440
+OFFLINE_BACKFILL_API = ''
+OFFLINE_BACKFILL_BATCHES = 4
+
+# Publish max and mean durations of telegram reads, CRC, parsing, HTTP posts
+# and WiFi reconnects plus the heap watermarks per publish window, and the
+# time from reset to the main loop, the first telegram and the first publish,
+# as sensor.smartmeter_* sensors
+INSTRUMENTATION = False
+
+# Serve the latest readings and the status sensors on PULL_SERVER_PORT for
+# scraping, as JSON on / and in the Prometheus text format on /metrics. The
+# server is polled between telegrams so scrapes never hold up the UART.
+PULL_SERVER = False
+PULL_SERVER_PORT = 80
+
+# Read several P1 ports, e.g. a main meter and sub-meters, and publish their
+# sensors together. Every meter has its own sensor id prefix, sensor.<prefix>_*,
+# and an optional name in front of the friendly names. 'uart' is hardware
+# UART 0 or 1 with its tx and rx pins, 'pio' a PIO state machine 0-7 with an
+# rx pin for more ports. The meters are polled from one loop in place of
+# RUNTIME. Aggregates and the offline log are kept per meter, the offline log
+# of a meter other than dsmr in offline_<prefix>.log. Empty reads the single
+# meter on UART 1.
+#
+# METERS = [
+#     {'prefix': 'dsmr', 'uart': 1, 'tx': 4, 'rx': 5},
+#     {'prefix': 'heat_pump', 'name': 'Heat pump', 'uart': 0, 'tx': 0, 'rx': 1},
+#     {'prefix': 'garage', 'name': 'Garage', 'pio': 0, 'rx': 6},
+# ]
+METERS = []
+
+# Thin device mode: only frame and CRC check the telegrams and send them raw
+# to the gateway (gateway.py) at GATEWAY, 'host:port', over GATEWAY_PROTOCOL
+# 'tcp' or 'udp'. The gateway parses and publishes for many devices, the
+# sensors of this one as sensor.<GATEWAY_DEVICE_ID>_*, by default the board's
+# unique id in hex.
+GATEWAY = ''
+GATEWAY_PROTOCOL = 'tcp'
+GATEWAY_DEVICE_ID = ''
+
+# Log messages at LOG_LEVEL 'debug', 'info', 'warning' or 'error' and above.
+# 'debug' logs every UART line, which fills the buffer with telegram lines
+# and with USB attached costs much of the time per telegram when LOG_PRINT
+# echoes it to the REPL, keep it for troubleshooting. Every category,
+# e.g. 'p1' or 'wifi', logs at most LOG_RATE_LIMIT messages per minute, 0
+# for no limit. The last LOG_BUFFER_LINES messages are kept in RAM and served
+# on /log by the pull server. LOG_SENSORS publishes the number of warnings
+# and the last one as sensor.smartmeter_log_* sensors.
+LOG_LEVEL = 'info'
+LOG_PRINT = False
+LOG_RATE_LIMIT = 0
+LOG_BUFFER_LINES = 32
+LOG_SENSORS = False
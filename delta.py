@@ -0,0 +1,51 @@
+from obis_codes import deadbands
+from publish import sensor_state
+
+
+def is_significant(previous, state, deadband=0, deadband_relative=0):
+    """True if state moved more than the deadband away from the previously published state"""
+    if previous is None:
+        return True
+    if previous == state:
+        return False
+    try:
+        previous_value = float(previous)
+        value = float(state)
+    except (TypeError, ValueError):
+        return True  # non numeric states are published on every change
+    threshold = max(deadband, deadband_relative * abs(previous_value))
+    return abs(value - previous_value) > threshold
+
+
+class DeltaPublisher:
+    """Remembers the last published state per sensor and filters out unchanged sensors.
+
+    Every full_refresh_cycles cycles all sensors are published regardless of
+    their state so Home Assistant recovers from lost updates and restarts.
+    """
+
+    def __init__(self, full_refresh_cycles):
+        self.full_refresh_cycles = full_refresh_cycles
+        self.cycle = 0
+        self.published = {}
+
+    def changed(self, sensors):
+        """Sensors to publish this cycle, with their states resolved"""
+        full_refresh = self.cycle % self.full_refresh_cycles == 0
+        self.cycle += 1
+
+        changes = {}
+        for sensor_id, sensor_data in sensors.items():
+            state = sensor_state(sensor_data)
+            attributes = sensor_data["attributes"]
+            if not full_refresh:
+                deadband, deadband_relative = deadbands(attributes.get("obis_code"))
+                if not is_significant(self.published.get(sensor_id), state, deadband, deadband_relative):
+                    continue
+            changes[sensor_id] = {"state": state, "attributes": attributes}
+        return changes
+
+    def commit(self, sensors):
+        """Record sensors returned by changed() as published"""
+        for sensor_id, sensor_data in sensors.items():
+            self.published[sensor_id] = sensor_data["state"]
@@ -0,0 +1,67 @@
+import unittest
+from delta import DeltaPublisher, is_significant
+
+
+def power(state):
+    return {
+        "state": state,
+        "attributes": {"unit_of_measurement": "kW", "friendly_name": "Current Power L1", "obis_code": "1-0:21.7.0"}
+    }
+
+
+def counter(state):
+    return {
+        "state": lambda: state,
+        "attributes": {"unit_of_measurement": "", "friendly_name": "P1 CRC errors"}
+    }
+
+
+class DeltaTest(unittest.TestCase):
+
+    def test_is_significant(self):
+        self.assertTrue(is_significant(None, '1.0'))
+        self.assertFalse(is_significant('1.0', '1.0'))
+        self.assertTrue(is_significant('1.0', '1.1'))
+        self.assertFalse(is_significant('1.0', '1.1', deadband=0.2))
+        self.assertTrue(is_significant('1.0', '1.3', deadband=0.2))
+        self.assertFalse(is_significant('100.0', '104.0', deadband_relative=0.05))
+        self.assertTrue(is_significant('100.0', '106.0', deadband_relative=0.05))
+        self.assertTrue(is_significant('241030120019W', '241030120020W', deadband=1))
+
+    def test_only_changes_published(self):
+        delta = DeltaPublisher(full_refresh_cycles=10)
+        sensors = {'sensor.dsmr_current_power_l1': power('0000.200'), 'sensor.smartmeter_p1_crc_errors': counter('0')}
+
+        changes = delta.changed(sensors)
+        self.assertEqual(len(changes), 2)
+        self.assertEqual(changes['sensor.smartmeter_p1_crc_errors']['state'], '0')
+        delta.commit(changes)
+
+        sensors = {'sensor.dsmr_current_power_l1': power('0000.203'), 'sensor.smartmeter_p1_crc_errors': counter('1')}
+        changes = delta.changed(sensors)
+        self.assertEqual(list(changes.keys()), ['sensor.smartmeter_p1_crc_errors'])
+        delta.commit(changes)
+
+        # deadband is measured against the last published value, not the last seen one
+        sensors = {'sensor.dsmr_current_power_l1': power('0000.206'), 'sensor.smartmeter_p1_crc_errors': counter('1')}
+        changes = delta.changed(sensors)
+        self.assertEqual(list(changes.keys()), ['sensor.dsmr_current_power_l1'])
+
+    def test_uncommitted_changes_are_retried(self):
+        delta = DeltaPublisher(full_refresh_cycles=10)
+        delta.changed({'sensor.dsmr_current_power_l1': power('0000.200')})
+        self.assertEqual(len(delta.changed({'sensor.dsmr_current_power_l1': power('0000.200')})), 1)
+
+    def test_full_refresh(self):
+        delta = DeltaPublisher(full_refresh_cycles=3)
+        sensors = {'sensor.dsmr_current_power_l1': power('0000.200')}
+        published = []
+        for cycle in range(7):
+            changes = delta.changed(sensors)
+            delta.commit(changes)
+            published.append(len(changes))
+        self.assertEqual(published, [1, 0, 0, 1, 0, 0, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
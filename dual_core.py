@@ -0,0 +1,132 @@
+import _thread
+
+from compat import ticks_ms, ticks_us, ticks_diff
+from p1meter import TelegramParser
+
+# Distinct reader exceptions kept until taken, further ones are dropped
+MAX_EXCEPTIONS = 8
+
+
+class BusyMeter:
+    """Share of wall clock time spent between begin() and end() since the last reset()"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.window_start = ticks_us()
+        self.busy_us = 0
+        self.started = None
+
+    def begin(self):
+        self.started = ticks_us()
+
+    def end(self):
+        if self.started is not None:
+            self.busy_us += ticks_diff(ticks_us(), self.started)
+            self.started = None
+
+    def percent(self):
+        elapsed = ticks_diff(ticks_us(), self.window_start)
+        return 100 * self.busy_us / elapsed if elapsed > 0 else 0
+
+
+class TelegramHandoff:
+    """Lock protected double buffer passing telegrams from the reader core to the publisher core.
+
+    The reader builds each telegram in a dict of its own and only swaps the
+    reference in under the lock, so the publisher keeps a consistent telegram
+    while the next one is being parsed. Read errors and reader exceptions are
+    counted until taken. The reader's BusyMeter is only touched under the
+    lock, as both cores update it.
+    """
+
+    def __init__(self):
+        self.lock = _thread.allocate_lock()
+        self.telegram = None
+        self.errors = {}
+        self.exceptions = {}
+        self.heartbeat = ticks_ms()
+        self.running = True
+        self.reader_busy = BusyMeter()
+
+    def put(self, data, error_type):
+        with self.lock:
+            if error_type is None:
+                self.telegram = data
+            else:
+                self.errors[error_type] = self.errors.get(error_type, 0) + 1
+            self.heartbeat = ticks_ms()
+
+    def failed(self, e):
+        """Count an exception raised on the reader core"""
+        key = repr(e)
+        with self.lock:
+            if key in self.exceptions:
+                self.exceptions[key][1] += 1
+            elif len(self.exceptions) < MAX_EXCEPTIONS:
+                self.exceptions[key] = [e, 1]
+
+    def take_exceptions(self):
+        """Returns the (exception, count) pairs of the reader since the last call"""
+        with self.lock:
+            exceptions = self.exceptions
+            self.exceptions = {}
+        return exceptions.values()
+
+    def reader_begin(self):
+        with self.lock:
+            self.reader_busy.begin()
+
+    def reader_end(self):
+        with self.lock:
+            self.reader_busy.end()
+
+    def reader_percent(self):
+        with self.lock:
+            return self.reader_busy.percent()
+
+    def reset_reader_busy(self):
+        with self.lock:
+            self.reader_busy.reset()
+
+    def take(self):
+        """Returns the latest telegram or None, and the read errors counted since the last take"""
+        with self.lock:
+            telegram, errors = self.telegram, self.errors
+            self.telegram = None
+            self.errors = {}
+        return telegram, errors
+
+    def reader_alive(self, max_age_ms):
+        return ticks_diff(ticks_ms(), self.heartbeat) < max_age_ms
+
+
+def read_loop(readline, handoff, parser=None):
+    """Reader running on the second core until handoff.running is cleared"""
+    parser = parser or TelegramParser()
+    while handoff.running:
+        try:
+            uart_line = readline()  # waiting for the UART does not count as busy
+            handoff.heartbeat = ticks_ms()
+            if uart_line is None:
+                parser.reset()
+                handoff.put(None, "timeout")
+                continue
+
+            handoff.reader_begin()
+            try:
+                result = parser.feed(uart_line)
+            finally:
+                handoff.reader_end()
+            if result:
+                handoff.put(*result)
+        except Exception as e:
+            # Counted by the publisher on core 0, the reader carries on with the next line
+            handoff.failed(e)
+            parser.reset()
+
+
+def start_reader(readline, handoff):
+    """Start read_loop on core 1 (a thread on CPython)"""
+    _thread.start_new_thread(read_loop, (readline, handoff))
@@ -0,0 +1,98 @@
+import time
+import unittest
+
+from dual_core import BusyMeter, TelegramHandoff, start_reader
+from p1meter_test import meter_sample, p1_test_readline
+
+
+def telegram_readline(telegrams, corrupt=()):
+    """readline returning the given number of telegrams, then None"""
+    sample = []
+    for i in range(telegrams):
+        lines = list(meter_sample)
+        if i in corrupt:
+            lines[-1] = '!0000\r\n'
+        sample += lines
+    return p1_test_readline(sample)
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            return False
+        time.sleep(0.001)
+    return True
+
+
+class DualCoreTest(unittest.TestCase):
+
+    def test_handoff_keeps_latest(self):
+        handoff = TelegramHandoff()
+        handoff.put({'a': 1}, None)
+        handoff.put(None, "crc")
+        handoff.put({'a': 2}, None)
+        handoff.put(None, "crc")
+        handoff.put(None, "timeout")
+        telegram, errors = handoff.take()
+        self.assertEqual(telegram, {'a': 2})
+        self.assertEqual(errors, {"crc": 2, "timeout": 1})
+        self.assertEqual(handoff.take(), (None, {}))
+
+    def test_reader_thread(self):
+        handoff = TelegramHandoff()
+        start_reader(telegram_readline(5, corrupt=(1, 3)), handoff)
+
+        received = []
+        errors = {}
+
+        def done():
+            telegram, new_errors = handoff.take()
+            if telegram is not None:
+                received.append(telegram)
+            for error_type, count in new_errors.items():
+                errors[error_type] = errors.get(error_type, 0) + count
+            return errors.get("timeout", 0) > 0
+
+        self.assertTrue(wait_for(done))
+        handoff.running = False
+        self.assertEqual(errors["crc"], 2)
+        self.assertGreaterEqual(len(received), 1)
+        self.assertEqual(len(received[-1]), 27)
+        self.assertTrue(handoff.reader_alive(1000))
+
+    def test_reader_survives_exceptions(self):
+        lines = telegram_readline(2)
+        calls = []
+
+        def readline():
+            calls.append(1)
+            if len(calls) in (3, 4):
+                raise OSError(5)
+            return lines()
+
+        handoff = TelegramHandoff()
+        start_reader(readline, handoff)
+        self.assertTrue(wait_for(lambda: handoff.take()[1].get("timeout")))
+        handoff.running = False
+        exceptions = list(handoff.take_exceptions())
+        self.assertEqual(len(exceptions), 1)
+        e, count = exceptions[0]
+        self.assertTrue(isinstance(e, OSError))
+        self.assertEqual(count, 2)
+        self.assertEqual(list(handoff.take_exceptions()), [])
+
+    def test_busy_meter(self):
+        meter = BusyMeter()
+        meter.begin()
+        time.sleep(0.02)
+        meter.end()
+        time.sleep(0.02)
+        self.assertGreaterEqual(meter.percent(), 30)
+        self.assertLessEqual(meter.percent(), 70)
+        meter.reset()
+        self.assertEqual(meter.busy_us, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
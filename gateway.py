@@ -0,0 +1,247 @@
+"""Gateway parsing the raw telegrams of many thin devices on a host and publishing them to Home Assistant.
+
+Devices with GATEWAY set only frame and CRC check their telegrams and send
+them here over TCP or UDP (see thin.py). The asyncio server collects the
+frames of all devices into batches that a process pool parses with the
+p1meter parser, every device with sensor ids sensor.<device id>_*. Every
+publish interval the latest sensors of the devices that sent a telegram
+are posted to the bulk endpoint, at most publish_batch sensors per request.
+
+    python3 gateway.py --api http://homeassistant.local:8123/api/webhook/p1meter --token TOKEN
+"""
+import argparse
+import asyncio
+import os
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from http_client import HttpClient
+from log import ERROR, logger
+from obis_codes import describer
+from p1meter import TelegramParser, read_p1_meter
+from publish import is_success, post_snapshot
+from thin import HEADER, HEADER_SIZE
+
+# Parser per device, kept in every worker process between batches
+parsers = {}
+
+
+def quiet_worker():
+    logger.configure(ERROR, 0, 0, False)  # the parser logs every line at debug level
+
+
+def device_prefix(device_id):
+    return ''.join(c if c.isalnum() else '_' for c in device_id.lower())
+
+
+def parse_batch(frames):
+    """[(device_id, telegram)] -> [(device_id, sensors, error_type)], run in the worker processes"""
+    results = []
+    for device_id, telegram in frames:
+        parser = parsers.get(device_id)
+        if parser is None:
+            parser = parsers[device_id] = TelegramParser(describe=describer(device_prefix(device_id)))
+        lines = iter(telegram.splitlines(True))
+        results.append((device_id,) + read_p1_meter(lambda: next(lines, None), parser))
+    return results
+
+
+class Gateway:
+    """Receives telegram frames from many devices, parses them in batches on a process pool and publishes.
+
+    publish(sensors) posts one batch of sensors and returns True on success,
+    it runs in a thread. on_result(device_id, sensors, error_type) is called
+    on the event loop for every parsed telegram.
+    """
+
+    def __init__(self, publish, workers=None, batch_size=64, batch_ms=20, publish_interval_s=60,
+                 publish_batch=500, on_result=None):
+        self.publish = publish
+        self.workers = workers or os.cpu_count()
+        self.batch_size = batch_size
+        self.batch_ms = batch_ms
+        self.publish_interval_s = publish_interval_s
+        self.publish_batch = publish_batch
+        self.on_result = on_result
+        self.queue = asyncio.Queue()
+        self.latest = {}
+        self.changed = set()
+        self.devices = {}
+        self.telegrams = 0
+        self.errors = {}
+        self.published = 0
+        self.publish_failures = 0
+        self.servers = []
+        self.tasks = []
+        self.streams = {}
+        self.pool = None
+
+    async def start(self, host='0.0.0.0', tcp_port=7010, udp_port=7010):
+        """Listen for devices, port 0 picks a free port, None disables the protocol"""
+        loop = asyncio.get_running_loop()
+        self.pool = ProcessPoolExecutor(self.workers, initializer=quiet_worker)
+        if tcp_port is not None:
+            server = await asyncio.start_server(self.handle_stream, host, tcp_port)
+            self.tcp_port = server.sockets[0].getsockname()[1]
+            self.servers.append(server)
+        if udp_port is not None:
+            transport, protocol = await loop.create_datagram_endpoint(lambda: DatagramReceiver(self),
+                                                                      local_addr=(host, udp_port))
+            self.udp_port = transport.get_extra_info('sockname')[1]
+            self.servers.append(transport)
+        self.tasks.append(asyncio.create_task(self.dispatch()))
+        self.tasks.append(asyncio.create_task(self.publish_periodically()))
+
+    async def stop(self):
+        for server in self.servers:
+            server.close()
+        for writer in self.streams.values():
+            writer.close()  # the handlers see the end of their stream
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, *self.streams, return_exceptions=True)
+        self.pool.shutdown()
+
+    def receive(self, frame):
+        id_length, telegram_length = struct.unpack_from(HEADER, frame)
+        if len(frame) != HEADER_SIZE + id_length + telegram_length:
+            self.count_error('frame')
+            return
+        device_id = frame[HEADER_SIZE:HEADER_SIZE + id_length].decode()
+        self.devices[device_id] = self.devices.get(device_id, 0) + 1
+        self.queue.put_nowait((device_id, bytes(frame[HEADER_SIZE + id_length:])))
+
+    async def handle_stream(self, reader, writer):
+        task = asyncio.current_task()
+        self.streams[task] = writer
+        try:
+            while True:
+                header = await reader.readexactly(HEADER_SIZE)
+                id_length, telegram_length = struct.unpack(HEADER, header)
+                self.receive(header + await reader.readexactly(id_length + telegram_length))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass  # the device went away, it reconnects
+        finally:
+            del self.streams[task]
+            writer.close()
+
+    async def dispatch(self):
+        """Hand the queued frames to the pool in batches, up to one batch per worker in flight"""
+        loop = asyncio.get_running_loop()
+        slots = asyncio.Semaphore(self.workers)
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.batch_ms / 1000
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await slots.acquire()
+            future = loop.run_in_executor(self.pool, parse_batch, batch)
+            future.add_done_callback(lambda f: self.parsed(f, slots))
+
+    def parsed(self, future, slots):
+        slots.release()
+        if future.cancelled():
+            return
+        if future.exception():
+            self.count_error(type(future.exception()).__name__)
+            return
+        for device_id, sensors, error_type in future.result():
+            if error_type is None:
+                self.telegrams += 1
+                self.latest[device_id] = sensors
+                self.changed.add(device_id)
+            else:
+                self.count_error(error_type)
+            if self.on_result:
+                self.on_result(device_id, sensors, error_type)
+
+    def count_error(self, error_type):
+        self.errors[error_type] = self.errors.get(error_type, 0) + 1
+
+    def batches(self):
+        """The latest sensors of the devices that sent a telegram since the last call, in publish batches"""
+        batch = {}
+        for device_id in self.changed:
+            for sensor_id, sensor_data in self.latest[device_id].items():
+                batch[sensor_id] = sensor_data
+                if len(batch) == self.publish_batch:
+                    yield batch
+                    batch = {}
+        self.changed = set()
+        if batch:
+            yield batch
+
+    async def publish_periodically(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.publish_interval_s)
+            for batch in list(self.batches()):
+                try:
+                    published = await loop.run_in_executor(None, self.publish, batch)
+                except Exception as e:
+                    print(f"Publish error: {e}")
+                    published = False
+                if published:
+                    self.published += len(batch)
+                else:
+                    self.publish_failures += 1
+
+
+class DatagramReceiver(asyncio.DatagramProtocol):
+
+    def __init__(self, gateway):
+        self.gateway = gateway
+
+    def datagram_received(self, data, address):
+        if len(data) < HEADER_SIZE:
+            self.gateway.count_error('frame')
+            return
+        self.gateway.receive(data)
+
+
+def bulk_publisher(api, access_token):
+    """publish() posting to the bulk endpoint over a kept-alive connection"""
+    client = HttpClient()
+
+    def publish(sensors):
+        status_code, text = post_snapshot(client.post, api, access_token, sensors)
+        if not is_success(status_code):
+            print(f"Bulk publish failed: {status_code} {text}")
+        return is_success(status_code)
+
+    return publish
+
+
+async def serve(args):
+    gateway = Gateway(bulk_publisher(args.api, args.token), args.workers, publish_interval_s=args.interval,
+                      publish_batch=args.publish_batch)
+    await gateway.start(args.host, args.tcp_port, args.udp_port)
+    print(f"Listening on {args.host} tcp {args.tcp_port} udp {args.udp_port}")
+    while True:
+        await asyncio.sleep(args.interval)
+        print(f"{time.strftime('%H:%M:%S')} devices {len(gateway.devices)} telegrams {gateway.telegrams} "
+              f"errors {gateway.errors} published {gateway.published} failed batches {gateway.publish_failures}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--api', required=True, help='Home Assistant bulk endpoint, e.g. a webhook')
+    parser.add_argument('--token', default='', help='Home Assistant access token')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--tcp-port', type=int, default=7010)
+    parser.add_argument('--udp-port', type=int, default=7010)
+    parser.add_argument('--workers', type=int, default=None, help='parser processes, one per CPU by default')
+    parser.add_argument('--interval', type=float, default=60, help='seconds between publishes')
+    parser.add_argument('--publish-batch', type=int, default=500, help='sensors per request')
+    asyncio.run(serve(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
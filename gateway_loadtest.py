@@ -0,0 +1,111 @@
+"""Load test of the gateway with hundreds of simulated thin devices on localhost.
+
+Every device opens its own TCP connection, or sends UDP datagrams, and
+sends the sample telegram every period seconds starting at a random phase.
+Latency is measured from handing a frame to the socket until its parsed
+telegram is back on the gateway's event loop. Devices and gateway share the
+event loop, the parsing runs on the gateway's process pool. Publishing only
+counts the sensors, unless --api is given.
+
+    python3 gateway_loadtest.py --devices 500 --period 1 --seconds 20
+"""
+import argparse
+import asyncio
+import json
+import random
+import struct
+from collections import deque
+
+from gateway import Gateway, bulk_publisher
+from harness import percentile
+from p1meter_test import meter_sample
+from thin import HEADER
+
+TELEGRAM = ''.join(meter_sample).encode()
+
+
+def frame(device_id, telegram=TELEGRAM):
+    device_id = device_id.encode()
+    return struct.pack(HEADER, len(device_id), len(telegram)) + device_id + telegram
+
+
+class DatagramSender(asyncio.DatagramProtocol):
+    pass
+
+
+async def device(index, gateway, protocol, period_s, duration_s, sent_at, counts):
+    device_id = f'loadtest_{index:04}'
+    data = frame(device_id)
+    loop = asyncio.get_running_loop()
+    if protocol == 'udp':
+        transport, _ = await loop.create_datagram_endpoint(DatagramSender, remote_addr=('127.0.0.1', gateway.udp_port))
+        send = transport.sendto
+    else:
+        reader, writer = await asyncio.open_connection('127.0.0.1', gateway.tcp_port)
+        send = writer.write
+    end = loop.time() + duration_s
+    await asyncio.sleep(random.random() * period_s)
+    next_send = loop.time()
+    while next_send < end:
+        sent_at.setdefault(device_id, deque()).append(loop.time())
+        send(data)
+        counts['sent'] += 1
+        next_send += period_s
+        await asyncio.sleep(max(0, next_send - loop.time()))
+    if protocol == 'udp':
+        transport.close()
+    else:
+        await writer.drain()
+        writer.close()
+
+
+async def load_test(devices, period_s, duration_s, protocol='tcp', workers=None, publish=None, interval_s=5):
+    loop = asyncio.get_running_loop()
+    sent_at = {}
+    latencies = []
+    counts = {'sent': 0}
+
+    def on_result(device_id, sensors, error_type):
+        latencies.append(1000 * (loop.time() - sent_at[device_id].popleft()))
+
+    gateway = Gateway(publish or (lambda sensors: True), workers, publish_interval_s=interval_s, on_result=on_result)
+    await gateway.start('127.0.0.1', 0, 0)
+    start = loop.time()
+    await asyncio.gather(*(device(i, gateway, protocol, period_s, duration_s, sent_at, counts)
+                           for i in range(devices)))
+    while gateway.telegrams + sum(gateway.errors.values()) < counts['sent'] and loop.time() - start < duration_s + 10:
+        await asyncio.sleep(0.05)  # let the last batches finish
+    elapsed = loop.time() - start
+    await gateway.stop()
+    return {
+        "devices": devices,
+        "protocol": protocol,
+        "workers": gateway.workers,
+        "seconds": round(elapsed, 1),
+        "telegrams_sent": counts['sent'],
+        "telegrams_parsed": gateway.telegrams,
+        "telegrams_per_s": round(gateway.telegrams / elapsed, 1),
+        "latency_ms": {"p50": round(percentile(latencies, 0.5), 1), "p99": round(percentile(latencies, 0.99), 1),
+                       "max": round(max(latencies), 1)} if latencies else None,
+        "errors": gateway.errors,
+        "sensors_published": gateway.published,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--devices', type=int, default=200)
+    parser.add_argument('--period', type=float, default=1.0, help='seconds between telegrams per device')
+    parser.add_argument('--seconds', type=float, default=10.0, help='how long the devices send')
+    parser.add_argument('--protocol', choices=('tcp', 'udp'), default='tcp')
+    parser.add_argument('--workers', type=int, default=None, help='parser processes, one per CPU by default')
+    parser.add_argument('--api', help='bulk endpoint to publish to instead of counting')
+    parser.add_argument('--token', default='')
+    args = parser.parse_args()
+    publish = bulk_publisher(args.api, args.token) if args.api else None
+    report = asyncio.run(load_test(args.devices, args.period, args.seconds, args.protocol, args.workers, publish))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+import asyncio
+import threading
+import unittest
+
+from gateway import Gateway, device_prefix, parse_batch
+from gateway_loadtest import load_test
+from harness import simulate
+from p1meter_test import meter_sample
+
+telegram = ''.join(meter_sample).encode('utf-8')
+
+
+class ParseBatchTest(unittest.TestCase):
+
+    def test_devices_get_their_own_sensor_ids(self):
+        crc_error = telegram.replace(b'!F5D8', b'!0000')
+        results = parse_batch([('meter-1', telegram), ('meter_2', telegram), ('meter-1', crc_error)])
+        self.assertEqual([(device_id, error_type) for device_id, sensors, error_type in results],
+                         [('meter-1', None), ('meter_2', None), ('meter-1', 'crc')])
+        self.assertEqual(results[0][1]['sensor.meter_1_total_energy_import']['state'], '00042741.128')
+        self.assertTrue('sensor.meter_2_total_energy_import' in results[1][1])
+
+    def test_device_prefix(self):
+        self.assertEqual(device_prefix('E6614C30-0B2A'), 'e6614c30_0b2a')
+
+
+class GatewayTest(unittest.TestCase):
+
+    def test_load(self):
+        for protocol in ('tcp', 'udp'):
+            report = asyncio.run(load_test(20, 0.2, 1, protocol, workers=2, interval_s=0.5))
+            self.assertEqual(report["telegrams_parsed"], report["telegrams_sent"])
+            self.assertTrue(report["telegrams_sent"] >= 20 * 4)
+            self.assertEqual(report["errors"], {})
+            self.assertTrue(report["latency_ms"]["p99"] > 0)
+
+    def test_publishes_latest_in_batches(self):
+        batches = []
+
+        async def run():
+            gateway = Gateway(lambda sensors: batches.append(sensors) or True, workers=1, publish_batch=40)
+            await gateway.start('127.0.0.1', None, None)
+            for device_id in ('a', 'b', 'c'):
+                for _ in range(2):
+                    gateway.receive(b'\x00\x01' + len(telegram).to_bytes(2, 'big') + device_id.encode() + telegram)
+            while gateway.telegrams < 6:
+                await asyncio.sleep(0.01)
+            published = list(gateway.batches())
+            self.assertEqual(list(gateway.batches()), [])  # nothing new since
+            await gateway.stop()
+            return published
+
+        published = asyncio.run(run())
+        self.assertEqual([len(batch) for batch in published], [40, 40, 1])
+        sensors = {sensor_id for batch in published for sensor_id in batch}
+        self.assertEqual(len(sensors), 3 * 27)
+        self.assertTrue('sensor.b_total_energy_import' in sensors)
+
+    def test_thin_device_in_harness(self):
+        started = threading.Event()
+        stop = None
+        gateways = []
+
+        def serve():
+            nonlocal stop
+            loop = asyncio.new_event_loop()
+            gateway = Gateway(lambda sensors: True, workers=1)
+            loop.run_until_complete(gateway.start('127.0.0.1', 0, 0))
+            gateways.append(gateway)
+            stop = asyncio.Event()
+            started.set()
+            loop.run_until_complete(stop.wait())
+            loop.run_until_complete(gateway.stop())
+            loop.close()
+
+        thread = threading.Thread(target=serve)
+        thread.start()
+        started.wait()
+        gateway = gateways[0]
+        try:
+            for protocol, port in (('tcp', gateway.tcp_port), ('udp', gateway.udp_port)):
+                report = simulate(60, cpu_scale=0, heap=False, settings={
+                    "GATEWAY": f'127.0.0.1:{port}', "GATEWAY_PROTOCOL": protocol, "GATEWAY_DEVICE_ID": protocol,
+                    "WIFI_NONBLOCKING": True})
+                self.assertEqual(report["telegrams_ok"], 60)
+                self.assertEqual(report["requests"], 0)  # the device itself publishes nothing
+            for _ in range(100):
+                if len(gateway.devices) == 2 and min(gateway.devices.values()) >= 55 and \
+                        gateway.telegrams == sum(gateway.devices.values()):
+                    break
+                threading.Event().wait(0.05)
+            self.assertEqual(gateway.telegrams, sum(gateway.devices.values()))
+            # Telegrams read while WiFi was still connecting are not sent
+            self.assertTrue(min(gateway.devices.values()) >= 55)
+            self.assertEqual(set(gateway.latest), {'tcp', 'udp'})
+        finally:
+            gateway.queue._loop.call_soon_threadsafe(stop.set)
+            thread.join()
+
+
+if __name__ == '__main__':
+    unittest.main()
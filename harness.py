@@ -0,0 +1,568 @@
+"""Host side harness running the real main.py loop against simulated hardware on CPython.
+
+The machine, network, ntptime, urequests and time modules imported by
+main.py are replaced by stand-ins sharing one simulated clock, which the
+modules taking their ticks from compat are pointed at as well: the UART
+replays captured telegrams at the meter rate into a bounded rx buffer, the
+WLAN drops out on a script and Home Assistant is a local HTTP sink
+recording every request. With PULL_SERVER set a host thread keeps scraping
+its /metrics endpoint. Sleeping
+and waiting for the UART only advance the simulated clock, so hours of
+operation replay in seconds, while the time spent in Python is added scaled
+by cpu_scale. The sync runtime with the HTTP publish modes is supported,
+as are several METERS on hardware UARTs, each replaying the same capture
+(the UART figures of the report are those of the last meter).
+
+    python3 harness.py --hours 2 --outage 1800:300 --set PUBLISH_MODE="'bulk'"
+"""
+import argparse
+import builtins
+import contextlib
+import importlib
+import json
+import os
+import socket
+import tempfile
+import threading
+import time as host_time
+import tracemalloc
+import types
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from p1meter_test import meter_sample
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Modules binding ticks_ms or ticks_us from compat at import time
+TICK_MODULES = ('compat', 'dual_core', 'instrument', 'log', 'runtime')
+
+
+class SimulationEnd(BaseException):
+    """Raised from the stand-ins when the simulated duration is over, not caught by the main loop"""
+
+
+class NullWriter:
+
+    def write(self, text):
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+class Clock:
+    """Simulated seconds, advanced by sleeps plus the real time spent in Python times cpu_scale"""
+
+    def __init__(self, duration_s, cpu_scale=1.0):
+        self.duration_s = duration_s
+        self.cpu_scale = cpu_scale
+        self.offset = 0.0
+        self.real_start = host_time.perf_counter()
+
+    def now(self):
+        return self.offset + (host_time.perf_counter() - self.real_start) * self.cpu_scale
+
+    def check(self):
+        if self.now() >= self.duration_s:
+            raise SimulationEnd()
+
+    def advance(self, seconds):
+        self.offset += max(0.0, seconds)
+        self.check()
+
+
+def time_module(clock, epoch=None):
+    """Stand-in for the MicroPython time module"""
+    epoch = int(host_time.time()) if epoch is None else epoch
+    module = types.ModuleType('time')
+    module.time = lambda: epoch + int(clock.now())
+    module.sleep = clock.advance
+    module.sleep_ms = lambda ms: clock.advance(ms / 1000)
+    module.sleep_us = lambda us: clock.advance(us / 1000000)
+    module.ticks_ms = lambda: int(clock.now() * 1000)
+    module.ticks_us = lambda: int(clock.now() * 1000000)
+    module.ticks_diff = lambda end, start: end - start
+    module.ticks_add = lambda ticks, delta: ticks + delta
+    module.localtime = lambda seconds=None: host_time.gmtime(module.time() if seconds is None else seconds)
+    module.gmtime = module.localtime
+    return module
+
+
+@contextlib.contextmanager
+def simulated_ticks(time_stand_in):
+    """Point the ticks of TICK_MODULES and the shared logger at the time stand-in, restored on exit"""
+    import log
+    saved = [(log.logger, 'clock', log.logger.clock)]
+    for name in TICK_MODULES:
+        module = importlib.import_module(name)
+        for attribute in ('ticks_ms', 'ticks_us'):
+            if hasattr(module, attribute):
+                saved.append((module, attribute, getattr(module, attribute)))
+                setattr(module, attribute, getattr(time_stand_in, attribute))
+    log.logger.clock = time_stand_in.ticks_ms
+    try:
+        yield
+    finally:
+        for owner, attribute, value in saved:
+            setattr(owner, attribute, value)
+
+
+def telegram_lines(capture=None):
+    """Lines of the captured telegrams, each ending in a newline"""
+    if capture:
+        with open(capture, 'rb') as f:
+            data = f.read()
+    else:
+        data = ''.join(meter_sample).encode()
+    lines = [line + b'\n' for line in data.split(b'\n') if line]
+    starts = [i for i, line in enumerate(lines) if line.startswith(b'/')]
+    return [lines[start:end] for start, end in zip(starts, starts[1:] + [len(lines)])]
+
+
+class SimulatedUart:
+    """UART receiving a telegram every period_s into a rxbuf sized buffer, bytes that do not fit are lost"""
+
+    INV_RX = 1
+    INV_TX = 2
+
+    def __init__(self, clock, telegrams, period_s=1.0, baudrate=115200, timeout=1000, rxbuf=2048):
+        self.clock = clock
+        self.telegrams = telegrams
+        self.period_s = period_s
+        self.byte_s = 10 / baudrate
+        self.timeout_s = timeout / 1000
+        self.rxbuf = rxbuf
+        self.rx = bytearray()
+        self.sent = 0
+        self.delivered = 0
+        self.dropped_bytes = 0
+        self.damaged = set()
+        self.next = self.arrivals()
+        self.pending = next(self.next)
+
+    def arrivals(self):
+        """(time the line is complete, line, telegram number) for every line sent by the meter"""
+        n = 0
+        while True:
+            lines = self.telegrams[n % len(self.telegrams)]
+            t = n * self.period_s
+            for line in lines:
+                t += len(line) * self.byte_s
+                yield t, line, n, line is lines[-1]
+            n += 1
+
+    def receive(self):
+        now = self.clock.now()
+        while self.pending[0] <= now:
+            t, line, n, last = self.pending
+            if len(self.rx) + len(line) <= self.rxbuf:
+                self.rx += line
+            else:
+                self.dropped_bytes += len(line)
+                self.damaged.add(n)
+            if last:
+                self.sent += 1
+            self.pending = next(self.next)
+
+    def wait(self):
+        """Wait up to the timeout for data, False when nothing arrived"""
+        self.receive()
+        if self.rx:
+            return True
+        wait_s = self.pending[0] - self.clock.now()
+        if wait_s > self.timeout_s:
+            self.clock.advance(self.timeout_s)
+            return False
+        self.clock.advance(wait_s)
+        self.receive()
+        return True
+
+    def take(self, n):
+        data = bytes(self.rx[:n])
+        del self.rx[:n]
+        self.delivered += data.count(b'!')
+        return data
+
+    def readline(self):
+        if not self.wait():
+            return None
+        return self.take(self.rx.find(b'\n') + 1)
+
+    def readinto(self, buf):
+        if not self.wait():
+            return None
+        data = self.take(len(buf))
+        buf[:len(data)] = data
+        return len(data)
+
+
+class Outages:
+    """Scripted Wi-Fi dropouts as (start_s, duration_s) pairs"""
+
+    def __init__(self, clock, outages=()):
+        self.clock = clock
+        self.outages = [(start, start + duration) for start, duration in outages]
+
+    def active(self, t=None):
+        t = self.clock.now() if t is None else t
+        return any(start <= t < end for start, end in self.outages)
+
+    def since(self, t):
+        """True if an outage happened between t and now"""
+        now = self.clock.now()
+        return any(start < now and end > t for start, end in self.outages)
+
+
+class SimulatedWlan:
+    """network.WLAN associating connect_s after connect(), losing the link on every scripted outage"""
+
+    def __init__(self, clock, outages, connect_s=2.0):
+        self.clock = clock
+        self.outages = outages
+        self.connect_s = connect_s
+        self.is_active = False
+        self.connect_time = None
+        self.connects = 0
+
+    def active(self, is_active=None):
+        if is_active is None:
+            return self.is_active
+        self.is_active = is_active
+        if not is_active:
+            self.connect_time = None
+
+    def connect(self, ssid, password):
+        self.connects += 1
+        self.connect_time = self.clock.now()
+
+    def disconnect(self):
+        self.connect_time = None
+
+    def isconnected(self):
+        if not self.is_active or self.connect_time is None:
+            return False
+        if self.outages.since(self.connect_time):
+            self.connect_time = None  # link lost, connect() has to be called again
+            return False
+        return self.clock.now() - self.connect_time >= self.connect_s
+
+    def status(self, param=None):
+        return -67 if param == 'rssi' else 3
+
+
+class Watchdog:
+
+    def __init__(self, clock, timeout=8388):
+        self.clock = clock
+        self.timeout_s = timeout / 1000
+        self.last_feed = clock.now()
+        self.max_gap_s = 0.0
+        self.resets = 0
+
+    def feed(self):
+        gap = self.clock.now() - self.last_feed
+        self.max_gap_s = max(self.max_gap_s, gap)
+        if gap > self.timeout_s:
+            self.resets += 1
+        self.last_feed = self.clock.now()
+
+
+class Pin:
+    OUT = 1
+    IN = 0
+
+    def __init__(self, id, mode=None):
+        self.state = 0
+
+    def on(self):
+        self.state = 1
+
+    def off(self):
+        self.state = 0
+
+    def toggle(self):
+        self.state ^= 1
+
+    def value(self, state=None):
+        if state is None:
+            return self.state
+        self.state = state
+
+
+class Timer:
+    PERIODIC = 1
+    ONE_SHOT = 0
+
+    def init(self, **kw):
+        pass  # the LED blinker is not simulated
+
+    def deinit(self):
+        pass
+
+
+class Sink:
+    """Local HTTP server recording (simulated time, path, body size), dropping requests during outages"""
+
+    def __init__(self, clock, outages):
+        sink = self
+        self.clock = clock
+        self.outages = outages
+        self.requests = []
+        self.refused = 0
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length'] or 0))
+                if sink.outages.active():
+                    sink.refused += 1
+                    self.close_connection = True  # unreachable, no response
+                    return
+                sink.requests.append((sink.clock.now(), self.path, len(body)))
+                self.send_response(200)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def cycles(self, gap_s=5.0):
+        """Publish cycles as lists of request times, split where requests are more than gap_s apart"""
+        cycles = []
+        for t, path, size in self.requests:
+            if cycles and t - cycles[-1][-1] <= gap_s:
+                cycles[-1].append(t)
+            else:
+                cycles.append([t])
+        return cycles
+
+
+class Scraper:
+    """Host thread fetching /metrics from the pull server of main.py every interval_s real seconds"""
+
+    def __init__(self, namespace, interval_s=0.01):
+        self.namespace = namespace
+        self.interval_s = interval_s
+        self.scrapes = 0
+        self.errors = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+
+    def scrape(self, port):
+        with socket.create_connection(('127.0.0.1', port), timeout=2) as sock:
+            sock.sendall(b'GET /metrics HTTP/1.0\r\n\r\n')
+            response = b''
+            while True:
+                chunk = sock.recv(4096)
+                if not chunk:
+                    return response
+                response += chunk
+
+    def run(self):
+        while not self.stopped.wait(self.interval_s):
+            server = self.namespace.get('pull_server')
+            if server is None:
+                continue
+            try:
+                ok = self.scrape(server.port).startswith(b'HTTP/1.0 200')
+            except OSError:
+                ok = False
+            if ok:
+                self.scrapes += 1
+            elif not self.stopped.is_set():
+                self.errors += 1
+
+
+def urequests_module():
+    """Stand-in for urequests, one connection per request like the MicroPython library"""
+    from http_client import HttpClient
+
+    def post(url, **kw):
+        client = HttpClient()
+        try:
+            return client.post(url, **kw)
+        finally:
+            client.close()
+
+    module = types.ModuleType('urequests')
+    module.post = post
+    return module
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def simulate(duration_s, capture=None, period_s=1.0, outages=(), settings=None, cpu_scale=1.0, heap=True,
+             ntp_down=False):
+    """Run main.py for duration_s simulated seconds, returns a report dict.
+
+    With ntp_down every NTP sync times out after 1 s.
+    """
+    clock = Clock(duration_s, cpu_scale)
+    outage_script = Outages(clock, outages)
+    telegrams = telegram_lines(capture)
+    devices = {}
+
+    def uart(id, baudrate=115200, timeout=1000, rxbuf=2048, **kw):
+        devices['uart'] = SimulatedUart(clock, telegrams, period_s, baudrate, timeout, rxbuf)
+        return devices['uart']
+
+    def wlan(interface):
+        devices['wlan'] = SimulatedWlan(clock, outage_script)
+        return devices['wlan']
+
+    def wdt(timeout=8388):
+        devices['wdt'] = Watchdog(clock, timeout)
+        return devices['wdt']
+
+    def settime():
+        if ntp_down:
+            clock.advance(1.0)
+            raise OSError(110)
+        if outage_script.active():
+            raise OSError(110)
+
+    uart.INV_RX = SimulatedUart.INV_RX
+    uart.INV_TX = SimulatedUart.INV_TX
+    machine = types.ModuleType('machine')
+    machine.UART, machine.Pin, machine.Timer, machine.WDT = uart, Pin, Timer, wdt
+    machine.unique_id = lambda: bytes.fromhex('e6614c300b2a4521')
+    network = types.ModuleType('network')
+    network.STA_IF = 0
+    network.WLAN = wlan
+    ntptime = types.ModuleType('ntptime')
+    ntptime.settime = settime
+
+    import config
+    with Sink(clock, outage_script) as sink:
+        overrides = {'HOME_ASSISTANT_SENSOR_API': f'{sink.url}/api/states',
+                     'HOME_ASSISTANT_BULK_API': f'{sink.url}/api/webhook/p1meter',
+                     'OFFLINE_BACKFILL_API': f'{sink.url}/api/webhook/backfill',
+                     'PULL_SERVER_PORT': 0, 'RUNTIME': 'sync'}
+        overrides.update(settings or {})
+        saved_config = {name: getattr(config, name) for name in overrides if hasattr(config, name)}
+        for name, value in overrides.items():
+            setattr(config, name, value)
+        simulated_time = time_module(clock)
+        stand_ins = {'machine': machine, 'network': network, 'ntptime': ntptime, 'urequests': urequests_module(),
+                     'time': simulated_time}
+
+        def import_stand_in(name, *args, **kw):
+            return stand_ins.get(name) or builtins.__import__(name, *args, **kw)
+
+        namespace = {'__name__': 'main', '__file__': os.path.join(HERE, 'main.py'),
+                     '__builtins__': dict(vars(builtins), __import__=import_stand_in)}
+        with open(namespace['__file__']) as f:
+            code = compile(f.read(), namespace['__file__'], 'exec')
+        if heap:
+            tracemalloc.start()
+        real_start = host_time.perf_counter()
+        clock.real_start = real_start
+        cwd = os.getcwd()
+        flash = tempfile.TemporaryDirectory()  # files main.py writes, like the offline log
+        scraper = Scraper(namespace)
+        try:
+            os.chdir(flash.name)
+            with contextlib.redirect_stdout(NullWriter()), simulated_ticks(simulated_time), \
+                    scraper if config.PULL_SERVER else contextlib.nullcontext():
+                exec(code, namespace)
+        except SimulationEnd:
+            pass
+        finally:
+            if namespace.get('pull_server'):
+                namespace['pull_server'].close()
+            os.chdir(cwd)
+            flash.cleanup()
+            real_s = host_time.perf_counter() - real_start
+            heap_peak = tracemalloc.get_traced_memory()[1] if heap else None
+            if heap:
+                tracemalloc.stop()
+            for name, value in saved_config.items():
+                setattr(config, name, value)
+
+    uart = devices['uart']
+    errors = {name: namespace.get(f'p1_{name}_errors', 0) for name in ('timeout', 'decode', 'crc', 'format')}
+    cycles = sink.cycles()
+    latencies = [round(1000 * (cycle[-1] - cycle[0]), 1) for cycle in cycles]
+    return {
+        "simulated_s": duration_s,
+        "real_s": round(real_s, 3),
+        "speedup": round(duration_s / real_s, 1) if real_s else None,
+        "telegrams_sent": uart.sent,
+        "telegrams_read": uart.delivered,
+        "telegrams_ok": uart.delivered - errors['decode'] - errors['crc'] - errors['format'],
+        "telegrams_damaged_by_overflow": len(uart.damaged),
+        "uart_dropped_bytes": uart.dropped_bytes,
+        "read_errors": errors,
+        "throughput_telegrams_per_real_s": round(uart.delivered / real_s, 1) if real_s else None,
+        "publish_cycles": len(cycles),
+        "requests": len(sink.requests),
+        "requests_refused": sink.refused,
+        "sensors_published": len(set(path for t, path, size in sink.requests)),
+        "publish_latency_ms": {"p50": percentile(latencies, 0.5), "p95": percentile(latencies, 0.95),
+                               "max": max(latencies) if latencies else None},
+        "wifi_connects": devices['wlan'].connects,
+        "watchdog_max_gap_ms": round(1000 * devices['wdt'].max_gap_s),
+        "watchdog_resets": devices['wdt'].resets,
+        "heap_peak_bytes": heap_peak,
+        "scrapes": scraper.scrapes,
+        "scrape_errors": scraper.errors,
+        "exceptions": dict(namespace.get('exception_counts', {})),
+        "boot_ms": dict(namespace['boot'].ms) if hasattr(namespace.get('boot'), 'ms') else None,
+    }
+
+
+def outage(text):
+    start, duration = text.split(':')
+    return float(start), float(duration)
+
+
+def setting(text):
+    name, value = text.split('=', 1)
+    return name, eval(value, {})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--hours', type=float, default=1.0, help='simulated duration')
+    parser.add_argument('--capture', help='file with captured telegrams, the sample telegram by default')
+    parser.add_argument('--period', type=float, default=1.0, help='seconds between telegrams')
+    parser.add_argument('--outage', type=outage, action='append', default=[], help='Wi-Fi dropout as start_s:duration_s')
+    parser.add_argument('--set', type=setting, action='append', default=[], help='config override as NAME=python literal')
+    parser.add_argument('--cpu-scale', type=float, default=1.0, help='simulated seconds per real second spent in Python')
+    parser.add_argument('--ntp-down', action='store_true', help='every NTP sync times out after 1 s')
+    parser.add_argument('--no-heap', action='store_true', help='skip tracemalloc, it slows the run down')
+    args = parser.parse_args()
+    report = simulate(args.hours * 3600, args.capture, args.period, args.outage, dict(args.set),
+                      args.cpu_scale, not args.no_heap, args.ntp_down)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+import os
+import tempfile
+import unittest
+
+from harness import simulate
+from log import logger
+from p1meter_test import meter_sample
+
+
+class HarnessTest(unittest.TestCase):
+
+    def test_steady_state(self):
+        report = simulate(600, cpu_scale=0, heap=False)
+        self.assertEqual(report["telegrams_sent"], 600)
+        self.assertEqual(report["telegrams_ok"], 600)
+        self.assertEqual(report["uart_dropped_bytes"], 0)
+        self.assertEqual(report["publish_cycles"], 10)
+        self.assertEqual(report["requests"], 10 * 37)  # 27 meter and 10 status sensors
+        self.assertEqual(report["watchdog_resets"], 0)
+
+    def test_blocking_reconnect_loses_telegrams(self):
+        report = simulate(600, outages=[(150, 120)], cpu_scale=0, heap=False)
+        self.assertTrue(report["requests_refused"] > 0)
+        self.assertTrue(report["telegrams_damaged_by_overflow"] > 0)
+        self.assertTrue(report["wifi_connects"] > 1)
+        self.assertEqual([name for name in report["exceptions"] if not name.startswith('oserror')], [])
+
+    def test_nonblocking_reconnect_keeps_reading(self):
+        report = simulate(600, outages=[(150, 120)], cpu_scale=0, heap=False,
+                          settings={"WIFI_NONBLOCKING": True, "OFFLINE_LOG": True})
+        self.assertEqual(report["uart_dropped_bytes"], 0)
+        self.assertEqual(report["telegrams_ok"], 600)
+        self.assertEqual(report["requests_refused"], 0)
+        self.assertEqual(report["watchdog_resets"], 0)
+
+    def test_unreachable_ntp_is_retried_with_backoff(self):
+        report = simulate(600, cpu_scale=0, heap=False, ntp_down=True, settings={"WIFI_NONBLOCKING": True})
+        self.assertTrue(sum(report["exceptions"].values()) <= 8)  # not one 1 s timeout per telegram
+        self.assertEqual(report["telegrams_ok"], 600)
+        self.assertEqual(report["uart_dropped_bytes"], 0)
+
+    def test_scraping_keeps_reading(self):
+        report = simulate(600, heap=False, settings={"PULL_SERVER": True})
+        self.assertTrue(report["scrapes"] > 0)
+        self.assertEqual(report["scrape_errors"], 0)
+        self.assertEqual(report["uart_dropped_bytes"], 0)
+        self.assertEqual(report["telegrams_ok"], 600)
+
+    def test_boot_times(self):
+        report = simulate(130, cpu_scale=0, heap=False, settings={"INSTRUMENTATION": True})
+        boot = report["boot_ms"]
+        self.assertTrue(boot["ready"] <= boot["first_telegram"] <= boot["first_publish"])
+        self.assertTrue(boot["first_publish"] < 1000)
+
+    def test_modules_share_the_simulated_clock(self):
+        simulate(130, outages=[(60, 30)], cpu_scale=0, heap=False)
+        stamps = [int(line.split()[0]) for line in logger.recent()]
+        self.assertTrue(stamps)
+        self.assertTrue(max(stamps) <= 130000)
+
+    def test_two_meters(self):
+        meters = [{'prefix': 'dsmr', 'uart': 1, 'tx': 4, 'rx': 5},
+                  {'prefix': 'heat_pump', 'name': 'Heat pump', 'uart': 0, 'tx': 0, 'rx': 1}]
+        report = simulate(600, cpu_scale=0, heap=False, settings={"METERS": meters})
+        self.assertEqual(report["uart_dropped_bytes"], 0)
+        self.assertEqual(report["publish_cycles"], 10)
+        self.assertEqual(report["sensors_published"], 2 * 27 + 10 + 2)  # two meters, status and errors per meter
+        self.assertEqual(report["read_errors"], {"timeout": 0, "decode": 0, "crc": 0, "format": 0})
+
+    def test_two_meters_aggregated_and_backfilled(self):
+        meters = [{'prefix': 'dsmr', 'uart': 1, 'tx': 4, 'rx': 5},
+                  {'prefix': 'heat_pump', 'name': 'Heat pump', 'uart': 0, 'tx': 0, 'rx': 1}]
+        report = simulate(600, outages=[(150, 120)], cpu_scale=0, heap=False,
+                          settings={"METERS": meters, "AGGREGATE_MEASUREMENTS": True, "OFFLINE_LOG": True,
+                                    "WIFI_NONBLOCKING": True})
+        # min, max and mean of the 22 measurement codes per meter, one backfill endpoint
+        self.assertEqual(report["sensors_published"], 2 * 27 + 10 + 2 + 2 * 22 * 3 + 1)
+        self.assertEqual(report["exceptions"], {})
+
+    def test_failed_due_telegram_is_not_published_stale(self):
+        telegram = ''.join(meter_sample)
+        with tempfile.TemporaryDirectory() as directory:
+            capture = os.path.join(directory, 'capture.txt')
+            with open(capture, 'w') as f:
+                f.write(telegram.replace('!F5D8', '!0000') + telegram)  # every other telegram fails its CRC
+            report = simulate(600, capture, cpu_scale=0, heap=False, settings={"SKIP_PARSE_BETWEEN_PUBLISHES": True})
+        self.assertEqual(report["read_errors"]["crc"], 300)
+        self.assertEqual(report["publish_cycles"], 10)
+        self.assertEqual(report["requests"], 10 * 37)  # the first cycle waits for a good telegram too
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,187 @@
+import errno
+import json as jsonlib
+import socket
+
+
+def split_url(url):
+    scheme, rest = url.split('://', 1)
+    if '/' in rest:
+        netloc, path = rest.split('/', 1)
+        path = '/' + path
+    else:
+        netloc, path = rest, '/'
+    if ':' in netloc:
+        host, port = netloc.split(':', 1)
+        port = int(port)
+    else:
+        host, port = netloc, 443 if scheme == 'https' else 80
+    return scheme, host, port, path
+
+
+class Response:
+
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode()
+
+    def close(self):
+        pass  # body is read eagerly so the connection can be reused
+
+
+class HttpClient:
+    """HTTP/1.1 client keeping a single connection alive between requests.
+
+    The host is resolved once per connection target. When a kept-alive
+    connection turns out to be dead the error is reported to on_error and the
+    request is retried once on a fresh connection. https connections are
+    wrapped with ssl_context, by default the certificate checks of urequests
+    on MicroPython and a verifying default context on CPython.
+    """
+
+    def __init__(self, on_error=None, ssl_context=None):
+        self.on_error = on_error
+        self.ssl_context = ssl_context
+        self.target = None
+        self.address = None
+        self.sock = None
+        self.stream = None
+
+    def close(self):
+        if self.sock:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+        self.sock = None
+        self.stream = None
+
+    def connect(self, scheme, host, port, timeout):
+        if self.target != (scheme, host, port):
+            self.close()
+            self.target = (scheme, host, port)
+            self.address = None
+        if self.address is None:
+            self.address = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)[0][-1]
+
+        sock = socket.socket()
+        try:
+            sock.settimeout(timeout)
+            sock.connect(self.address)
+            if scheme == 'https':
+                sock = self.wrap_tls(sock, host)
+        except OSError:
+            sock.close()
+            self.address = None  # resolve again on the next attempt
+            raise
+        self.sock = sock
+        self.stream = sock.makefile('rwb') if hasattr(sock, 'makefile') else sock
+
+    def wrap_tls(self, sock, host):
+        import ssl  # not imported at boot for plain http targets
+        context = self.ssl_context
+        if context is None:
+            if not hasattr(ssl, 'create_default_context'):
+                return ssl.wrap_socket(sock, server_hostname=host)  # as urequests does on MicroPython
+            context = ssl.create_default_context()
+        return context.wrap_socket(sock, server_hostname=host)
+
+    def send(self, method, host, path, headers, data):
+        request = f'{method} {path} HTTP/1.1\r\nHost: {host}\r\nConnection: keep-alive\r\n'
+        if data is not None:
+            request += f'Content-Length: {len(data)}\r\n'
+        for name, value in headers.items():
+            request += f'{name}: {value}\r\n'
+        self.stream.write(request.encode() + b'\r\n')
+        if data is not None:
+            self.stream.write(data)
+        if hasattr(self.stream, 'flush'):
+            self.stream.flush()
+
+    def read_chunked(self):
+        content = b''
+        while True:
+            size = int(self.stream.readline().split(b';')[0], 16)
+            if size == 0:
+                self.stream.readline()
+                return content
+            content += self.stream.read(size)
+            self.stream.readline()
+
+    def read_response(self):
+        status_line = self.stream.readline()
+        if not status_line:
+            raise OSError(errno.ECONNRESET)  # peer closed the kept-alive connection
+        status_code = int(status_line.split(None, 2)[1])
+
+        content_length = None
+        chunked = False
+        keep_alive = True
+        while True:
+            line = self.stream.readline()
+            if not line or line == b'\r\n':
+                break
+            name, value = line.split(b':', 1)
+            name = name.strip().lower()
+            value = value.strip().lower()
+            if name == b'content-length':
+                content_length = int(value)
+            elif name == b'transfer-encoding' and value == b'chunked':
+                chunked = True
+            elif name == b'connection' and value == b'close':
+                keep_alive = False
+
+        if chunked:
+            content = self.read_chunked()
+        elif content_length is not None:
+            content = self.stream.read(content_length) if content_length else b''
+        else:
+            content = self.stream.read()
+            keep_alive = False
+
+        if not keep_alive:
+            self.close()
+        return Response(status_code, content)
+
+    def exchange(self, target, write, timeout):
+        """Connect to target unless already connected, write the request and read the response"""
+        for attempt in range(2):
+            reused = self.sock is not None and self.target == target
+            try:
+                if not reused:
+                    self.connect(*target, timeout)
+                elif timeout is not None:
+                    self.sock.settimeout(timeout)
+                write()
+                return self.read_response()
+            except OSError as e:
+                self.close()
+                if not reused:
+                    raise
+                if self.on_error:
+                    self.on_error(e)
+
+    def request(self, method, url, data=None, json=None, headers=None, timeout=None):
+        scheme, host, port, path = split_url(url)
+        headers = dict(headers) if headers else {}
+        if json is not None:
+            data = jsonlib.dumps(json)
+            headers.setdefault('Content-Type', 'application/json')
+        if isinstance(data, str):
+            data = data.encode()
+        return self.exchange((scheme, host, port), lambda: self.send(method, host, path, headers, data), timeout)
+
+    def send_request(self, target, request, timeout=None):
+        """Send a complete serialised request to target, a (scheme, host, port) tuple"""
+        return self.exchange(target, lambda: self.write_request(request), timeout)
+
+    def write_request(self, request):
+        self.stream.write(request)
+        if hasattr(self.stream, 'flush'):
+            self.stream.flush()
+
+    def post(self, url, **kw):
+        return self.request('POST', url, **kw)
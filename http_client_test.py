@@ -0,0 +1,105 @@
+import os
+import shutil
+import ssl
+import subprocess
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from http_client import HttpClient, split_url
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.requests.append((self.path, body))
+        response = b'{"ok": true}'
+        self.send_response(201)
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+        if self.server.drop_connections:
+            self.close_connection = True  # close without announcing it
+
+    def log_message(self, format, *args):
+        pass
+
+
+class HttpClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+        self.server.connections = 0
+        self.server.requests = []
+        self.server.drop_connections = False
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.errors = []
+        self.client = HttpClient(on_error=self.errors.append)
+        self.url = f'http://127.0.0.1:{self.server.server_port}/api/states'
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def test_split_url(self):
+        self.assertEqual(split_url('http://ha.local:8123/api/states'), ('http', 'ha.local', 8123, '/api/states'))
+        self.assertEqual(split_url('https://ha.local'), ('https', 'ha.local', 443, '/'))
+
+    def test_connection_reused(self):
+        for i in range(10):
+            response = self.client.post(f'{self.url}/sensor.test_{i}', json={"state": str(i)}, timeout=1)
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(response.text, '{"ok": true}')
+            response.close()
+        self.assertEqual(len(self.server.requests), 10)
+        self.assertEqual(self.server.requests[3], ('/api/states/sensor.test_3', b'{"state": "3"}'))
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(self.errors, [])
+
+    def test_reconnect_after_close(self):
+        self.server.drop_connections = True
+        for i in range(3):
+            response = self.client.post(f'{self.url}/sensor.test_{i}', json={"state": str(i)}, timeout=1)
+            self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(self.server.connections, 3)
+        self.assertEqual(len(self.errors), 2)
+        self.assertIsInstance(self.errors[0], OSError)
+
+    @unittest.skipUnless(shutil.which('openssl'), 'needs openssl to make a certificate')
+    def test_https_certificate_checked(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cert, key = os.path.join(directory, 'cert.pem'), os.path.join(directory, 'key.pem')
+            subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+                            '-subj', '/CN=127.0.0.1', '-addext', 'subjectAltName=IP:127.0.0.1',
+                            '-keyout', key, '-out', cert], check=True, capture_output=True)
+            server_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            server_context.load_cert_chain(cert, key)
+            trusting = ssl.create_default_context(cafile=cert)
+        self.server.socket = server_context.wrap_socket(self.server.socket, server_side=True)
+        url = f'https://127.0.0.1:{self.server.server_port}/api/states/sensor.test'
+
+        with self.assertRaises(ssl.SSLError):
+            self.client.post(url, json={"state": "1"}, timeout=1)
+        self.assertEqual(self.server.requests, [])
+
+        client = HttpClient(ssl_context=trusting)
+        try:
+            self.assertEqual(client.post(url, json={"state": "1"}, timeout=1).status_code, 201)
+        finally:
+            client.close()
+        self.assertEqual(self.server.requests, [('/api/states/sensor.test', b'{"state": "1"}')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+import gc
+
+from compat import ticks_us, ticks_diff
+
+
+class Stopwatch:
+    """Count, total and max duration of a code path in microseconds.
+
+    Time a block with 'with stopwatch:' or decorate a function with it to
+    record every call as a sample. Functions wrapped with accumulate() add
+    their time up until lap() records it as one sample, e.g. the CRC over all
+    lines of a telegram.
+    """
+
+    def __init__(self):
+        self.start = 0
+        self.pending_us = 0
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.total_us = 0
+        self.max_us = 0
+
+    def record(self, us):
+        self.count += 1
+        self.total_us += us
+        if us > self.max_us:
+            self.max_us = us
+
+    def mean_us(self):
+        return self.total_us // self.count if self.count else 0
+
+    def __enter__(self):
+        self.start = ticks_us()
+        return self
+
+    def __exit__(self, *exc):
+        self.record(ticks_diff(ticks_us(), self.start))
+        return False
+
+    def __call__(self, func):
+        def timed(*args, **kw):
+            with self:
+                return func(*args, **kw)
+        return timed
+
+    def accumulate(self, func):
+        def timed(*args):
+            start = ticks_us()
+            result = func(*args)
+            self.pending_us += ticks_diff(ticks_us(), start)
+            return result
+        return timed
+
+    def lap(self):
+        if self.pending_us:
+            self.record(self.pending_us)
+            self.pending_us = 0
+
+
+class MemoryWatermark:
+    """Lowest free and highest allocated heap seen by sample(), MicroPython only"""
+
+    available = hasattr(gc, 'mem_free')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.min_free = None
+        self.max_alloc = None
+
+    def sample(self):
+        if not self.available:
+            return
+        free = gc.mem_free()
+        alloc = gc.mem_alloc()
+        if self.min_free is None or free < self.min_free:
+            self.min_free = free
+        if self.max_alloc is None or alloc > self.max_alloc:
+            self.max_alloc = alloc
+
+
+class BootTimes:
+    """Milliseconds from reset until each boot milestone was first reached.
+
+    The tick counter starts at zero on reset, so the tick count passed to
+    reached() is the time since reset.
+    """
+
+    milestones = ('ready', 'first_telegram', 'first_publish')
+
+    def __init__(self):
+        self.ms = {}
+
+    def reached(self, milestone, now):
+        if milestone not in self.ms:
+            self.ms[milestone] = now
+
+
+def ms(us):
+    return f'{us / 1000:.1f}'
+
+
+def status_sensors(stopwatches, memory, boot=None, prefix='sensor.smartmeter_'):
+    """Max and mean duration per stopwatch, the heap watermarks and the boot times as sensors"""
+    sensors = {}
+    for name, stopwatch in stopwatches.items():
+        friendly_name = name.replace('_', ' ').capitalize()
+        sensors[f'{prefix}{name}_max_ms'] = {
+            "state": lambda s=stopwatch: ms(s.max_us),
+            "attributes": {
+                "unit_of_measurement": "ms",
+                "friendly_name": f"{friendly_name} max"
+            }
+        }
+        sensors[f'{prefix}{name}_mean_ms'] = {
+            "state": lambda s=stopwatch: ms(s.mean_us()),
+            "attributes": {
+                "unit_of_measurement": "ms",
+                "friendly_name": f"{friendly_name} mean"
+            }
+        }
+    if memory.available:
+        sensors[f'{prefix}heap_min_free'] = {
+            "state": lambda: str(memory.min_free),
+            "attributes": {
+                "unit_of_measurement": "B",
+                "friendly_name": "Heap min free"
+            }
+        }
+        sensors[f'{prefix}heap_max_alloc'] = {
+            "state": lambda: str(memory.max_alloc),
+            "attributes": {
+                "unit_of_measurement": "B",
+                "friendly_name": "Heap max allocated"
+            }
+        }
+    if boot is not None:
+        for milestone in boot.milestones:
+            sensors[f'{prefix}boot_{milestone}_ms'] = {
+                "state": lambda m=milestone: str(boot.ms.get(m, 'unknown')),
+                "attributes": {
+                    "unit_of_measurement": "ms",
+                    "friendly_name": f"Boot to {milestone.replace('_', ' ')}"
+                }
+            }
+    return sensors
@@ -0,0 +1,75 @@
+import time
+import unittest
+
+from instrument import BootTimes, MemoryWatermark, Stopwatch, status_sensors
+from p1meter import TelegramParser, calculate_crc, parse_line, read_p1_meter
+from p1meter_test import p1_test_readline
+
+
+class InstrumentTest(unittest.TestCase):
+
+    def test_context_and_decorator(self):
+        stopwatch = Stopwatch()
+        with stopwatch:
+            time.sleep(0.002)
+
+        @stopwatch
+        def work():
+            return 42
+
+        self.assertEqual(work(), 42)
+        self.assertEqual(stopwatch.count, 2)
+        self.assertTrue(stopwatch.max_us >= 2000)
+        self.assertTrue(stopwatch.total_us >= stopwatch.max_us)
+        self.assertEqual(stopwatch.mean_us(), stopwatch.total_us // 2)
+
+        stopwatch.reset()
+        self.assertEqual((stopwatch.count, stopwatch.total_us, stopwatch.max_us, stopwatch.mean_us()), (0, 0, 0, 0))
+
+    def test_exception_is_recorded_and_raised(self):
+        stopwatch = Stopwatch()
+        with self.assertRaises(ValueError):
+            with stopwatch:
+                raise ValueError()
+        self.assertEqual(stopwatch.count, 1)
+
+    def test_timed_parser(self):
+        crc = Stopwatch()
+        parse = Stopwatch()
+        parser = TelegramParser()
+        parser.checksum = crc.accumulate(calculate_crc)
+        parser.tokenise = parse.accumulate(parse_line)
+        for i in range(3):
+            data, error_type = read_p1_meter(p1_test_readline(), parser)
+            self.assertIsNone(error_type)
+            self.assertEqual(len(data), 27)
+            crc.lap()
+            parse.lap()
+        self.assertEqual(crc.count, 3)  # one sample per telegram
+        self.assertEqual(parse.count, 3)
+        self.assertTrue(crc.total_us > 0)
+
+    def test_status_sensors(self):
+        stopwatch = Stopwatch()
+        stopwatch.record(1500)
+        stopwatch.record(500)
+        sensors = status_sensors({'http_post': stopwatch}, MemoryWatermark())
+        self.assertEqual(sensors['sensor.smartmeter_http_post_max_ms']["state"](), '1.5')
+        self.assertEqual(sensors['sensor.smartmeter_http_post_mean_ms']["state"](), '1.0')
+        self.assertEqual(sensors['sensor.smartmeter_http_post_max_ms']["attributes"]["friendly_name"], 'Http post max')
+        self.assertEqual('sensor.smartmeter_heap_min_free' in sensors, MemoryWatermark.available)
+        self.assertFalse('sensor.smartmeter_boot_ready_ms' in sensors)
+
+    def test_boot_sensors(self):
+        boot = BootTimes()
+        sensors = status_sensors({}, MemoryWatermark(), boot)
+        self.assertEqual(sensors['sensor.smartmeter_boot_first_publish_ms']["state"](), 'unknown')
+        boot.reached('first_telegram', 1200)
+        boot.reached('first_telegram', 2200)  # only the first time counts
+        self.assertEqual(sensors['sensor.smartmeter_boot_first_telegram_ms']["state"](), '1200')
+        self.assertEqual(sensors['sensor.smartmeter_boot_first_telegram_ms']["attributes"]["friendly_name"],
+                         'Boot to first telegram')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+import _thread
+
+from compat import const, ticks_ms, ticks_diff
+
+# A message is kept when its level is at least the logger's level
+DEBUG = const(10)
+INFO = const(20)
+WARNING = const(30)
+ERROR = const(40)
+LEVELS = {'debug': DEBUG, 'info': INFO, 'warning': WARNING, 'error': ERROR}
+NAMES = {DEBUG: 'DEBUG', INFO: 'INFO', WARNING: 'WARNING', ERROR: 'ERROR'}
+
+
+class Logger:
+    """Levelled log kept in a ring buffer in RAM, optionally printed to the REPL.
+
+    A message below the level returns before its arguments are %-formatted,
+    so pass values as arguments rather than formatting them in the call.
+    With a rate limit every category logs at most rate_limit messages per
+    window_ms, the messages beyond are counted and the count is added to the
+    next message of the category that gets through. Messages that pass the
+    level are handled under a lock, the dual core runtime logs from both
+    cores and the rp2 port has no GIL.
+    """
+
+    def __init__(self, level=INFO, capacity=32, rate_limit=0, echo=False, window_ms=60000, clock=ticks_ms):
+        self.clock = clock
+        self.window_ms = window_ms
+        self.lock = _thread.allocate_lock()
+        self.configure(level, capacity, rate_limit, echo)
+
+    def configure(self, level, capacity, rate_limit, echo):
+        self.level = level
+        self.lines = [None] * capacity
+        self.next = 0
+        self.rate_limit = rate_limit
+        self.echo = echo
+        self.windows = {}  # category -> [window start, messages, suppressed]
+        self.warnings = 0
+        self.last_warning = ''
+
+    def debug(self, category, message, *args):
+        if self.level <= DEBUG:
+            self.log(DEBUG, category, message, args)
+
+    def info(self, category, message, *args):
+        if self.level <= INFO:
+            self.log(INFO, category, message, args)
+
+    def warning(self, category, message, *args):
+        if self.level <= WARNING:
+            self.log(WARNING, category, message, args)
+
+    def error(self, category, message, *args):
+        if self.level <= ERROR:
+            self.log(ERROR, category, message, args)
+
+    def admit(self, category, now):
+        """Messages suppressed in the category before this one, None if this one is suppressed too"""
+        window = self.windows.get(category)
+        if window is None or ticks_diff(now, window[0]) >= self.window_ms:
+            self.windows[category] = [now, 1, 0]
+            return window[2] if window else 0
+        if window[1] < self.rate_limit:
+            window[1] += 1
+            suppressed = window[2]
+            window[2] = 0
+            return suppressed
+        window[2] += 1
+        return None
+
+    def log(self, level, category, message, args):
+        with self.lock:
+            self.append(level, category, message, args)
+
+    def append(self, level, category, message, args):
+        now = self.clock()
+        suppressed = 0
+        if self.rate_limit:
+            suppressed = self.admit(category, now)
+            if suppressed is None:
+                return
+        if args:
+            message = message % args
+        line = f'{now} {NAMES[level]} {category}: {message}'
+        if suppressed:
+            line += f' ({suppressed} suppressed)'
+        if self.lines:
+            self.lines[self.next] = line
+            self.next = (self.next + 1) % len(self.lines)
+        if level >= WARNING:
+            self.warnings += 1
+            self.last_warning = line
+        if self.echo:
+            print(line)
+
+    def recent(self):
+        """The buffered lines, oldest first"""
+        with self.lock:
+            lines = self.lines[self.next:] + self.lines[:self.next]
+        return [line for line in lines if line is not None]
+
+    def dump(self, write):
+        for line in self.recent():
+            write(line)
+            write('\n')
+
+
+# Shared by all modules, main.py configures it from config.py
+logger = Logger()
+
+
+def status_sensors(logger, prefix='sensor.smartmeter_'):
+    """Number of warnings and errors and the last one as sensors"""
+    return {
+        f'{prefix}log_warnings': {
+            "state": lambda: str(logger.warnings),
+            "attributes": {
+                "unit_of_measurement": "",
+                "friendly_name": "Log warnings"
+            }
+        },
+        f'{prefix}log_last_warning': {
+            "state": lambda: logger.last_warning[:255],  # the longest state Home Assistant accepts
+            "attributes": {
+                "friendly_name": "Log last warning"
+            }
+        },
+    }
@@ -0,0 +1,97 @@
+import _thread
+import time
+import unittest
+
+from log import DEBUG, INFO, WARNING, Logger, status_sensors
+
+
+class Formatted:
+
+    def __init__(self):
+        self.count = 0
+
+    def __str__(self):
+        self.count += 1
+        return 'formatted'
+
+
+class LogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0
+        self.logger = Logger(INFO, capacity=3, echo=False, clock=lambda: self.now)
+
+    def test_level_filters_before_formatting(self):
+        value = Formatted()
+        self.logger.debug('p1', '%s', value)
+        self.assertEqual(value.count, 0)
+        self.assertEqual(self.logger.recent(), [])
+        self.logger.info('p1', 'value %s', value)
+        self.assertEqual(value.count, 1)
+        self.assertEqual(self.logger.recent(), ['0 INFO p1: value formatted'])
+
+    def test_message_without_arguments_is_not_formatted(self):
+        self.logger.info('p1', '1-0:1.7.0(00.193*kW) 100%')
+        self.assertEqual(self.logger.recent(), ['0 INFO p1: 1-0:1.7.0(00.193*kW) 100%'])
+
+    def test_ring_buffer_keeps_the_newest_lines(self):
+        for i in range(5):
+            self.now = i
+            self.logger.info('main', 'line %d', i)
+        self.assertEqual(self.logger.recent(), ['2 INFO main: line 2', '3 INFO main: line 3', '4 INFO main: line 4'])
+        lines = []
+        self.logger.dump(lines.append)
+        self.assertEqual(''.join(lines), '2 INFO main: line 2\n3 INFO main: line 3\n4 INFO main: line 4\n')
+
+    def test_rate_limit_per_category(self):
+        self.logger.configure(DEBUG, 10, 2, False)
+        for i in range(5):
+            self.logger.warning('p1', 'CRC error %d', i)
+        self.logger.warning('wifi', 'WiFi connection lost')
+        self.now = 60000
+        self.logger.warning('p1', 'CRC error %d', 5)
+        self.assertEqual(self.logger.recent(), [
+            '0 WARNING p1: CRC error 0',
+            '0 WARNING p1: CRC error 1',
+            '0 WARNING wifi: WiFi connection lost',
+            '60000 WARNING p1: CRC error 5 (3 suppressed)',
+        ])
+
+    def test_status_sensors(self):
+        sensors = status_sensors(self.logger)
+        self.assertEqual(sensors['sensor.smartmeter_log_warnings']["state"](), '0')
+        self.logger.info('wifi', 'Connecting to WiFi...')
+        self.logger.warning('wifi', 'Failed to connect to WiFi: Timeout, retry in %d ms', 1000)
+        self.assertEqual(sensors['sensor.smartmeter_log_warnings']["state"](), '1')
+        self.assertEqual(sensors['sensor.smartmeter_log_last_warning']["state"](),
+                         '0 WARNING wifi: Failed to connect to WiFi: Timeout, retry in 1000 ms')
+        self.logger.warning('p1', 'x' * 300)
+        self.assertEqual(len(sensors['sensor.smartmeter_log_last_warning']["state"]()), 255)
+
+    def test_logging_from_two_threads(self):
+        self.logger.configure(DEBUG, 64, 5, False)
+        done = []
+
+        def core1():
+            for i in range(2000):
+                self.logger.warning('uart', 'line %d', i)
+            done.append(True)
+
+        _thread.start_new_thread(core1, ())
+        for i in range(2000):
+            self.logger.warning('wifi', 'line %d', i)
+        while not done:
+            time.sleep(0.01)
+        self.assertEqual(self.logger.warnings, 10)
+        self.assertEqual(len(self.logger.recent()), 10)
+
+    def test_disabled_buffer_and_levels(self):
+        self.logger.configure(WARNING, 0, 0, False)
+        self.logger.info('main', 'Reading meter...')
+        self.logger.warning('main', 'Publishing failed')
+        self.assertEqual(self.logger.recent(), [])
+        self.assertEqual(self.logger.warnings, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
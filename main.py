@@ -1,27 +1,46 @@
-from machine import UART, Pin, Timer, WDT
+from machine import UART, Pin, Timer, WDT, unique_id
 import network
-import ntptime
-import re
 import time
-import urequests
 
-from p1meter import read_p1_meter
-
-from config import WIFI_SSID, WIFI_PASSWORD, HOME_ASSISTANT_SENSOR_API, HOME_ASSISTANT_ACCESS_TOKEN
+# Only the parser, the log and the publish helpers every mode needs are
+# imported on reset. Network modules are imported once Wi-Fi is up, the
+# modules of the runtimes and optional features only when they are enabled.
+from log import LEVELS, logger, status_sensors as log_sensors
+from p1meter import TelegramParser, calculate_crc, parse_line, read_p1_meter
+from publish import PayloadTemplates, is_success, post_json, post_sensor, post_sensor_request, post_snapshot
+
+from config import WIFI_SSID, WIFI_PASSWORD, WIFI_NONBLOCKING, HOME_ASSISTANT_SENSOR_API, HOME_ASSISTANT_ACCESS_TOKEN
+from config import PUBLISH_MODE, HOME_ASSISTANT_BULK_API, HTTP_KEEP_ALIVE, PAYLOAD_TEMPLATES
+from config import PUBLISH_CHANGES_ONLY, FULL_REFRESH_CYCLES, RUNTIME, UART_READINTO
+from config import PUBLISH_INTERVAL_MS, PUBLISH_INTERVAL_MIN_MS, POWER_SWING_KW, SKIP_PARSE_BETWEEN_PUBLISHES
+from config import AGGREGATE_MEASUREMENTS, COMPACT_SNAPSHOT, INSTRUMENTATION
+from config import MQTT_BROKER, MQTT_PORT, MQTT_USER, MQTT_PASSWORD, MQTT_BATCHED, MQTT_CLIENT_ID
+from config import OFFLINE_LOG, OFFLINE_LOG_CAPACITY, OFFLINE_BACKFILL_API, OFFLINE_BACKFILL_BATCHES
+from config import PULL_SERVER, PULL_SERVER_PORT, METERS
+from config import GATEWAY, GATEWAY_PROTOCOL, GATEWAY_DEVICE_ID
+from config import LOG_LEVEL, LOG_PRINT, LOG_RATE_LIMIT, LOG_BUFFER_LINES, LOG_SENSORS
+
+logger.configure(LEVELS[LOG_LEVEL], LOG_BUFFER_LINES, LOG_RATE_LIMIT, LOG_PRINT)
 
 # Initialize watchdog with 8388ms timeout
 wdt = WDT(timeout=8388)
 
 wlan = network.WLAN(network.STA_IF)
-print("Reset WiFi")
+logger.info('wifi', 'Reset WiFi')
 wlan.disconnect()
 wlan.active(False)
 
-uart = UART(1, tx=Pin(4), rx=Pin(5),
-            baudrate=115200, bits=8, parity=None,
-            stop=1, invert=UART.INV_RX | UART.INV_TX,
-            timeout=1000, timeout_char=1000,
-            txbuf=2048, rxbuf=2048)
+def open_uart(uart_id, tx, rx, timeout):
+    return UART(uart_id, tx=Pin(tx), rx=Pin(rx),
+                baudrate=115200, bits=8, parity=None,
+                stop=1, invert=UART.INV_RX | UART.INV_TX,
+                timeout=timeout, timeout_char=timeout,
+                txbuf=2048, rxbuf=2048)
+
+
+# The asyncio runtime polls the UART, so reads must not block
+uart_timeout = 0 if RUNTIME == 'async' else 1000
+uart = None if METERS else open_uart(1, 4, 5, uart_timeout)
 
 # Solid LED WiFi is connecting, blinking LED WiFi is connected
 led = Pin('LED', Pin.OUT)
@@ -33,10 +52,12 @@ def tick(timer):
     else:
         led.on()
 
-tim = Timer()
-tim.init(freq=2.5, mode=Timer.PERIODIC, callback=tick)
+if RUNTIME != 'async':
+    tim = Timer()
+    tim.init(freq=2.5, mode=Timer.PERIODIC, callback=tick)
 
 epoch = time.time()
+clock_synced = False  # the RTC was set from NTP, offline readings are stamped with it
 wifi_connections = 0
 http_400_errors = 0
 http_500_errors = 0
@@ -48,8 +69,8 @@ exception_counts = {}  # Track counts of different exception types
 MAX_RETRIES = 3
 
 
-def get_utc_time_string():
-    current_time = time.localtime()
+def get_utc_time_string(seconds=None):
+    current_time = time.localtime(seconds)
     return "{:04}-{:02}-{:02} {:02}:{:02}:{:02}".format(
         current_time[0], current_time[1], current_time[2],  # Year, Month, Day
         current_time[3], current_time[4], current_time[5]   # Hour, Minute, Second
@@ -130,11 +151,12 @@ status_sensors = {
 }
 
 
-def count_exception(e):
+def count_exception(e, count=1):
     global exception_counts, status_sensors
     exception_name = type(e).__name__.lower()
 
     if isinstance(e, OSError):
+        import re  # compiled on the first error rather than at boot
         match = re.search(r'([A-Z_][A-Z_]+)', str(e))
         if match:
             error_name = match.group(0).lower()
@@ -144,7 +166,7 @@ def count_exception(e):
     else:
         exception_type = exception_name
 
-    exception_counts[exception_type] = exception_counts.get(exception_type, 0) + 1
+    exception_counts[exception_type] = exception_counts.get(exception_type, 0) + count
 
     # Add new sensor type if this is the first time we've seen this exception
     if exception_type not in [s.split('_')[-1] for s in status_sensors.keys() if s.startswith('sensor.smartmeter_exception_')]:
@@ -157,6 +179,72 @@ def count_exception(e):
         }
 
 
+class NotMeasured:
+    """Stands in for the stopwatches, heap watermarks and boot times when INSTRUMENTATION is off"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def lap(self):
+        pass
+
+    def reset(self):
+        pass
+
+    def sample(self):
+        pass
+
+    def reached(self, milestone, now):
+        pass
+
+
+# Where the time and memory go per publish window, published when INSTRUMENTATION is set
+STOPWATCHES = ('telegram_read', 'crc', 'parse', 'http_post', 'wifi_connect')
+if INSTRUMENTATION:
+    from instrument import BootTimes, MemoryWatermark, Stopwatch, status_sensors as instrument_sensors
+    stopwatches = {name: Stopwatch() for name in STOPWATCHES}
+    heap = MemoryWatermark()
+    boot = BootTimes()
+    status_sensors.update(instrument_sensors(stopwatches, heap, boot))
+else:
+    heap = boot = NotMeasured()
+    stopwatches = {name: heap for name in STOPWATCHES}
+if LOG_SENSORS:
+    status_sensors.update(log_sensors(logger))
+
+
+# Keep-alive connection to Home Assistant, a dead connection is counted and reopened
+http_client = None
+if HTTP_KEEP_ALIVE:
+    from http_client import HttpClient
+    http_client = HttpClient(on_error=count_exception)
+
+
+def urequests_post(url, **kw):
+    import urequests  # network only, imported on the first post
+    return urequests.post(url, **kw)
+
+
+http_post = http_client.post if HTTP_KEEP_ALIVE else urequests_post
+payload_templates = None
+if HTTP_KEEP_ALIVE and PAYLOAD_TEMPLATES:
+    payload_templates = PayloadTemplates(HOME_ASSISTANT_SENSOR_API, HOME_ASSISTANT_ACCESS_TOKEN)
+
+# One persistent MQTT connection, umqtt is only needed in mqtt mode
+mqtt_publisher = None
+if PUBLISH_MODE == 'mqtt':
+    from mqtt import MqttPublisher
+    from umqtt.simple import MQTTClient
+    mqtt_keepalive = max(60, 3 * PUBLISH_INTERVAL_MS // 1000)
+    mqtt_client_id = MQTT_CLIENT_ID or f'p1meter_{unique_id().hex()}'
+    mqtt_publisher = MqttPublisher(MQTTClient(mqtt_client_id, MQTT_BROKER, MQTT_PORT, MQTT_USER or None,
+                                              MQTT_PASSWORD or None, keepalive=mqtt_keepalive),
+                                   mqtt_client_id, batched=MQTT_BATCHED)
+
+
 def safe_sleep(seconds):
     """Sleep while keeping the watchdog fed"""
     start = time.time()
@@ -165,125 +253,577 @@ def safe_sleep(seconds):
         time.sleep(0.1)
 
 
-def sync_time_with_ntp():
-    global epoch
+def sync_time_with_ntp(attempts=MAX_RETRIES):
+    """Set the RTC from NTP, returns True when it succeeded"""
+    global epoch, clock_synced
 
-    for attempt in range(MAX_RETRIES):
+    for attempt in range(attempts):
         try:
             uptime = time.time() - epoch
+            import ntptime  # network only, imported once Wi-Fi is up
             ntptime.settime()
             epoch = time.time() - uptime # adjust uptime due to RTC change
-            break
+            clock_synced = True
+            return True
         except Exception as e:
-            print(f"ntp failed {e}")
+            logger.warning('ntp', 'ntp failed %s', e)
             count_exception(e)
-            safe_sleep(1)
+            if attempt + 1 < attempts:
+                safe_sleep(1)
+    return False
+
+
+def on_wifi_connected():
+    global wifi_connections, ntp_pending
+
+    if http_client:
+        http_client.close()  # sockets belong to the previous connection
+    if mqtt_publisher:
+        mqtt_publisher.close()
+    ntp_pending = True
+    if ntp_retry:
+        ntp_retry.reset()
+    logger.info('wifi', 'Connected to WiFi with RSSI: %s', wlan.status('rssi'))
+    wifi_connections += 1
+
+
+wifi = None
+ntp_pending = False
+ntp_retry = None
+if WIFI_NONBLOCKING:
+    from wifi import CONNECTED, Retry, WifiManager
+    wifi = WifiManager(wlan, WIFI_SSID, WIFI_PASSWORD, on_connected=on_wifi_connected)
+    ntp_retry = Retry()  # a failed NTP sync blocks for its timeout, so it is retried with backoff
+
+
+def poll_wifi():
+    """Advance the non-blocking WiFi state machine, with one NTP attempt when due until the time is set"""
+    global ntp_pending
+
+    with stopwatches['wifi_connect']:
+        now = time.ticks_ms()
+        connected = wifi.poll(now) == CONNECTED
+        if connected and ntp_pending and ntp_retry.due(now):
+            ntp_pending = not sync_time_with_ntp(attempts=1)
+            if ntp_pending:
+                ntp_retry.failed(now)
+    return connected
 
 
 def wifi_connect():
-    global wifi_connections
-    
+    if WIFI_NONBLOCKING:
+        return poll_wifi()  # the main loop keeps reading while the state machine reconnects
+
     if not wlan.isconnected():
-        # Reset wifi module
-        wlan.active(False)
-        safe_sleep(0.2)
-        wlan.active(True)
-
-        print("Connecting to WiFi...")
-        wlan.connect(WIFI_SSID, WIFI_PASSWORD)
-        
-        timeout_time = time.time() + 10
-        while not wlan.isconnected():
-            if time.time() > timeout_time:
-                print("Failed to connect to WiFi: Timeout")
-                return False
-            safe_sleep(1)
+        with stopwatches['wifi_connect']:
+            return reconnect_wifi()
+    return True
 
-        sync_time_with_ntp()
 
-        print(f"Connected to WiFi with RSSI: {wlan.status('rssi')}")
-        wifi_connections += 1        
-        return True
+def reconnect_wifi():
+    # Reset wifi module
+    wlan.active(False)
+    safe_sleep(0.2)
+    wlan.active(True)
+
+    logger.info('wifi', 'Connecting to WiFi...')
+    wlan.connect(WIFI_SSID, WIFI_PASSWORD)
+
+    timeout_time = time.time() + 10
+    while not wlan.isconnected():
+        if time.time() > timeout_time:
+            logger.warning('wifi', 'Failed to connect to WiFi: Timeout')
+            return False
+        safe_sleep(1)
+
+    on_wifi_connected()
+    sync_time_with_ntp()
     return True
 
 
-def post_sensor(sensor_id, sensor_data):
+def check_response(name, status_code, text):
     global http_400_errors, http_500_errors
-    
-    url = f"{HOME_ASSISTANT_SENSOR_API}/{sensor_id}"
-    headers = {
-        "Authorization": f"Bearer {HOME_ASSISTANT_ACCESS_TOKEN}",
-        "Content-Type": "application/json",
-    }
-    payload = {
-        "state": sensor_data["state"]() if callable(sensor_data["state"]) else sensor_data["state"],
-        "attributes": sensor_data["attributes"]
-    }
-
-    response = None
-    try:
-        response = urequests.post(url, json=payload, headers=headers, timeout=1)
-        if response.status_code == 200 or response.status_code == 201:
-            print(f"Successfully updated {sensor_id}")
-        elif response.status_code >= 400 and response.status_code < 500:
-            print(f"Client error updating {sensor_id}: {response.status_code} {response.text}")
-            http_400_errors += 1
-        else:
-            print(f"Server error updating {sensor_id}: {response.status_code} {response.text}")
-            http_500_errors += 1
-    finally:
-        if response:
-            response.close()
 
+    if is_success(status_code):
+        logger.debug('http', 'Successfully updated %s', name)
+    elif status_code >= 400 and status_code < 500:
+        logger.warning('http', 'Client error updating %s: %s %s', name, status_code, text)
+        http_400_errors += 1
+    else:
+        logger.warning('http', 'Server error updating %s: %s %s', name, status_code, text)
+        http_500_errors += 1
+    return is_success(status_code)
 
-def publish_sensors(sensors):
+
+def publish_each_sensor(sensors):
     for sensor_id, sensor_data in sensors.items():
+        poll_meters()
         for attempt in range(MAX_RETRIES):
             try:
                 wdt.feed()
-                post_sensor(sensor_id, sensor_data)
+                with stopwatches['http_post']:
+                    if payload_templates:
+                        status_code, text = post_sensor_request(http_client, payload_templates, sensor_id, sensor_data)
+                    else:
+                        status_code, text = post_sensor(http_post, HOME_ASSISTANT_SENSOR_API,
+                                                        HOME_ASSISTANT_ACCESS_TOKEN, sensor_id, sensor_data)
+                check_response(sensor_id, status_code, text)
                 break # Break if publish is successful
             except Exception as e:
-                print(f"Publish error for sensor '{sensor_id}': {e}")
+                logger.warning('http', "Publish error for sensor '%s': %s", sensor_id, e)
                 count_exception(e)
                 if not wifi_connect():
                     return False
     return True
 
 
-# Set to allow immediate publishing on the first iteration
-last_publish_time = time.ticks_ms() - 60000
-last_known_good_values = {}
+def publish_snapshot(sensors):
+    """Publish all sensors in one request, returns None if the bulk endpoint rejected it"""
+    for attempt in range(MAX_RETRIES):
+        try:
+            wdt.feed()
+            with stopwatches['http_post']:
+                status_code, text = post_snapshot(http_post, HOME_ASSISTANT_BULK_API,
+                                                  HOME_ASSISTANT_ACCESS_TOKEN, sensors)
+            return True if check_response("snapshot", status_code, text) else None
+        except Exception as e:
+            logger.warning('http', 'Publish error for snapshot: %s', e)
+            count_exception(e)
+            if not wifi_connect():
+                return False
+    return False
 
-while True:
-    try:
-        wdt.feed()
-        loop_time = time.ticks_ms()
 
-        print("Reading meter...")
-        p1_sensors, error_type = read_p1_meter(uart.readline)
+def publish_mqtt(sensors):
+    for attempt in range(MAX_RETRIES):
+        try:
+            wdt.feed()
+            mqtt_publisher.publish(sensors)
+            logger.debug('mqtt', 'Successfully published %d sensors to MQTT', len(sensors))
+            return True
+        except Exception as e:
+            logger.warning('mqtt', 'MQTT publish error: %s', e)
+            count_exception(e)
+            if not wifi_connect():
+                return False
+    return False
+
 
-        if error_type is None and p1_sensors is not None:
-            last_known_good_values = p1_sensors
-        else:
-            p1_sensors = last_known_good_values
-            if error_type == "timeout":
-                p1_timeout_errors += 1
-            elif error_type == "decode":
-                p1_decode_errors += 1
-            elif error_type == "crc":
-                p1_crc_errors += 1
-            elif error_type == "format":
-                p1_format_errors += 1
-
-        current_time = time.ticks_ms()
-        if time.ticks_diff(current_time, last_publish_time) >= 60000:
-            last_publish_time = current_time
-            p1_sensors.update(status_sensors)
-            if not publish_sensors(p1_sensors):
-                print("Publishing failed")
+def publish_sensors(sensors):
+    if not sensors and not mqtt_publisher:
+        return True  # nothing changed since the last cycle
+    if WIFI_NONBLOCKING and not wifi.isconnected():
+        return False
+    if mqtt_publisher:
+        return publish_mqtt(sensors)  # pings the broker when nothing changed
+    if PUBLISH_MODE == 'bulk' and HOME_ASSISTANT_BULK_API:
+        published = publish_snapshot(sensors)
+        if published is not None:
+            return published
+        logger.warning('http', 'Bulk publish rejected, falling back to per sensor publish')
+    return publish_each_sensor(sensors)
+
+
+def record_reading(p1_sensors, error_type):
+    """Count read errors, returns True if p1_sensors is a valid telegram"""
+    global last_known_good_values
+
+    if error_type is None and p1_sensors is not None:
+        boot.reached('first_telegram', time.ticks_ms())
+        last_known_good_values = p1_sensors
+        if AGGREGATE_MEASUREMENTS:
+            aggregator.add(p1_sensors)
+        return True
+
+    count_read_error(error_type)
+    return False
+
+
+def count_read_error(error_type, count=1):
+    global p1_timeout_errors, p1_decode_errors, p1_crc_errors, p1_format_errors
+
+    if error_type == "timeout":
+        p1_timeout_errors += count
+    elif error_type == "decode":
+        p1_decode_errors += count
+    elif error_type == "crc":
+        p1_crc_errors += count
+    elif error_type == "format":
+        p1_format_errors += count
+
+
+def prepare_publish(p1_sensors):
+    """The sensors of one publish cycle, copied so the reader can commit the next telegram meanwhile"""
+    sensors = dict(p1_sensors.items())
+    if AGGREGATE_MEASUREMENTS:
+        sensors.update(aggregates())
+    sensors.update(status_sensors)
+    if PUBLISH_CHANGES_ONLY:
+        sensors = delta_publisher.changed(sensors)
+    return sensors
+
+
+def aggregates():
+    """The min/max/mean sensors of the window, the next window starts"""
+    if meter_group:
+        return meter_group.aggregates()
+    sensors = aggregator.sensors()
+    aggregator.reset()
+    return sensors
+
+
+def deliver_backfill(records, describe):
+    payload = backfill_payload(records, get_utc_time_string, describe)
+    try:
+        wdt.feed()
+        if mqtt_publisher:
+            mqtt_publisher.publish_backfill(payload)
+            return True
+        with stopwatches['http_post']:
+            status_code, text = post_json(http_post, OFFLINE_BACKFILL_API, HOME_ASSISTANT_ACCESS_TOKEN, payload)
+        return check_response("backfill", status_code, text)
     except Exception as e:
-        print(f"Error in main loop: {e}")
+        logger.warning('backfill', 'Backfill error: %s', e)
         count_exception(e)
-        safe_sleep(1)
-        continue
+        return False
+
+
+def finish_publish(sensors, published):
+    for stopwatch in stopwatches.values():
+        stopwatch.reset()  # the next window starts
+    heap.reset()
+
+    if not published:
+        logger.warning('main', 'Publishing failed')
+        for offline_log, describe, latest in offline_logs:
+            sensors = latest()
+            if sensors:
+                offline_log.append(time.time() if clock_synced else UNSYNCED, registers(sensors, describe))
+        return
+
+    boot.reached('first_publish', time.ticks_ms())
+    if PUBLISH_CHANGES_ONLY:
+        delta_publisher.commit(sensors)
+    for offline_log, describe, latest in offline_logs:
+        if offline_log.pending():
+            sent = offline_log.drain(lambda records: deliver_backfill(records, describe),
+                                     max_batches=OFFLINE_BACKFILL_BATCHES)
+            logger.info('backfill', 'Backfilled %d offline readings of %s, %d pending', sent, offline_log.path,
+                        offline_log.pending())
+
+
+last_known_good_values = {}
+delta_publisher = None
+if PUBLISH_CHANGES_ONLY:
+    from delta import DeltaPublisher
+    delta_publisher = DeltaPublisher(FULL_REFRESH_CYCLES)
+aggregator = None
+if AGGREGATE_MEASUREMENTS and not METERS:
+    from aggregate import MEASUREMENT_CODES, Aggregator
+    aggregator = Aggregator()  # with METERS every meter aggregates its own sensors
+
+# The latest readings for Home Assistant's REST sensor or Prometheus to scrape
+pull_server = None
+if PULL_SERVER:
+    from pull_server import PullServer
+    pull_server = PullServer(lambda: (last_known_good_values, status_sensors), PULL_SERVER_PORT)
+
+
+def open_meter(meter):
+    if 'pio' in meter:
+        from pio_uart import PioUart
+        meter_uart = PioUart(meter['pio'], meter['rx'])
+    else:
+        meter_uart = open_uart(meter['uart'], meter['tx'], meter['rx'], 0)
+    return Meter(meter_uart, meter.get('prefix', 'dsmr'), meter.get('name'), COMPACT_SNAPSHOT, now=time.ticks_ms(),
+                 aggregate=AGGREGATE_MEASUREMENTS)
+
+
+# Several P1 ports read in turn without blocking, see METERS in config.py
+meter_group = None
+if METERS:
+    from meters import Meter, MeterGroup, status_sensors as meter_sensors
+    meter_group = MeterGroup([open_meter(meter) for meter in METERS])
+    status_sensors.update(meter_sensors(meter_group.meters))
+
+# Readings that could not be published, forwarded once the connection is back.
+# (ring log, describe, latest sensors) per meter, offline.log for the dsmr meter.
+offline_logs = []
+if OFFLINE_LOG and (mqtt_publisher or OFFLINE_BACKFILL_API):
+    from ring_log import UNSYNCED, RingLog, backfill_payload, registers
+    if meter_group:
+        for meter in meter_group.meters:
+            path = 'offline.log' if meter.prefix == 'dsmr' else f'offline_{meter.prefix}.log'
+            offline_logs.append((RingLog(path, OFFLINE_LOG_CAPACITY, wdt.feed), meter.describe,
+                                 lambda m=meter: m.sensors))
+    else:
+        from obis_codes import describe
+        offline_logs.append((RingLog('offline.log', OFFLINE_LOG_CAPACITY, wdt.feed), describe,
+                             lambda: last_known_good_values))
+
+
+def on_meter_telegram(meter, p1_sensors, error_type):
+    end_of_telegram()
+    if error_type:
+        count_read_error(error_type)
+        return
+    boot.reached('first_telegram', time.ticks_ms())  # the meter aggregated the telegram
+
+
+def poll_meters():
+    """Scan what the meters sent so far, also between requests while publishing"""
+    if meter_group:
+        return meter_group.poll(time.ticks_ms(), on_meter_telegram)
+    return 0
+
+
+def new_parser():
+    snapshot = None
+    if COMPACT_SNAPSHOT:
+        from snapshot import Snapshot
+        snapshot = Snapshot()
+    parser = TelegramParser(snapshot=snapshot)
+    if INSTRUMENTATION:
+        parser.checksum = stopwatches['crc'].accumulate(calculate_crc)
+        parser.tokenise = stopwatches['parse'].accumulate(parse_line)
+    return parser
+
+
+def end_of_telegram():
+    stopwatches['crc'].lap()
+    stopwatches['parse'].lap()
+    heap.sample()
+
+
+def run():
+    from scheduler import POWER_OBIS_CODE, PublishScheduler, instantaneous_power
+
+    parser = new_parser()
+    if UART_READINTO:
+        from uart_reader import FrameReader
+        read_telegram = FrameReader(uart, parser).read_telegram
+    else:
+        read_telegram = lambda: read_p1_meter(uart.readline, parser)
+
+    scheduler = PublishScheduler(PUBLISH_INTERVAL_MS, PUBLISH_INTERVAL_MIN_MS, POWER_SWING_KW)
+    partial_codes = set(MEASUREMENT_CODES) if AGGREGATE_MEASUREMENTS else {POWER_OBIS_CODE}
+    retried = False  # a failed telegram was due and its publish put off
+
+    while True:
+        try:
+            wdt.feed()
+            if WIFI_NONBLOCKING:
+                poll_wifi()
+
+            # Between publishes only the codes needed for the interval and the
+            # aggregates are tokenised
+            publish_due = scheduler.due(time.ticks_ms())
+            full_parse = publish_due or not SKIP_PARSE_BETWEEN_PUBLISHES
+            parser.wanted = None if full_parse else partial_codes
+
+            logger.debug('main', 'Reading meter...')
+            with stopwatches['telegram_read']:
+                p1_sensors, error_type = read_telegram()
+            end_of_telegram()
+            if full_parse:
+                record_reading(p1_sensors, error_type)
+            elif error_type:
+                count_read_error(error_type)
+            else:
+                boot.reached('first_telegram', time.ticks_ms())
+                if AGGREGATE_MEASUREMENTS:
+                    aggregator.add(p1_sensors)
+
+            current_time = time.ticks_ms()
+            if not publish_due:
+                scheduler.observe(instantaneous_power(p1_sensors))
+            elif error_type and SKIP_PARSE_BETWEEN_PUBLISHES and not retried:
+                # The last good values are a whole interval old, the publish
+                # stays due and the next telegram is parsed in full
+                retried = True
+            else:
+                sensors = prepare_publish(last_known_good_values)
+                finish_publish(sensors, publish_sensors(sensors))
+                scheduler.published(current_time, instantaneous_power(last_known_good_values))
+                retried = False
+
+            # Right after a telegram the UART is idle for most of a second
+            if pull_server:
+                pull_server.poll()
+        except Exception as e:
+            logger.error('main', 'Error in main loop: %s', e)
+            count_exception(e)
+            safe_sleep(1)
+            continue
+
+
+async def publish_yielding(sensors):
+    """Publish one sensor at a time, letting the reader task drain the UART between posts"""
+    if mqtt_publisher or (PUBLISH_MODE == 'bulk' and HOME_ASSISTANT_BULK_API):
+        return publish_sensors(sensors)
+    return await publish_each(sensors, publish_sensors)
+
+
+async def publish_telegram(p1_sensors):
+    sensors = prepare_publish(p1_sensors if p1_sensors is not None else last_known_good_values)
+    finish_publish(sensors, await publish_yielding(sensors))
+
+
+def run_async():
+    global publish_each  # used by publish_yielding
+    from runtime import (asyncio, Mailbox, read_telegrams, publish_each, publish_periodically, feed_watchdog,
+                         blink_led, poll_periodically)
+
+    mailbox = Mailbox()
+
+    def on_telegram(p1_sensors, error_type):
+        end_of_telegram()
+        if record_reading(p1_sensors, error_type):
+            mailbox.put(p1_sensors)
+
+    async def main():
+        asyncio.create_task(feed_watchdog(wdt))
+        asyncio.create_task(blink_led(led, wlan.isconnected))
+        if WIFI_NONBLOCKING:
+            asyncio.create_task(poll_periodically(poll_wifi, 200, count_exception))
+        if pull_server:
+            asyncio.create_task(poll_periodically(pull_server.poll, 100, count_exception))
+        asyncio.create_task(publish_periodically(mailbox, publish_telegram, PUBLISH_INTERVAL_MS, count_exception))
+        await read_telegrams(asyncio.StreamReader(uart), on_telegram, count_exception, parser=new_parser())
+
+    asyncio.run(main())
+
+
+def run_dual_core():
+    from dual_core import BusyMeter, TelegramHandoff, start_reader
+
+    handoff = TelegramHandoff()
+    publisher_busy = BusyMeter()
+
+    status_sensors['sensor.smartmeter_core0_busy'] = {
+        "state": lambda: f"{publisher_busy.percent():.1f}",
+        "attributes": {
+            "unit_of_measurement": "%",
+            "friendly_name": "Core 0 busy"
+            }
+        }
+    status_sensors['sensor.smartmeter_core1_busy'] = {
+        "state": lambda: f"{handoff.reader_percent():.1f}",
+        "attributes": {
+            "unit_of_measurement": "%",
+            "friendly_name": "Core 1 busy"
+            }
+        }
+
+    start_reader(uart.readline, handoff)
+
+    # Set to allow immediate publishing on the first iteration
+    last_publish_time = time.ticks_ms() - PUBLISH_INTERVAL_MS
+
+    while True:
+        try:
+            # A stalled reader on core 1 is left to the watchdog
+            if handoff.reader_alive(5000):
+                wdt.feed()
+            if WIFI_NONBLOCKING:
+                poll_wifi()
+
+            publisher_busy.begin()
+            p1_sensors, errors = handoff.take()
+            if p1_sensors is not None:
+                record_reading(p1_sensors, None)
+            for error_type, count in errors.items():
+                count_read_error(error_type, count)
+            for e, count in handoff.take_exceptions():
+                count_exception(e, count)
+
+            current_time = time.ticks_ms()
+            if time.ticks_diff(current_time, last_publish_time) >= PUBLISH_INTERVAL_MS:
+                last_publish_time = current_time
+                sensors = prepare_publish(last_known_good_values)
+                finish_publish(sensors, publish_sensors(sensors))
+                publisher_busy.reset()
+                handoff.reset_reader_busy()
+            if pull_server:
+                pull_server.poll()
+            publisher_busy.end()
+
+            time.sleep_ms(100)
+        except Exception as e:
+            logger.error('main', 'Error in main loop: %s', e)
+            count_exception(e)
+            safe_sleep(1)
+            continue
+
+
+def run_meters():
+    global last_known_good_values
+
+    # Set to allow immediate publishing on the first iteration
+    last_publish_time = time.ticks_ms() - PUBLISH_INTERVAL_MS
+
+    while True:
+        try:
+            wdt.feed()
+            if WIFI_NONBLOCKING:
+                poll_wifi()
+
+            if not poll_meters():
+                time.sleep_ms(10)
+
+            current_time = time.ticks_ms()
+            if time.ticks_diff(current_time, last_publish_time) >= PUBLISH_INTERVAL_MS:
+                last_publish_time = current_time
+                p1_sensors = meter_group.sensors()
+                if p1_sensors is not None:
+                    last_known_good_values = p1_sensors  # telegrams were counted and aggregated as they came
+                sensors = prepare_publish(last_known_good_values)
+                finish_publish(sensors, publish_sensors(sensors))
+
+            if pull_server:
+                pull_server.poll()
+        except Exception as e:
+            logger.error('main', 'Error in main loop: %s', e)
+            count_exception(e)
+            safe_sleep(1)
+            continue
+
+
+def run_thin():
+    """Send the raw telegrams to the gateway, which parses and publishes them"""
+    from thin import GatewayLink, TelegramFramer, read_frame
+
+    host, port = GATEWAY.rsplit(':', 1)
+    link = GatewayLink(host, int(port), GATEWAY_DEVICE_ID or unique_id().hex(), GATEWAY_PROTOCOL,
+                       on_error=count_exception)
+    framer = TelegramFramer()
+
+    while True:
+        try:
+            wdt.feed()
+            connected = wifi_connect()
+
+            with stopwatches['telegram_read']:
+                telegram, error_type = read_frame(uart.readline, framer)
+            if error_type:
+                count_read_error(error_type)
+            elif connected:
+                link.send(telegram)
+        except Exception as e:
+            logger.error('main', 'Error in main loop: %s', e)
+            count_exception(e)
+            safe_sleep(1)
+            continue
+
+
+boot.reached('ready', time.ticks_ms())
+if GATEWAY:
+    run_thin()
+elif METERS:
+    run_meters()
+elif RUNTIME == 'async':
+    run_async()
+elif RUNTIME == 'dual_core':
+    run_dual_core()
+else:
+    run()
@@ -0,0 +1,13 @@
+# Freeze the device modules into the firmware, their bytecode then runs from
+# flash instead of being loaded into the heap at every reset:
+#
+#   make -C ports/rp2 BOARD=RPI_PICO_W FROZEN_MANIFEST=/path/to/p1meter/manifest.py
+#
+# After flashing copy main.py, p1meter_app.mpy and config.py from build/
+# (see build.py) to the board. Keep DEVICE_MODULES in build.py in sync.
+include("$(BOARD_DIR)/manifest.py")
+
+for name in ('aggregate', 'compat', 'delta', 'dual_core', 'http_client', 'instrument', 'log', 'meters', 'mqtt',
+             'obis_codes', 'p1meter', 'pio_uart', 'publish', 'pull_server', 'ring_log', 'runtime', 'scheduler',
+             'snapshot', 'thin', 'uart_reader', 'wifi'):
+    module(name + '.py')
@@ -0,0 +1,99 @@
+from compat import ticks_diff
+from obis_codes import DEFAULT_PREFIX, describer
+from p1meter import TelegramParser
+from snapshot import Snapshot
+from uart_reader import FrameReader
+
+
+class Meter:
+    """One P1 port with its own frame state and sensor ids sensor.<prefix>_*.
+
+    The UART must not block (timeout=0), poll() scans whatever arrived and
+    reports a timeout when no telegram completed for timeout_ms. With
+    aggregate every telegram is added to an Aggregator of the meter's own
+    sensor ids.
+    """
+
+    def __init__(self, uart, prefix=DEFAULT_PREFIX, name=None, compact=False, timeout_ms=5000, now=0,
+                 aggregate=False):
+        describe = describer(prefix, name)
+        self.prefix = prefix
+        self.describe = describe
+        self.aggregator = None
+        if aggregate:
+            from aggregate import Aggregator
+            self.aggregator = Aggregator(describe=describe)
+        self.parser = TelegramParser(snapshot=Snapshot(describe) if compact else None, describe=describe)
+        self.reader = FrameReader(uart, self.parser)
+        self.timeout_ms = timeout_ms
+        self.last_telegram = now
+        self.sensors = None
+        self.errors = 0
+
+    def poll(self, now):
+        """Returns (data, error_type) once a telegram completed or timed out, None before"""
+        result = self.reader.poll()
+        if result is None:
+            if ticks_diff(now, self.last_telegram) < self.timeout_ms:
+                return None
+            self.reader.reset()
+            result = None, "timeout"
+        self.last_telegram = now
+        data, error_type = result
+        if error_type:
+            self.errors += 1
+        else:
+            self.sensors = data
+            if self.aggregator:
+                self.aggregator.add(data)
+        return result
+
+
+class MeterGroup:
+    """Meters polled in turn without blocking, their latest telegrams merged into one set of sensors"""
+
+    def __init__(self, meters):
+        self.meters = meters
+
+    def poll(self, now, on_telegram):
+        """Poll every meter once, calls on_telegram(meter, data, error_type) per result, returns their number"""
+        results = 0
+        for meter in self.meters:
+            result = meter.poll(now)
+            if result:
+                on_telegram(meter, *result)
+                results += 1
+        return results
+
+    def sensors(self):
+        """The latest sensors of every meter in one dict, None before the first telegram"""
+        merged = None
+        for meter in self.meters:
+            if meter.sensors is not None:
+                if merged is None:
+                    merged = {}
+                merged.update(meter.sensors.items())
+        return merged
+
+    def aggregates(self):
+        """The min/max/mean sensors of every meter since the last call"""
+        sensors = {}
+        for meter in self.meters:
+            if meter.aggregator:
+                sensors.update(meter.aggregator.sensors())
+                meter.aggregator.reset()
+        return sensors
+
+
+def status_sensors(meters, prefix='sensor.smartmeter_'):
+    """Read errors per meter"""
+    sensors = {}
+    for meter in meters:
+        sensors[f'{prefix}{meter.prefix}_read_errors'] = {
+            "state": lambda m=meter: str(m.errors),
+            "attributes": {
+                "unit_of_measurement": "",
+                "friendly_name": f"{meter.prefix.replace('_', ' ').capitalize()} read errors"
+            }
+        }
+    return sensors
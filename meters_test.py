@@ -0,0 +1,76 @@
+import io
+import unittest
+
+from meters import Meter, MeterGroup, status_sensors
+from snapshot import Snapshot
+from uart_reader_test import FileUart, telegram
+
+
+class MeterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.main = Meter(FileUart(io.BytesIO(telegram * 2), chunk=64))
+        self.sub = Meter(FileUart(io.BytesIO(telegram), chunk=200), prefix='heat_pump', name='Heat pump',
+                         compact=True)
+        self.group = MeterGroup([self.main, self.sub])
+        self.telegrams = []
+
+    def on_telegram(self, meter, data, error_type):
+        self.telegrams.append((meter.prefix, error_type))
+
+    def poll(self, times, now=0):
+        for _ in range(times):
+            self.group.poll(now, self.on_telegram)
+
+    def test_meters_read_concurrently(self):
+        self.assertIsNone(self.group.sensors())
+        self.poll(10)
+        self.assertEqual(self.telegrams, [('heat_pump', None)])
+        self.poll(50)
+        self.assertEqual(self.telegrams, [('heat_pump', None), ('dsmr', None), ('dsmr', None)])
+        self.assertIsInstance(self.sub.sensors, Snapshot)
+
+    def test_merged_sensors_prefixed(self):
+        self.poll(60)
+        sensors = self.group.sensors()
+        self.assertEqual(len(sensors), 2 * 27)
+        self.assertEqual(sensors['sensor.dsmr_total_energy_import']['state'], '00042741.128')
+        heat_pump = sensors['sensor.heat_pump_total_energy_import']
+        self.assertEqual(heat_pump['state'], '00042741.128')
+        self.assertEqual(heat_pump['attributes']['friendly_name'], 'Heat pump Total Energy Import')
+        self.assertEqual(sensors['sensor.dsmr_total_energy_import']['attributes']['friendly_name'],
+                         'Total Energy Import')
+
+    def test_timeout_per_meter(self):
+        self.poll(60)
+        self.telegrams = []
+        self.poll(1, now=4999)
+        self.assertEqual(self.telegrams, [])
+        self.poll(1, now=6000)
+        self.assertEqual(self.telegrams, [('dsmr', 'timeout'), ('heat_pump', 'timeout')])
+        self.assertEqual(self.main.errors, 1)
+        self.assertIsNotNone(self.main.sensors)  # the last good telegram is kept
+
+    def test_aggregates_per_meter(self):
+        self.main = Meter(FileUart(io.BytesIO(telegram), chunk=64), aggregate=True)
+        self.sub = Meter(FileUart(io.BytesIO(telegram), chunk=200), prefix='heat_pump', name='Heat pump',
+                         compact=True, aggregate=True)
+        self.group = MeterGroup([self.main, self.sub])
+        self.poll(60)
+        aggregates = self.group.aggregates()
+        self.assertEqual(aggregates['sensor.dsmr_current_power_l1_max']['state'], '0.200')
+        heat_pump = aggregates['sensor.heat_pump_current_power_l1_max']
+        self.assertEqual(heat_pump['state'], '0.200')
+        self.assertEqual(heat_pump['attributes']['friendly_name'], 'Heat pump Current Power L1 max')
+        self.assertEqual(self.group.aggregates(), {})
+
+    def test_status_sensors(self):
+        sensors = status_sensors(self.group.meters)
+        self.poll(1, now=6000)
+        self.assertEqual(sensors['sensor.smartmeter_heat_pump_read_errors']['state'](), '1')
+        self.assertEqual(sensors['sensor.smartmeter_heat_pump_read_errors']['attributes']['friendly_name'],
+                         'Heat pump read errors')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+import json
+
+from publish import sensor_state
+
+DISCOVERY_PREFIX = 'homeassistant'
+# Client id, base topic and device of one board, main.py derives it from the board's unique id
+DEFAULT_DEVICE_ID = 'p1meter'
+
+
+def object_id(sensor_id):
+    return sensor_id.split('.', 1)[-1]
+
+
+def device(device_id):
+    return {"identifiers": [device_id], "name": f"P1 meter {device_id}", "manufacturer": "p1meter"}
+
+
+def discovery_config(sensor_id, attributes, state_topic, availability_topic, batched, device_id=DEFAULT_DEVICE_ID):
+    """Home Assistant MQTT discovery payload built from the sensor attributes"""
+    config = {
+        "name": attributes.get("friendly_name", sensor_id),
+        "unique_id": f'{device_id}_{object_id(sensor_id)}',
+        "object_id": f'{device_id}_{object_id(sensor_id)}',
+        "state_topic": state_topic,
+        "availability_topic": availability_topic,
+        "device": device(device_id),
+    }
+    if batched:
+        config["value_template"] = "{{ value_json." + object_id(sensor_id) + " }}"
+    if attributes.get("unit_of_measurement"):
+        config["unit_of_measurement"] = attributes["unit_of_measurement"]
+    for name in ("device_class", "state_class"):
+        if attributes.get(name):
+            config[name] = attributes[name]
+    return config
+
+
+class MqttPublisher:
+    """Publishes sensors over one persistent umqtt.simple compatible connection.
+
+    Every sensor is announced to Home Assistant with a retained discovery
+    config the first time it is published, so the entities survive a Home
+    Assistant restart. States are retained messages on <device_id>/<object_id>,
+    or when batched a single JSON object on <device_id>/state holding the
+    latest state of every sensor published so far. The last will marks the
+    sensors unavailable when the connection is lost. device_id must be unique
+    per board and is also the MQTT client id, so boards sharing a broker
+    neither disconnect each other nor mix up their states and entities.
+    umqtt.simple only talks to the broker when asked to, so a cycle without
+    changes pings it to keep the session within the keepalive.
+    """
+
+    def __init__(self, client, device_id=DEFAULT_DEVICE_ID, discovery_prefix=DISCOVERY_PREFIX, batched=False):
+        self.client = client
+        self.device_id = device_id
+        self.discovery_prefix = discovery_prefix
+        self.batched = batched
+        self.availability_topic = f'{device_id}/status'
+        self.announced = set()
+        self.states = {}
+        self.connected = False
+        client.set_last_will(self.availability_topic, b'offline', retain=True)
+
+    def connect(self):
+        self.client.connect()
+        self.connected = True
+        self.client.publish(self.availability_topic, b'online', retain=True)
+
+    def close(self):
+        if self.connected:
+            try:
+                self.client.disconnect()
+            except OSError:
+                pass
+        self.connected = False
+
+    def state_topic(self, sensor_id):
+        if self.batched:
+            return f'{self.device_id}/state'
+        return f'{self.device_id}/{object_id(sensor_id)}'
+
+    def announce(self, sensor_id, attributes):
+        config = discovery_config(sensor_id, attributes, self.state_topic(sensor_id),
+                                  self.availability_topic, self.batched, self.device_id)
+        topic = f'{self.discovery_prefix}/sensor/{self.device_id}/{object_id(sensor_id)}/config'
+        self.client.publish(topic, json.dumps(config), retain=True)
+        self.announced.add(sensor_id)
+
+    def publish_backfill(self, payload):
+        """Publish readings stored while offline on <device_id>/backfill, not retained"""
+        try:
+            if not self.connected:
+                self.connect()
+            self.client.publish(f'{self.device_id}/backfill', json.dumps(payload))
+        except OSError:
+            self.close()
+            raise
+
+    def ping(self):
+        """Send PINGREQ, the PINGRESP of the previous ping is read without waiting"""
+        self.client.ping()
+        self.client.check_msg()
+
+    def publish(self, sensors):
+        """Publish the sensor states or ping when there are none, raises OSError when the connection fails"""
+        try:
+            if not self.connected:
+                self.connect()
+            if not sensors:
+                self.ping()
+                return
+            for sensor_id, sensor_data in sensors.items():
+                if sensor_id not in self.announced:
+                    self.announce(sensor_id, sensor_data["attributes"])
+
+            if self.batched:
+                for sensor_id, sensor_data in sensors.items():
+                    self.states[object_id(sensor_id)] = sensor_state(sensor_data)
+                self.client.publish(self.state_topic(None), json.dumps(self.states), retain=True)
+            else:
+                for sensor_id, sensor_data in sensors.items():
+                    self.client.publish(self.state_topic(sensor_id), sensor_state(sensor_data), retain=True)
+        except OSError:
+            self.close()
+            raise
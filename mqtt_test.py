@@ -0,0 +1,193 @@
+import json
+import unittest
+
+from mqtt import MqttPublisher, discovery_config
+from p1meter import read_p1_meter
+from p1meter_test import p1_test_readline
+
+
+class FakeBroker:
+    """In-process stand-in for an MQTT broker keeping the retained messages"""
+
+    def __init__(self):
+        self.connections = 0
+        self.sessions = {}  # client id -> the connected client
+        self.messages = []
+        self.retained = {}
+        self.fail_publish = False
+
+    def deliver(self, topic, msg, retain):
+        topic = topic.decode() if isinstance(topic, bytes) else topic
+        msg = msg.decode() if isinstance(msg, bytes) else msg
+        self.messages.append((topic, msg))
+        if retain:
+            self.retained[topic] = msg
+
+
+class FakeClient:
+    """umqtt.simple MQTTClient interface connected to a FakeBroker"""
+
+    def __init__(self, broker, client_id='p1meter'):
+        self.broker = broker
+        self.client_id = client_id
+        self.lw = None
+        self.connected = False
+        self.pings = 0
+
+    def set_last_will(self, topic, msg, retain=False, qos=0):
+        self.lw = (topic, msg, retain)
+
+    def connect(self, clean_session=True):
+        previous = self.broker.sessions.get(self.client_id)
+        if previous is not None:
+            previous.connected = False  # like a broker taking over the session of a client id
+        self.broker.sessions[self.client_id] = self
+        self.broker.connections += 1
+        self.connected = True
+
+    def disconnect(self):
+        self.connected = False
+
+    def ping(self):
+        if not self.connected:
+            raise OSError(104)
+        self.pings += 1
+
+    def check_msg(self):
+        return None
+
+    def publish(self, topic, msg, retain=False, qos=0):
+        if not self.connected:
+            raise OSError(104)
+        if self.broker.fail_publish:
+            self.broker.fail_publish = False
+            self.connected = False
+            self.broker.deliver(*self.lw)  # broker sends the last will for the lost connection
+            raise OSError(104)
+        self.broker.deliver(topic, msg, retain)
+
+
+def meter_sensors():
+    sensors, error_type = read_p1_meter(p1_test_readline())
+    sensors['sensor.smartmeter_uptime'] = {
+        "state": lambda: "42",
+        "attributes": {"unit_of_measurement": "s", "friendly_name": "Uptime"}
+    }
+    return sensors
+
+
+class MqttTest(unittest.TestCase):
+
+    def setUp(self):
+        self.broker = FakeBroker()
+        self.sensors = meter_sensors()
+
+    def test_discovery_config(self):
+        attributes = self.sensors['sensor.dsmr_instantaneous_power']["attributes"]
+        config = discovery_config('sensor.dsmr_instantaneous_power', attributes,
+                                  'p1meter/dsmr_instantaneous_power', 'p1meter/status', False)
+        self.assertEqual(config["name"], 'Instantaneous Power')
+        self.assertEqual(config["unique_id"], 'p1meter_dsmr_instantaneous_power')
+        self.assertEqual(config["device"]["identifiers"], ['p1meter'])
+        self.assertEqual(config["unit_of_measurement"], 'kW')
+        self.assertEqual(config["device_class"], 'power')
+        self.assertEqual(config["state_class"], 'measurement')
+        self.assertNotIn("value_template", config)
+
+        attributes = self.sensors['sensor.dsmr_timestamp']["attributes"]
+        config = discovery_config('sensor.dsmr_timestamp', attributes, 'p1meter/state', 'p1meter/status', True)
+        self.assertEqual(config["value_template"], '{{ value_json.dsmr_timestamp }}')
+        self.assertNotIn("device_class", config)
+
+    def test_retained_states_and_single_announcement(self):
+        publisher = MqttPublisher(FakeClient(self.broker))
+        publisher.publish(self.sensors)
+        publisher.publish(self.sensors)
+
+        configs = [topic for topic, msg in self.broker.messages if topic.endswith('/config')]
+        self.assertEqual(len(configs), len(self.sensors))
+        self.assertEqual(self.broker.connections, 1)
+        self.assertEqual(self.broker.retained['p1meter/status'], 'online')
+        self.assertEqual(self.broker.retained['p1meter/dsmr_total_energy_import'], '00042741.128')
+        self.assertEqual(self.broker.retained['p1meter/smartmeter_uptime'], '42')
+        config = json.loads(self.broker.retained['homeassistant/sensor/p1meter/dsmr_total_energy_import/config'])
+        self.assertEqual(config["state_topic"], 'p1meter/dsmr_total_energy_import')
+
+    def test_batched_state(self):
+        publisher = MqttPublisher(FakeClient(self.broker), batched=True)
+        publisher.publish(self.sensors)
+        states = [msg for topic, msg in self.broker.messages if topic == 'p1meter/state']
+        self.assertEqual(len(states), 1)
+        state = json.loads(states[0])
+        self.assertEqual(len(state), len(self.sensors))
+        self.assertEqual(state['dsmr_instantaneous_power'], '0000.268')
+        self.assertEqual(state['smartmeter_uptime'], '42')
+
+        publisher.publish({'sensor.dsmr_instantaneous_power': {"state": "0001.000", "attributes": {}}})
+        state = json.loads(self.broker.retained['p1meter/state'])
+        self.assertEqual(len(state), len(self.sensors))  # unchanged sensors keep their state
+        self.assertEqual(state['dsmr_instantaneous_power'], '0001.000')
+
+    def test_reconnect_after_lost_connection(self):
+        publisher = MqttPublisher(FakeClient(self.broker))
+        publisher.publish(self.sensors)
+        self.broker.fail_publish = True
+        with self.assertRaises(OSError):
+            publisher.publish(self.sensors)
+        self.assertFalse(publisher.connected)
+        self.assertEqual(self.broker.retained['p1meter/status'], 'offline')
+
+        publisher.publish(self.sensors)
+        self.assertEqual(self.broker.connections, 2)
+        self.assertEqual(self.broker.retained['p1meter/status'], 'online')
+
+    def test_boards_sharing_a_broker(self):
+        first = MqttPublisher(FakeClient(self.broker, 'p1meter_e6614c30'), 'p1meter_e6614c30')
+        second = MqttPublisher(FakeClient(self.broker, 'p1meter_e6614c31'), 'p1meter_e6614c31')
+        first.publish(self.sensors)
+        second.publish({'sensor.dsmr_total_energy_import': {"state": "00000001.000", "attributes": {}}})
+        first.publish(self.sensors)
+
+        self.assertEqual(self.broker.connections, 2)
+        self.assertTrue(first.client.connected and second.client.connected)
+        self.assertEqual(self.broker.retained['p1meter_e6614c30/dsmr_total_energy_import'], '00042741.128')
+        self.assertEqual(self.broker.retained['p1meter_e6614c31/dsmr_total_energy_import'], '00000001.000')
+        configs = [json.loads(self.broker.retained[f'homeassistant/sensor/{device_id}/dsmr_total_energy_import/config'])
+                   for device_id in ('p1meter_e6614c30', 'p1meter_e6614c31')]
+        self.assertEqual([config["unique_id"] for config in configs],
+                         ['p1meter_e6614c30_dsmr_total_energy_import', 'p1meter_e6614c31_dsmr_total_energy_import'])
+        self.assertEqual([config["device"]["identifiers"] for config in configs],
+                         [['p1meter_e6614c30'], ['p1meter_e6614c31']])
+        self.assertEqual(configs[1]["availability_topic"], 'p1meter_e6614c31/status')
+
+    def test_same_client_id_takes_over_the_connection(self):
+        first = MqttPublisher(FakeClient(self.broker))
+        second = MqttPublisher(FakeClient(self.broker))
+        first.publish(self.sensors)
+        second.publish(self.sensors)
+        self.assertFalse(first.client.connected)
+
+    def test_empty_cycle_pings(self):
+        publisher = MqttPublisher(FakeClient(self.broker))
+        publisher.publish(self.sensors)
+        messages = len(self.broker.messages)
+        publisher.publish({})
+        self.assertEqual(publisher.client.pings, 1)
+        self.assertEqual(len(self.broker.messages), messages)
+
+        publisher.client.connected = False  # the broker dropped the session
+        with self.assertRaises(OSError):
+            publisher.publish({})
+        self.assertFalse(publisher.connected)
+        publisher.publish({})
+        self.assertEqual(self.broker.connections, 2)
+
+    def test_backfill(self):
+        publisher = MqttPublisher(FakeClient(self.broker))
+        publisher.publish_backfill({"readings": [{"timestamp": "0"}]})
+        self.assertEqual(self.broker.messages[-1], ('p1meter/backfill', '{"readings": [{"timestamp": "0"}]}'))
+        self.assertNotIn('p1meter/backfill', self.broker.retained)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,137 +1,139 @@
-OBIS_CODES = {
-    '0-0:1.0.0': {  # Timestamp
-        'friendly_name': 'Timestamp',
-        'device_class': None,  # No device class for timestamp
-        'state_class': None
-    },
-    '1-0:1.8.0': {  # Total Energy Import
-        'friendly_name': 'Total Energy Import',
-        'device_class': 'energy',  # Total energy in kWh
-        'state_class': 'total'
-    },
-    '1-0:2.8.0': {  # Total Energy Export
-        'friendly_name': 'Total Energy Export',
-        'device_class': 'energy',  # Total energy in kWh
-        'state_class': 'total'
-    },
-    '1-0:3.8.0': {  # Total Reactive Energy Import
-        'friendly_name': 'Total Reactive Energy Import',
-        'device_class': 'energy',  # Total reactive energy in kvarh
-        'state_class': 'total'
-    },
-    '1-0:4.8.0': {  # Total Reactive Energy Export
-        'friendly_name': 'Total Reactive Energy Export',
-        'device_class': 'energy',  # Total reactive energy in kvarh
-        'state_class': 'total'
-    },
-    '1-0:1.7.0': {  # Instantaneous Power
-        'friendly_name': 'Instantaneous Power',
-        'device_class': 'power',  # Power in kW
-        'state_class': 'measurement'
-    },
-    '1-0:2.7.0': {  # Instantaneous Power Export
-        'friendly_name': 'Instantaneous Power Export',
-        'device_class': 'power',  # Power in kW
-        'state_class': 'measurement'
-    },
-    '1-0:3.7.0': {  # Instantaneous Reactive Power
-        'friendly_name': 'Instantaneous Reactive Power',
-        'device_class': 'power',  # Reactive power in kvar
-        'state_class': 'measurement'
-    },
-    '1-0:4.7.0': {  # Instantaneous Reactive Power Export
-        'friendly_name': 'Instantaneous Reactive Power Export',
-        'device_class': 'power',  # Reactive power in kvar
-        'state_class': 'measurement'
-    },
-    '1-0:21.7.0': {  # Current Power L1
-        'friendly_name': 'Current Power L1',
-        'device_class': 'power',  # Power in kW
-        'state_class': 'measurement'
-    },
-    '1-0:41.7.0': {  # Current Power L2
-        'friendly_name': 'Current Power L2',
-        'device_class': 'power',  # Power in kW
-        'state_class': 'measurement'
-    },
-    '1-0:61.7.0': {  # Current Power L3
-        'friendly_name': 'Current Power L3',
-        'device_class': 'power',  # Power in kW
-        'state_class': 'measurement'
-    },
-    '1-0:22.7.0': {  # Current Power Export L1
-        'friendly_name': 'Current Power Export L1',
-        'device_class': 'power',  # Power in kW
-        'state_class': 'measurement'
-    },
-    '1-0:42.7.0': {  # Current Power Export L2
-        'friendly_name': 'Current Power Export L2',
-        'device_class': 'power',  # Power in kW
-        'state_class': 'measurement'
-    },
-    '1-0:62.7.0': {  # Current Power Export L3
-        'friendly_name': 'Current Power Export L3',
-        'device_class': 'power',  # Power in kW
-        'state_class': 'measurement'
-    },
-    '1-0:23.7.0': {  # Current Reactive Power L1
-        'friendly_name': 'Current Reactive Power L1',
-        'device_class': 'power',  # Reactive power in kvar
-        'state_class': 'measurement'
-    },
-    '1-0:43.7.0': {  # Current Reactive Power L2
-        'friendly_name': 'Current Reactive Power L2',
-        'device_class': 'power',  # Reactive power in kvar
-        'state_class': 'measurement'
-    },
-    '1-0:63.7.0': {  # Current Reactive Power L3
-        'friendly_name': 'Current Reactive Power L3',
-        'device_class': 'power',  # Reactive power in kvar
-        'state_class': 'measurement'
-    },
-    '1-0:24.7.0': {  # Current Reactive Power Export L1
-        'friendly_name': 'Current Reactive Power Export L1',
-        'device_class': 'power',  # Reactive power in kvar
-        'state_class': 'measurement'
-    },
-    '1-0:44.7.0': {  # Current Reactive Power Export L2
-        'friendly_name': 'Current Reactive Power Export L2',
-        'device_class': 'power',  # Reactive power in kvar
-        'state_class': 'measurement'
-    },
-    '1-0:64.7.0': {  # Current Reactive Power Export L3
-        'friendly_name': 'Current Reactive Power Export L3',
-        'device_class': 'power',  # Reactive power in kvar
-        'state_class': 'measurement'
-    },
-    '1-0:32.7.0': {  # Current Voltage L1
-        'friendly_name': 'Current Voltage L1',
-        'device_class': 'voltage',  # Voltage in V
-        'state_class': 'measurement'
-    },
-    '1-0:52.7.0': {  # Current Voltage L2
-        'friendly_name': 'Current Voltage L2',
-        'device_class': 'voltage',  # Voltage in V
-        'state_class': 'measurement'
-    },
-    '1-0:72.7.0': {  # Current Voltage L3
-        'friendly_name': 'Current Voltage L3',
-        'device_class': 'voltage',  # Voltage in V
-        'state_class': 'measurement'
-    },
-    '1-0:31.7.0': {  # Current Current L1
-        'friendly_name': 'Current Current L1',
-        'device_class': 'current',  # Current in A
-        'state_class': 'measurement'
-    },
-    '1-0:51.7.0': {  # Current Current L2
-        'friendly_name': 'Current Current L2',
-        'device_class': 'current',  # Current in A
-        'state_class': 'measurement'
-    },
-    '1-0:71.7.0': {  # Current Current L3
-        'friendly_name': 'Current Current L3',
-        'device_class': 'current',  # Current in A
-        'state_class': 'measurement'
-    },
-}
+from compat import const
+
+# One row per OBIS code:
+#   (obis_code, friendly_name, unit, device_class, state_class, deadband, deadband_relative)
+# unit is the unit the meter reports, telegrams in that unit share the
+# attributes built by describe(). The deadbands are used when
+# PUBLISH_CHANGES_ONLY is enabled:
+#   deadband: minimum absolute change, in the unit reported by the meter
+#   deadband_relative: minimum change as a fraction of the last published value
+# A tuple of constants is compiled into the bytecode, so when the module is
+# frozen into the firmware the table stays in flash instead of on the heap.
+# The rows are sorted by OBIS code, slot_of() looks codes up by bisection.
+OBIS_TABLE = (
+    ('0-0:1.0.0',  'Timestamp',                            '',       None,       None,           0,      0),
+    ('1-0:1.7.0',  'Instantaneous Power',                  'kW',     'power',    'measurement',  0.005,  0),
+    ('1-0:1.8.0',  'Total Energy Import',                  'kWh',    'energy',   'total',        0,      0),
+    ('1-0:2.7.0',  'Instantaneous Power Export',           'kW',     'power',    'measurement',  0.005,  0),
+    ('1-0:2.8.0',  'Total Energy Export',                  'kWh',    'energy',   'total',        0,      0),
+    ('1-0:21.7.0', 'Current Power L1',                     'kW',     'power',    'measurement',  0.005,  0),
+    ('1-0:22.7.0', 'Current Power Export L1',              'kW',     'power',    'measurement',  0.005,  0),
+    ('1-0:23.7.0', 'Current Reactive Power L1',            'kvar',   'power',    'measurement',  0.005,  0),
+    ('1-0:24.7.0', 'Current Reactive Power Export L1',     'kvar',   'power',    'measurement',  0.005,  0),
+    ('1-0:3.7.0',  'Instantaneous Reactive Power',         'kvar',   'power',    'measurement',  0.005,  0),
+    ('1-0:3.8.0',  'Total Reactive Energy Import',         'kvarh',  'energy',   'total',        0,      0),
+    ('1-0:31.7.0', 'Current Current L1',                   'A',      'current',  'measurement',  0.1,    0),
+    ('1-0:32.7.0', 'Current Voltage L1',                   'V',      'voltage',  'measurement',  0.5,    0),
+    ('1-0:4.7.0',  'Instantaneous Reactive Power Export',  'kvar',   'power',    'measurement',  0.005,  0),
+    ('1-0:4.8.0',  'Total Reactive Energy Export',         'kvarh',  'energy',   'total',        0,      0),
+    ('1-0:41.7.0', 'Current Power L2',                     'kW',     'power',    'measurement',  0.005,  0),
+    ('1-0:42.7.0', 'Current Power Export L2',              'kW',     'power',    'measurement',  0.005,  0),
+    ('1-0:43.7.0', 'Current Reactive Power L2',            'kvar',   'power',    'measurement',  0.005,  0),
+    ('1-0:44.7.0', 'Current Reactive Power Export L2',     'kvar',   'power',    'measurement',  0.005,  0),
+    ('1-0:51.7.0', 'Current Current L2',                   'A',      'current',  'measurement',  0.1,    0),
+    ('1-0:52.7.0', 'Current Voltage L2',                   'V',      'voltage',  'measurement',  0.5,    0),
+    ('1-0:61.7.0', 'Current Power L3',                     'kW',     'power',    'measurement',  0.005,  0),
+    ('1-0:62.7.0', 'Current Power Export L3',              'kW',     'power',    'measurement',  0.005,  0),
+    ('1-0:63.7.0', 'Current Reactive Power L3',            'kvar',   'power',    'measurement',  0.005,  0),
+    ('1-0:64.7.0', 'Current Reactive Power Export L3',     'kvar',   'power',    'measurement',  0.005,  0),
+    ('1-0:71.7.0', 'Current Current L3',                   'A',      'current',  'measurement',  0.1,    0),
+    ('1-0:72.7.0', 'Current Voltage L3',                   'V',      'voltage',  'measurement',  0.5,    0),
+)
+
+# Row fields
+CODE = const(0)
+FRIENDLY_NAME = const(1)
+UNIT = const(2)
+DEVICE_CLASS = const(3)
+STATE_CLASS = const(4)
+DEADBAND = const(5)
+DEADBAND_RELATIVE = const(6)
+
+# Sensor ids are sensor.dsmr_* unless a meter is given a prefix of its own
+DEFAULT_PREFIX = 'dsmr'
+
+
+def sensor_id(friendly_name, prefix=DEFAULT_PREFIX):
+    return f'sensor.{prefix}_' + friendly_name.lower().replace(' ', '_')
+
+
+def sensor_attributes(row, name=None):
+    return {
+        "unit_of_measurement": row[UNIT],
+        "friendly_name": f"{name} {row[FRIENDLY_NAME]}" if name else row[FRIENDLY_NAME],
+        "obis_code": row[CODE],
+        "device_class": row[DEVICE_CLASS],
+        "state_class": row[STATE_CLASS]
+    }
+
+
+def slot_of(obis_code):
+    """Row of a code in OBIS_TABLE, also its slot in a Snapshot, None for unknown codes"""
+    low, high = 0, len(OBIS_TABLE)
+    while low < high:
+        middle = (low + high) // 2
+        if OBIS_TABLE[middle][CODE] < obis_code:
+            low = middle + 1
+        else:
+            high = middle
+    if low < len(OBIS_TABLE) and OBIS_TABLE[low][CODE] == obis_code:
+        return low
+    return None
+
+
+# Descriptors of codes missing from OBIS_TABLE, cleared when full
+UNKNOWN_CACHE_SIZE = const(16)
+
+
+def deadbands(obis_code):
+    """(deadband, deadband_relative) of a code, no deadband for unknown codes and sensors without one"""
+    slot = slot_of(obis_code) if obis_code else None
+    if slot is None:
+        return 0, 0
+    row = OBIS_TABLE[slot]
+    return row[DEADBAND], row[DEADBAND_RELATIVE]
+
+
+def describe_unknown(obis_code, cache, prefix=DEFAULT_PREFIX, name=None):
+    if len(cache) >= UNKNOWN_CACHE_SIZE:
+        cache.clear()
+    unique_id = obis_code.replace("-", "_").replace(".", "_").replace(":", "_")
+    attributes = {
+        "unit_of_measurement": '',
+        "friendly_name": f"{name} {obis_code}" if name else obis_code,
+        "obis_code": obis_code
+    }
+    descriptor = (f'sensor.{prefix}_{unique_id}', attributes)
+    cache[obis_code] = descriptor
+    return descriptor
+
+
+def describer(prefix=DEFAULT_PREFIX, name=None, unknown=None):
+    """describe() for a meter with sensor ids sensor.<prefix>_* and friendly names starting with name.
+
+    describe(obis_code) returns (sensor id, attributes) without allocating
+    once a code was seen. The descriptor of a known code is built on its
+    first use and kept per row of OBIS_TABLE. The attributes dict is shared
+    by every telegram, so callers must copy it before changing it, as
+    line_attributes() does. Codes missing from the table are described in
+    the unknown cache.
+    """
+    descriptors = [None] * len(OBIS_TABLE)
+    unknown = {} if unknown is None else unknown
+
+    def describe(obis_code):
+        slot = slot_of(obis_code)
+        if slot is None:
+            return unknown.get(obis_code) or describe_unknown(obis_code, unknown, prefix, name)
+        descriptor = descriptors[slot]
+        if descriptor is None:
+            row = OBIS_TABLE[slot]
+            descriptor = descriptors[slot] = (sensor_id(row[FRIENDLY_NAME], prefix), sensor_attributes(row, name))
+        return descriptor
+
+    return describe
+
+
+# The sensor.dsmr_* descriptors of the single meter
+unknown_index = {}
+describe = describer(unknown=unknown_index)
@@ -1,112 +1,233 @@
-import re
+from array import array
 
-from obis_codes import OBIS_CODES
+from log import logger
+from obis_codes import describe
 
-PARSE_TIMESTAMP = re.compile(r'([\d\.\-:]+)\((\d+[SW]?)\)\(([\w.]*)\*?([\w%]*)\)')
-PARSE_NO_TIMESTAMP = match = re.compile(r'([\d\.\-:]+)\(([\w.]*)\*?([\w%]*)\)')
+OBIS_CODE_CHARS = '0123456789.-:'
 
 
 def obis_to_description(obis_code):
-    description = OBIS_CODES.get(obis_code)
-    if description:
-        description['id'] = f'sensor.dsmr_{description["friendly_name"].lower().replace(" ", "_")}'
-        return description
+    """Returns (sensor_id, attributes), the attributes are shared and must not be modified"""
+    return describe(obis_code)
+
+
+def line_attributes(attributes, unit, timestamp):
+    """The shared attributes, or a copy when the line has another unit or a timestamp"""
+    if unit != attributes["unit_of_measurement"] or timestamp:
+        attributes = dict(attributes)
+        attributes["unit_of_measurement"] = unit
+        if timestamp:
+            attributes["timestamp"] = timestamp
+    return attributes
+
+
+def is_word(text, extra):
+    if text.isdigit() or text.isalpha():
+        return True  # common case without a per character loop
+    for c in text:
+        if not (c.isalpha() or c.isdigit() or c == '_' or c in extra):
+            return False
+    return True
+
+
+def is_timestamp(text):
+    digits = text[:-1] if text[-1:] in ('S', 'W') else text
+    return digits.isdigit()
+
+
+def split_value(group):
+    star = group.find('*')
+    if star < 0:
+        value, unit = group, ''
     else:
-        unique_id = obis_code.replace("-", "_").replace(".", "_").replace(":", "_")
-        return {
-            'id': f'sensor.dsmr_{unique_id}',
-            'friendly_name': obis_code
-        }
+        value, unit = group[:star], group[star + 1:]
+    if (value.replace('.', '', 1).isdigit() or is_word(value, '.')) and (not unit or is_word(unit, '%')):
+        return value, unit
+    return None, None
 
 
 def parse_line(line):
-    match = PARSE_TIMESTAMP.match(line)
-    if match:
-        return match.group(1), match.group(3), match.group(4), match.group(2)
-    
-    match = PARSE_NO_TIMESTAMP.match(line)
-    if match:
-        return match.group(1), match.group(2), match.group(3), None
+    """Tokenise 'code(value*unit)', 'code(timestamp)(value*unit)' and event log lines.
+
+    Event logs such as the power failure log 1-0:99.97.0(count)(code)(ts)(value)...
+    report the number of entries as value.
+    """
+    start = line.find('(')
+    if start <= 0:
+        return None, None, None, None
+    obis_code = line[:start]
+    for c in obis_code:
+        if c not in OBIS_CODE_CHARS:
+            return None, None, None, None
+
+    groups = []
+    while start < len(line) and line[start] == '(':
+        end = line.find(')', start + 1)
+        if end < 0:
+            break
+        groups.append(line[start + 1:end])
+        start = end + 1
+    if not groups:
+        return None, None, None, None
+
+    if len(groups) == 2 and is_timestamp(groups[0]):
+        value, unit = split_value(groups[1])
+        timestamp = groups[0]
+    else:
+        value, unit = split_value(groups[0])
+        timestamp = None
+        if len(groups) > 2 and unit:
+            value = None  # event logs start with a plain entry count
 
-    return None, None, None, None
+    if value is None:
+        return None, None, None, None
+    return obis_code, value, unit, timestamp
 
 
-def calculate_crc(crc, buf):
-    for c in buf:
-        crc ^= c
-        for i in range(8):
+def make_crc_table():
+    table = array('H', [0] * 256)
+    for i in range(256):
+        crc = i
+        for _ in range(8):
             if crc & 0x01:
-                crc >>= 1
-                crc ^= 0xA001
+                crc = (crc >> 1) ^ 0xA001
             else:
                 crc >>= 1
+        table[i] = crc
+    return table
+
+
+# CRC16/ARC lookup table, one entry per byte value
+CRC_TABLE = make_crc_table()
+
+
+def calculate_crc(crc, buf):
+    table = CRC_TABLE
+    for c in buf:
+        crc = (crc >> 8) ^ table[(crc ^ c) & 0xFF]
     return crc
 
 
-def read_p1_meter(readline):
-    header = None
-    crc = 0
-    lines = []
-    data = {}
+# Upper bound on data lines per telegram, the slots are allocated once and reused
+MAX_TELEGRAM_LINES = 64
+
+
+class TelegramParser:
+    """Push parser that checks the CRC and tokenises every line as it arrives.
+
+    Tokens are stored in preallocated slots reused for every telegram, sensors
+    are only built once the CRC of the complete telegram checks out. When
+    wanted is a set of OBIS codes only those lines are tokenised, the CRC is
+    still checked over the whole telegram. When snapshot is set, telegrams are
+    committed into it instead of into a new dict per telegram. checksum and
+    tokenise can be replaced by timed wrappers of the same functions, describe
+    maps the OBIS codes to sensor ids and attributes (see obis_codes.describer).
+    """
+
+    def __init__(self, max_lines=MAX_TELEGRAM_LINES, snapshot=None, describe=obis_to_description):
+        self.wanted = None
+        self.snapshot = snapshot
+        self.describe = describe
+        self.checksum = calculate_crc
+        self.tokenise = parse_line
+        self.obis_codes = [None] * max_lines
+        self.values = [None] * max_lines
+        self.units = [None] * max_lines
+        self.timestamps = [None] * max_lines
+        self.reset()
+
+    def reset(self):
+        self.header = None
+        self.crc = 0
+        self.count = 0
+        self.error_type = None
+
+    def store(self, line):
+        if self.wanted is not None and line[:line.find('(')] not in self.wanted:
+            return  # not needed for this telegram
+        obis_code, value, unit, timestamp = self.tokenise(line)
+        if not obis_code:
+            logger.warning('p1', 'Line format is incorrect: %s', line)
+            self.error_type = "format"
+        elif self.count == len(self.obis_codes):
+            logger.warning('p1', 'Too many lines in telegram: %s', line)
+            self.error_type = "format"
+        else:
+            i = self.count
+            self.obis_codes[i] = obis_code
+            self.values[i] = value
+            self.units[i] = unit
+            self.timestamps[i] = timestamp
+            self.count += 1
+
+    def commit(self):
+        if self.snapshot is not None:
+            if self.wanted is None:
+                self.snapshot.clear()  # a full telegram replaces the previous one, a partial one is merged
+            for i in range(self.count):
+                self.snapshot.set(self.obis_codes[i], self.values[i], self.units[i], self.timestamps[i])
+            return self.snapshot
+
+        data = {}
+        for i in range(self.count):
+            sensor_id, attributes = self.describe(self.obis_codes[i])
+            data[sensor_id] = {
+                "state": self.values[i],
+                "attributes": line_attributes(attributes, self.units[i], self.timestamps[i])
+            }
+        return data
 
-    while True:
-        uart_line = readline()
-        
-        if uart_line is None:
-            return None, "timeout"  # timeout
+    def finish(self, data, error_type):
+        self.reset()
+        return data, error_type
 
+    def feed(self, uart_line):
+        """Feed one UART line, returns (data, error_type) once the telegram ends and None before"""
         try:
             line = uart_line.decode().strip()
         except BaseException as error:
-            print(f'decode error: {uart_line}')
-            return None, "decode"  # decode error
+            logger.warning('p1', 'decode error: %s', uart_line)
+            return self.finish(None, "decode")  # decode error
 
-        print(line)
+        logger.debug('p1', line)
 
         if not line:
-            crc = calculate_crc(crc, uart_line)
-            continue  # blank line
+            self.crc = self.checksum(self.crc, uart_line)
+            return None  # blank line
 
-        if not header and line[0] == '/':
-            header = line
-            crc = calculate_crc(0, uart_line)
-            lines = []
-            continue  # header
+        if not self.header and line[0] == '/':
+            self.reset()
+            self.header = line
+            self.crc = self.checksum(0, uart_line)
+            return None  # header
 
         if line[0] == '!':
-            crc = calculate_crc(crc, b'!')
+            crc = self.checksum(self.crc, b'!')
             if line != f'!{crc:04X}':
-                print(f'CRC error: {line} !{crc:04X}')
-                return None, "crc"  # crc error
-            break  # success, exit the collection loop
-
-        crc = calculate_crc(crc, uart_line)
-        lines.append(line)
-
-    # Parse all lines now that CRC is verified
-    for line in lines:
-        obis_code, value, unit, timestamp = parse_line(line)
-        if obis_code:
-            description = obis_to_description(obis_code)
-
-            attributes = {
-                "unit_of_measurement": unit,
-                "friendly_name": description['friendly_name'],
-                "obis_code": obis_code
-            }
-            if 'device_class' in description:
-                attributes["device_class"] = description['device_class']
-            if 'state_class' in description:
-                attributes["state_class"] = description['state_class']
-            if timestamp:
-                attributes["timestamp"] = timestamp
-
-            data[description['id']] = {
-                "state": value,
-                "attributes": attributes
-            }
-        else:
-            print(f"Line format is incorrect: {line}")
-            return None, "format"  # format error
+                logger.warning('p1', 'CRC error: %s !%04X', line, crc)
+                return self.finish(None, "crc")  # crc error
+            if self.error_type:
+                return self.finish(None, self.error_type)  # format error
+            return self.finish(self.commit(), None)  # success
+
+        self.crc = self.checksum(self.crc, uart_line)
+        if not self.error_type:
+            self.store(line)
+        return None
+
+
+telegram_parser = TelegramParser()
+
+
+def read_p1_meter(readline, parser=telegram_parser):
+    parser.reset()
+
+    while True:
+        uart_line = readline()
+
+        if uart_line is None:
+            return None, "timeout"  # timeout
 
-    return data, None  # success
+        result = parser.feed(uart_line)
+        if result:
+            return result
@@ -1,5 +1,13 @@
+import sys
 import unittest
-from p1meter import read_p1_meter
+import obis_codes
+from p1meter import read_p1_meter, calculate_crc, obis_to_description, TelegramParser
+from snapshot import Snapshot
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
 
 
 meter_sample = [
@@ -51,6 +59,34 @@ def p1_test_readline(sample=meter_sample):
     return readline
 
 
+def bitwise_crc(crc, buf):
+    for c in buf:
+        crc ^= c
+        for i in range(8):
+            if crc & 0x01:
+                crc >>= 1
+                crc ^= 0xA001
+            else:
+                crc >>= 1
+    return crc
+
+
+class CrcTest(unittest.TestCase):
+
+    def test_matches_bitwise_crc(self):
+        crc = 0
+        reference = 0
+        for line in meter_sample:
+            crc = calculate_crc(crc, line.encode('utf-8'))
+            reference = bitwise_crc(reference, line.encode('utf-8'))
+            self.assertEqual(crc, reference)
+
+    def test_all_byte_values(self):
+        buf = bytes(range(256))
+        self.assertEqual(calculate_crc(0, buf), bitwise_crc(0, buf))
+        self.assertEqual(calculate_crc(0xFFFF, buf), bitwise_crc(0xFFFF, buf))
+
+
 class P1MeterTest(unittest.TestCase):
 
     def test_meter_sample(self):
@@ -115,6 +151,31 @@ class P1MeterTest(unittest.TestCase):
         self.assertEqual(s["sensor.dsmr_1_0_99_9_9"]["state"], "00012345.678")
         self.assertIsNone(error_type)
 
+    def test_gas_meter(self):
+        sample = [
+            "/XMX5LGBBFFB231157879",
+            "1-0:1.8.0(00042741.128*kWh)",
+            "0-1:24.2.1(241030120000W)(01234.567*m3)",
+            "!46C5"
+        ]
+        s, error_type = read_p1_meter(p1_test_readline(sample))
+        self.assertIsNone(error_type)
+        self.assertEqual(s['sensor.dsmr_0_1_24_2_1']['state'], '01234.567')
+        self.assertEqual(s['sensor.dsmr_0_1_24_2_1']['attributes']['unit_of_measurement'], 'm3')
+        self.assertEqual(s['sensor.dsmr_0_1_24_2_1']['attributes']['timestamp'], '241030120000W')
+
+    def test_power_failure_log(self):
+        sample = [
+            "/XMX5LGBBFFB231157879",
+            "1-0:99.97.0(2)(0-0:96.7.19)(101208152415W)(0000000240*s)(101208151004W)(0000000301*s)",
+            "0-0:96.13.0()",
+            "!F471"
+        ]
+        s, error_type = read_p1_meter(p1_test_readline(sample))
+        self.assertIsNone(error_type)
+        self.assertEqual(s['sensor.dsmr_1_0_99_97_0']['state'], '2')
+        self.assertEqual(s['sensor.dsmr_0_0_96_13_0']['state'], '')
+
     def test_crc_failure(self):
         sample = [
             "/XMX5LGBBFFB231157879",
@@ -148,5 +209,143 @@ class P1MeterTest(unittest.TestCase):
         self.assertIsNone(s)
         self.assertEqual(error_type, "decode")
 
+
+def describe_all(codes):
+    for code in codes:
+        obis_to_description(code)
+
+
+class ObisIndexTest(unittest.TestCase):
+
+    def test_known_codes_share_attributes(self):
+        first, error_type = read_p1_meter(p1_test_readline())
+        second, error_type = read_p1_meter(p1_test_readline())
+        for sensor_id, sensor in first.items():
+            sensor_id_index, attributes = obis_codes.describe(sensor['attributes']['obis_code'])
+            self.assertEqual(sensor_id, sensor_id_index)
+            self.assertIs(sensor['attributes'], attributes)
+            self.assertIs(second[sensor_id]['attributes'], attributes)
+            self.assertIs(next(k for k in second if k == sensor_id), sensor_id_index)
+
+    def peak(self, func):
+        """Peak bytes allocated while running func"""
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        func()
+        return tracemalloc.get_traced_memory()[1] - before
+
+    def kept(self, func):
+        """Bytes still allocated while the result of func is alive"""
+        before = tracemalloc.get_traced_memory()[0]
+        result = func()
+        return tracemalloc.get_traced_memory()[0] - before
+
+    def committed_parser(self, lines, snapshot=None):
+        """Parser with the lines stored, ready to commit"""
+        parser = TelegramParser(snapshot=snapshot)
+        for line in lines:
+            parser.feed(line.encode())
+        parser.commit()  # warm up
+        return parser
+
+    @unittest.skipUnless(tracemalloc, 'needs tracemalloc')
+    def test_commit_allocations(self):
+        codes = [line[:line.find('(')] for line in meter_sample if line[:1].isdigit()]
+        dict_parser = self.committed_parser(meter_sample[:-1])
+        snapshot_parser = self.committed_parser(meter_sample[:-1], Snapshot())
+        one, many = codes[:1], codes * 10
+        tracemalloc.start()
+        try:
+            one_bytes = self.peak(lambda: describe_all(one))
+            many_bytes = self.peak(lambda: describe_all(many))
+            snapshot_bytes = self.kept(snapshot_parser.commit)
+            dict_bytes = self.kept(dict_parser.commit)
+        finally:
+            tracemalloc.stop()
+        # The descriptors and attributes of known codes are shared, a snapshot
+        # stores the tokens in its slots and a dict holds one small dict per line
+        self.assertEqual(many_bytes, one_bytes)
+        self.assertEqual(snapshot_bytes, 0)
+        per_line = sys.getsizeof({"state": '', "attributes": {}})
+        self.assertTrue(dict_bytes <= len(codes) * per_line + sys.getsizeof(dict.fromkeys(codes)))
+
+    def test_obis_table_is_sorted_tuple_of_rows(self):
+        table = obis_codes.OBIS_TABLE
+        self.assertIsInstance(table, tuple)
+        self.assertEqual(len(table), 27)
+        for row in table:
+            self.assertIsInstance(row, tuple)
+            self.assertEqual(len(row), 7)
+        codes = [row[obis_codes.CODE] for row in table]
+        self.assertEqual(codes, sorted(set(codes)))
+
+    def test_slot_of(self):
+        for slot, row in enumerate(obis_codes.OBIS_TABLE):
+            self.assertEqual(obis_codes.slot_of(row[obis_codes.CODE]), slot)
+        for code in ('', '0-0:0.0.0', '1-0:1.7', '1-0:99.9.9', '9-9:99.99.99'):
+            self.assertIsNone(obis_codes.slot_of(code))
+
+    def test_timestamp_copies_attributes(self):
+        sample = [
+            "/XMX5LGBBFFB231157879",
+            "1-0:1.8.0(170124210000W)(00042741.128*kWh)",
+            "1-0:2.8.0(00000001.234*kWh)",
+            "!63F5"
+        ]
+        s, error_type = read_p1_meter(p1_test_readline(sample))
+        sensor_id, attributes = obis_codes.describe('1-0:1.8.0')
+        self.assertIsNot(s[sensor_id]['attributes'], attributes)
+        self.assertNotIn('timestamp', attributes)
+
+    def test_unknown_cache_bounded(self):
+        for i in range(3 * obis_codes.UNKNOWN_CACHE_SIZE):
+            sensor_id, attributes = obis_codes.describe(f'1-0:99.{i}.0')
+            self.assertEqual(sensor_id, f'sensor.dsmr_1_0_99_{i}_0')
+            self.assertLessEqual(len(obis_codes.unknown_index), obis_codes.UNKNOWN_CACHE_SIZE)
+        self.assertIs(obis_codes.describe('1-0:99.47.0'), obis_codes.describe('1-0:99.47.0'))
+
+
+class TelegramParserTest(unittest.TestCase):
+
+    def test_feed_line_by_line(self):
+        parser = TelegramParser()
+        for line in meter_sample[:-1]:
+            self.assertIsNone(parser.feed(line.encode('utf-8')))
+        s, error_type = parser.feed(meter_sample[-1].encode('utf-8'))
+        self.assertEqual(len(s), 27)
+        self.assertIsNone(error_type)
+
+    def test_parser_reused(self):
+        parser = TelegramParser()
+        readline = p1_test_readline(meter_sample + meter_sample)
+        first, error_type = read_p1_meter(readline, parser)
+        second, error_type = read_p1_meter(readline, parser)
+        self.assertEqual(first, second)
+        self.assertIsNone(error_type)
+
+    def test_partial_telegram_discarded(self):
+        readline = p1_test_readline(meter_sample[5:] + meter_sample)
+        s, error_type = read_p1_meter(readline)
+        self.assertEqual(error_type, "crc")
+        s, error_type = read_p1_meter(readline)
+        self.assertEqual(len(s), 27)
+        self.assertIsNone(error_type)
+
+    def test_crc_checked_before_format(self):
+        sample = [
+            "/XMX5LGBBFFB231157879",
+            "1-0:2.7.0(!@#$%^&*())",
+            "!0000"
+        ]
+        s, error_type = read_p1_meter(p1_test_readline(sample))
+        self.assertEqual(error_type, "crc")
+
+    def test_too_many_lines(self):
+        parser = TelegramParser(max_lines=4)
+        s, error_type = read_p1_meter(p1_test_readline(), parser)
+        self.assertIsNone(s)
+        self.assertEqual(error_type, "format")
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,99 @@
+from machine import Pin
+from uctypes import addressof
+from array import array
+import rp2
+
+# RX FIFO of state machine sm_id, its top byte holds the received byte
+PIO_BASE = (0x50200000, 0x50300000, 0x50400000)
+RXF_OFFSET = 0x20
+
+# TRANS_COUNT of a DMA channel, writing it also triggers the channel
+DMA_BASE = 0x50000000
+DMA_CHANNEL_STRIDE = 0x40
+AL1_TRANS_COUNT_TRIG = 0x1C
+TREQ_UNPACED = 0x3F
+
+# Bytes per run of the data channel, a multiple of every ring size below the
+# MicroPython small int limit, so the counts stay small ints
+RUN_BYTES = (1 << 30) - (1 << 15)
+
+
+@rp2.asm_pio(in_shiftdir=rp2.PIO.SHIFT_RIGHT)
+def inverted_uart_rx():
+    # 8 cycles per bit. The P1 signal is inverted, the start bit is high
+    wait(1, pin, 0)
+    set(x, 7)                 [10]  # to the middle of the first data bit
+    label("bitloop")
+    in_(pins, 1)
+    jmp(x_dec, "bitloop")     [6]
+    mov(isr, invert(isr))
+    push(noblock)
+
+
+class PioUart:
+    """Receive only UART on a PIO state machine for P1 ports beyond the two hardware UARTs.
+
+    One DMA channel moves the received bytes from the RX FIFO into a ring
+    buffer, its write address wraps at the end of the buffer. When its run of
+    RUN_BYTES ends it chains to a control channel that writes the count again,
+    which restarts it, so the hardware never waits for Python. readinto()
+    copies what arrived since the last call, like a UART with timeout=0. The
+    position in the ring follows from the bytes the channel has written, when
+    the reader falls a whole buffer behind those bytes are skipped and
+    counted in overruns.
+    """
+
+    def __init__(self, sm_id, rx, baudrate=115200, size=1024):
+        if size & (size - 1) or not 2 <= size <= 1 << 15:
+            raise ValueError('size must be a power of two up to 32768')
+        self.sm = rp2.StateMachine(sm_id, inverted_uart_rx, freq=8 * baudrate, in_base=Pin(rx, Pin.IN))
+        # The ring must start at a multiple of its size
+        self.memory = bytearray(2 * size)
+        offset = -addressof(self.memory) % size
+        self.view = memoryview(self.memory)[offset:offset + size]
+        self.size = size
+        self.read = 0  # bytes consumed, modulo RUN_BYTES
+        self.overruns = 0
+
+        rxf = PIO_BASE[sm_id // 4] + RXF_OFFSET + 4 * (sm_id % 4) + 3
+        dreq = (sm_id // 4) * 8 + 4 + sm_id % 4
+        self.data = rp2.DMA()
+        self.control = rp2.DMA()
+        self.run_bytes = array('L', [RUN_BYTES])
+        self.control.config(read=self.run_bytes,
+                            write=DMA_BASE + DMA_CHANNEL_STRIDE * self.data.channel + AL1_TRANS_COUNT_TRIG,
+                            count=1, ctrl=self.control.pack_ctrl(size=2, inc_read=False, inc_write=False,
+                                                                 treq_sel=TREQ_UNPACED))
+        ctrl = self.data.pack_ctrl(size=0, inc_read=False, inc_write=True, treq_sel=dreq,
+                                   ring_sel=True, ring_size=size.bit_length() - 1, chain_to=self.control.channel)
+        self.data.config(read=rxf, write=addressof(self.memory) + offset, count=RUN_BYTES, ctrl=ctrl)
+        self.data.active(True)
+        self.sm.active(1)
+
+    def written(self):
+        """Bytes the data channel wrote, modulo RUN_BYTES"""
+        return (RUN_BYTES - self.data.count) % RUN_BYTES
+
+    def available(self):
+        return (self.written() - self.read) % RUN_BYTES
+
+    def readinto(self, buf):
+        available = self.available()
+        if available >= self.size:
+            self.overruns += 1  # the oldest bytes may be overwritten already
+            self.read = self.written()
+            return None
+        n = min(available, len(buf))
+        pos = self.read % self.size
+        first = min(n, self.size - pos)
+        buf[:first] = self.view[pos:pos + first]
+        if n > first:
+            buf[first:n] = self.view[:n - first]
+        self.read = (self.read + n) % RUN_BYTES
+        return n or None
+
+    def deinit(self):
+        self.sm.active(0)
+        self.data.active(False)
+        self.control.close()
+        self.data.close()
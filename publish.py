@@ -0,0 +1,112 @@
+import json
+
+
+def sensor_state(sensor_data):
+    state = sensor_data["state"]
+    return state() if callable(state) else state
+
+
+def sensor_payload(sensor_data):
+    return {
+        "state": sensor_state(sensor_data),
+        "attributes": sensor_data["attributes"]
+    }
+
+
+def snapshot_payload(sensors):
+    """Payload for the bulk endpoint: every sensor keyed by its entity id"""
+    return {sensor_id: sensor_payload(sensor_data) for sensor_id, sensor_data in sensors.items()}
+
+
+def request_headers(access_token):
+    return {
+        "Authorization": f"Bearer {access_token}",
+        "Content-Type": "application/json",
+    }
+
+
+def is_success(status_code):
+    return status_code == 200 or status_code == 201
+
+
+def post_json(post, url, access_token, payload):
+    """POST payload with a urequests compatible post function, returns (status_code, text)"""
+    response = None
+    try:
+        response = post(url, json=payload, headers=request_headers(access_token), timeout=1)
+        status_code = response.status_code
+        return status_code, '' if is_success(status_code) else response.text
+    finally:
+        if response:
+            response.close()
+
+
+def post_sensor(post, api, access_token, sensor_id, sensor_data):
+    return post_json(post, f"{api}/{sensor_id}", access_token, sensor_payload(sensor_data))
+
+
+def post_snapshot(post, url, access_token, sensors):
+    return post_json(post, url, access_token, snapshot_payload(sensors))
+
+
+STATE_PREFIX = b'{"state": '
+
+
+class PayloadTemplates:
+    """Per sensor HTTP requests with everything except the state serialised once.
+
+    The request line, headers and the JSON attributes are cached per sensor
+    and only serialised again when the attributes change. At publish time the
+    state and Content-Length are spliced into a buffer shared by all requests,
+    which HttpClient.send_request writes to the socket as is.
+    """
+
+    def __init__(self, api, access_token, size=512):
+        self.api = api
+        from http_client import split_url  # templates are only used with the keep-alive HttpClient
+        scheme, host, port, path = split_url(api)
+        self.target = scheme, host, port
+        self.path = path.rstrip('/')
+        self.headers = ''.join(f'{name}: {value}\r\n' for name, value in request_headers(access_token).items())
+        self.templates = {}
+        self.buf = bytearray(size)
+        self.mv = memoryview(self.buf)
+
+    def template(self, sensor_id, attributes):
+        template = self.templates.get(sensor_id)
+        if template is None or (template[0] is not attributes and template[0] != attributes):
+            head = f'POST {self.path}/{sensor_id} HTTP/1.1\r\nHost: {self.target[1]}\r\nConnection: keep-alive\r\n{self.headers}Content-Length: '
+            tail = ', "attributes": ' + json.dumps(attributes) + '}'
+            template = (attributes, head.encode(), tail.encode())
+            self.templates[sensor_id] = template
+        return template
+
+    def write(self, position, data):
+        end = position + len(data)
+        self.mv[position:end] = data
+        return end
+
+    def request(self, sensor_id, sensor_data):
+        """The complete request for the sensor, a memoryview valid until the next call"""
+        attributes, head, tail = self.template(sensor_id, sensor_data["attributes"])
+        state = json.dumps(sensor_state(sensor_data)).encode()
+        length = str(len(STATE_PREFIX) + len(state) + len(tail)).encode()
+        size = len(head) + len(length) + 4 + len(STATE_PREFIX) + len(state) + len(tail)
+        if size > len(self.buf):
+            self.buf = bytearray(size)
+            self.mv = memoryview(self.buf)
+
+        position = self.write(0, head)
+        position = self.write(position, length)
+        position = self.write(position, b'\r\n\r\n')
+        position = self.write(position, STATE_PREFIX)
+        position = self.write(position, state)
+        position = self.write(position, tail)
+        return self.mv[:position]
+
+
+def post_sensor_request(client, templates, sensor_id, sensor_data):
+    """post_sensor using a PayloadTemplates and an HttpClient, returns (status_code, text)"""
+    response = client.send_request(templates.target, templates.request(sensor_id, sensor_data), timeout=1)
+    status_code = response.status_code
+    return status_code, '' if is_success(status_code) else response.text
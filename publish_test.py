@@ -0,0 +1,109 @@
+import threading
+import unittest
+import urllib.request
+from json import dumps, loads
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from http_client import HttpClient
+from publish import PayloadTemplates, post_sensor, post_sensor_request, post_snapshot, sensor_payload
+
+
+class RecordingHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.requests.append((self.path, loads(body)))
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class UrllibResponse:
+
+    def __init__(self, response):
+        self.status_code = response.status
+        self.text = response.read().decode()
+
+    def close(self):
+        pass
+
+
+def urllib_post(url, json=None, headers=None, timeout=None):
+    request = urllib.request.Request(url, data=dumps(json).encode(), headers=headers, method='POST')
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return UrllibResponse(response)
+
+
+sensors = {
+    f'sensor.dsmr_test_{i}': {
+        "state": str(i),
+        "attributes": {"unit_of_measurement": "kW", "friendly_name": f"Test {i}"}
+    }
+    for i in range(10)
+}
+
+
+class PublishTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), RecordingHandler)
+        self.server.requests = []
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def test_sensor_payload_calls_state(self):
+        payload = sensor_payload({"state": lambda: "42", "attributes": {}})
+        self.assertEqual(payload["state"], "42")
+
+    def test_per_sensor_publish(self):
+        for sensor_id, sensor_data in sensors.items():
+            status_code, text = post_sensor(urllib_post, f'{self.url}/api/states', 'token', sensor_id, sensor_data)
+            self.assertEqual(status_code, 200)
+        self.assertEqual(len(self.server.requests), len(sensors))
+        self.assertEqual(self.server.requests[3][0], '/api/states/sensor.dsmr_test_3')
+
+    def test_bulk_publish(self):
+        status_code, text = post_snapshot(urllib_post, f'{self.url}/api/webhook/p1meter', 'token', sensors)
+        self.assertEqual(status_code, 200)
+        self.assertEqual(len(self.server.requests), 1)
+        path, body = self.server.requests[0]
+        self.assertEqual(path, '/api/webhook/p1meter')
+        self.assertEqual(len(body), len(sensors))
+        self.assertEqual(body['sensor.dsmr_test_3']['state'], '3')
+
+    def test_template_publish(self):
+        client = HttpClient()
+        templates = PayloadTemplates(f'{self.url}/api/states', 'token')
+        for sensor_id, sensor_data in sensors.items():
+            status_code, text = post_sensor_request(client, templates, sensor_id, sensor_data)
+            self.assertEqual(status_code, 200)
+        client.close()
+        self.assertEqual(len(self.server.requests), len(sensors))
+        self.assertEqual(self.server.requests[3], ('/api/states/sensor.dsmr_test_3',
+                                                    sensor_payload(sensors['sensor.dsmr_test_3'])))
+
+    def test_template_follows_state_and_attributes(self):
+        templates = PayloadTemplates('http://ha.local:8123/api/states', 'token', size=16)
+        request = bytes(templates.request('sensor.test', {"state": lambda: "1", "attributes": {"unit": "kW"}}))
+        self.assertTrue(request.startswith(b'POST /api/states/sensor.test HTTP/1.1\r\nHost: ha.local\r\n'))
+        self.assertIn(b'Authorization: Bearer token\r\n', request)
+        head, body = request.split(b'\r\n\r\n')
+        self.assertIn(f'Content-Length: {len(body)}'.encode(), head)
+        self.assertEqual(loads(body), {"state": "1", "attributes": {"unit": "kW"}})
+
+        request = bytes(templates.request('sensor.test', {"state": "12345.678", "attributes": {"unit": "W"}}))
+        self.assertEqual(loads(request.split(b'\r\n\r\n')[1]), {"state": "12345.678", "attributes": {"unit": "W"}})
+
+
+if __name__ == '__main__':
+    unittest.main()
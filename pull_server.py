@@ -0,0 +1,158 @@
+import json
+import socket
+
+try:
+    import select
+except ImportError:
+    import uselect as select
+
+from log import logger
+from publish import sensor_state
+
+NOT_FOUND = b'HTTP/1.0 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n'
+
+
+class BufferedWriter:
+    """Collects small writes into a fixed buffer and sends it to the socket when full"""
+
+    def __init__(self, sock, size=512):
+        self.sock = sock
+        self.buf = bytearray(size)
+        self.mv = memoryview(self.buf)
+        self.used = 0
+
+    def write(self, text):
+        data = text.encode() if isinstance(text, str) else text
+        if self.used + len(data) > len(self.buf):
+            self.flush()
+            if len(data) > len(self.buf):
+                self.sock.sendall(data)
+                return
+        self.mv[self.used:self.used + len(data)] = data
+        self.used += len(data)
+
+    def flush(self):
+        if self.used:
+            self.sock.sendall(self.mv[:self.used])
+            self.used = 0
+
+
+def sensor_items(sources):
+    """Items of all sources, skipping sensors an earlier source already had"""
+    for index, sensors in enumerate(sources):
+        for sensor_id, sensor_data in sensors.items():
+            if not any(sensor_id in earlier for earlier in sources[:index]):
+                yield sensor_id, sensor_data
+
+
+def render_json(write, sources):
+    """Write every sensor of the sources as one JSON object keyed by sensor id"""
+    separator = '{'
+    for sensor_id, sensor_data in sensor_items(sources):
+        write(separator)
+        write(json.dumps(sensor_id))
+        write(': {"state": ')
+        write(json.dumps(sensor_state(sensor_data)))
+        write(', "attributes": ')
+        write(json.dumps(sensor_data["attributes"]))
+        write('}')
+        separator = ', '
+    write('{}' if separator == '{' else '}')
+
+
+def metric_name(sensor_id):
+    return 'p1meter_' + sensor_id.split('.', 1)[-1]
+
+
+def render_prometheus(write, sources):
+    """Write the numeric sensors of the sources in the Prometheus text exposition format"""
+    for sensor_id, sensor_data in sensor_items(sources):
+        state = sensor_state(sensor_data)
+        try:
+            float(state)
+        except (TypeError, ValueError):
+            continue  # timestamps and identifiers are not samples
+        attributes = sensor_data["attributes"]
+        name = metric_name(sensor_id)
+        kind = 'counter' if str(attributes.get("state_class")).startswith('total') else 'gauge'
+        write(f'# HELP {name} {attributes.get("friendly_name", sensor_id)}\n# TYPE {name} {kind}\n{name}')
+        unit = attributes.get("unit_of_measurement")
+        if unit:
+            write(f'{{unit="{unit}"}}')
+        write(f' {state}\n')
+
+
+def render_log(write, sources):
+    """Write the lines in the log buffer, oldest first"""
+    logger.dump(write)
+
+
+ROUTES = {
+    '/': (b'application/json', render_json),
+    '/json': (b'application/json', render_json),
+    '/metrics': (b'text/plain; version=0.0.4', render_prometheus),
+    '/log': (b'text/plain', render_log),
+}
+
+
+class PullServer:
+    """Tiny HTTP server for scraping the sensors, polled from the main loop.
+
+    poll() returns at once unless a client is waiting, then answers one
+    request with the sensors of sources() rendered straight into a small
+    send buffer: JSON on / and /json, Prometheus text on /metrics and the
+    log buffer on /log. The socket timeout bounds how long a slow client
+    can hold up the loop.
+    """
+
+    def __init__(self, sources, port=80, host='0.0.0.0', timeout=0.2):
+        self.sources = sources
+        self.timeout = timeout
+        self.requests = 0
+        self.errors = 0
+        self.sock = socket.socket()
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(socket.getaddrinfo(host, port)[0][-1])
+        self.sock.listen(2)
+        self.port = self.sock.getsockname()[1] if hasattr(self.sock, 'getsockname') else port
+        self.poller = select.poll()
+        self.poller.register(self.sock, select.POLLIN)
+
+    def close(self):
+        self.sock.close()
+
+    def poll(self):
+        """Serve one waiting client, returns True if there was one"""
+        if not self.poller.poll(0):
+            return False
+        client, address = self.sock.accept()
+        try:
+            client.settimeout(self.timeout)
+            self.serve(client)
+        except OSError as e:
+            logger.warning('pull', 'Pull request failed: %s', e)
+            self.errors += 1  # a slow or vanished client, not worth an exception sensor
+        finally:
+            client.close()
+        return True
+
+    def serve(self, client):
+        request = client.recv(512)
+        while b'\r\n\r\n' not in request and len(request) < 2048:
+            more = client.recv(512)
+            if not more:
+                break
+            request += more
+        parts = request.split(b' ', 2)
+        path = parts[1].decode().split('?', 1)[0] if len(parts) > 1 else ''
+        route = ROUTES.get(path)
+        if parts[0] != b'GET' or route is None:
+            client.sendall(NOT_FOUND)
+            return
+
+        content_type, render = route
+        writer = BufferedWriter(client)
+        writer.write(b'HTTP/1.0 200 OK\r\nContent-Type: ' + content_type + b'\r\nConnection: close\r\n\r\n')
+        render(writer.write, self.sources())
+        writer.flush()
+        self.requests += 1
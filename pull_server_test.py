@@ -0,0 +1,143 @@
+import json
+import socket
+import threading
+import unittest
+
+from log import logger
+from p1meter import TelegramParser, read_p1_meter
+from pull_server import PullServer, render_json, render_prometheus
+from p1meter_test import p1_test_readline
+from snapshot import Snapshot
+
+
+STATUS = {
+    "sensor.smartmeter_uptime": {
+        "state": lambda: "42",
+        "attributes": {"unit_of_measurement": "s", "friendly_name": "Uptime"}
+    }
+}
+
+
+def read_sensors(parser):
+    sensors, error_type = read_p1_meter(p1_test_readline(), parser)
+    assert error_type is None, error_type
+    return sensors
+
+
+def render(render_func, sources):
+    chunks = []
+    render_func(chunks.append, sources)
+    return ''.join(chunks)
+
+
+class RenderTest(unittest.TestCase):
+
+    def test_json_matches_sensors(self):
+        sensors = read_sensors(TelegramParser())
+        document = json.loads(render(render_json, (sensors, STATUS)))
+        self.assertEqual(len(document), len(sensors) + 1)
+        self.assertEqual(document["sensor.smartmeter_uptime"]["state"], "42")
+        for sensor_id, sensor_data in sensors.items():
+            self.assertEqual(document[sensor_id], sensor_data)
+
+    def test_json_from_snapshot(self):
+        expected = read_sensors(TelegramParser())
+        snapshot = read_sensors(TelegramParser(snapshot=Snapshot()))
+        self.assertEqual(json.loads(render(render_json, (snapshot,))), expected)
+
+    def test_json_empty(self):
+        self.assertEqual(json.loads(render(render_json, ({}, {}))), {})
+
+    def test_status_merged_into_values_is_rendered_once(self):
+        sensors = read_sensors(TelegramParser())
+        sensors.update(STATUS)
+        document = render(render_json, (sensors, STATUS))
+        self.assertEqual(document.count('"sensor.smartmeter_uptime"'), 1)
+        self.assertEqual(len(json.loads(document)), len(sensors))
+
+    def test_prometheus(self):
+        sensors = read_sensors(TelegramParser())
+        text = render(render_prometheus, (sensors, STATUS))
+        samples = [line for line in text.splitlines() if not line.startswith('#')]
+        self.assertTrue(len(samples) > 10)
+        for sample in samples:
+            name, value = sample.rsplit(' ', 1)
+            self.assertTrue(name.startswith('p1meter_'))
+            float(value)
+        self.assertTrue('p1meter_smartmeter_uptime{unit="s"} 42' in samples)
+        self.assertTrue('# TYPE p1meter_smartmeter_uptime gauge' in text)
+        self.assertTrue('p1meter_dsmr_total_energy_import{unit="kWh"} 00042741.128' in samples)
+        self.assertTrue('# TYPE p1meter_dsmr_total_energy_import counter' in text)
+        self.assertFalse('p1meter_dsmr_timestamp' in text)  # text states are no samples
+
+
+class PullServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sensors = read_sensors(TelegramParser())
+        self.server = PullServer(lambda: (self.sensors, STATUS), port=0, host='127.0.0.1')
+
+    def tearDown(self):
+        self.server.close()
+
+    def get(self, request):
+        """Send request from a client thread while polling the server, returns the raw response"""
+        response = []
+
+        def client():
+            with socket.create_connection(('127.0.0.1', self.server.port), timeout=5) as sock:
+                sock.sendall(request)
+                chunks = []
+                while True:
+                    chunk = sock.recv(4096)
+                    if not chunk:
+                        break
+                    chunks.append(chunk)
+                response.append(b''.join(chunks))
+
+        thread = threading.Thread(target=client)
+        thread.start()
+        while thread.is_alive():
+            self.server.poll()
+        thread.join()
+        return response[0]
+
+    def test_poll_without_client_returns_at_once(self):
+        self.assertFalse(self.server.poll())
+
+    def test_json(self):
+        response = self.get(b'GET /json HTTP/1.1\r\nHost: p1meter\r\n\r\n')
+        head, body = response.split(b'\r\n\r\n', 1)
+        self.assertTrue(head.startswith(b'HTTP/1.0 200 OK'))
+        self.assertTrue(b'Content-Type: application/json' in head)
+        self.assertEqual(len(json.loads(body)), len(self.sensors) + 1)
+        self.assertEqual(self.server.requests, 1)
+
+    def test_metrics(self):
+        response = self.get(b'GET /metrics HTTP/1.1\r\n\r\n')
+        head, body = response.split(b'\r\n\r\n', 1)
+        self.assertTrue(b'text/plain; version=0.0.4' in head)
+        self.assertTrue(b'p1meter_smartmeter_uptime{unit="s"} 42\n' in body)
+
+    def test_log(self):
+        logger.warning('test', 'served on %s', '/log')
+        response = self.get(b'GET /log HTTP/1.1\r\n\r\n')
+        head, body = response.split(b'\r\n\r\n', 1)
+        self.assertTrue(head.startswith(b'HTTP/1.0 200 OK'))
+        self.assertTrue(body.endswith(b'WARNING test: served on /log\n'))
+
+    def test_not_found(self):
+        response = self.get(b'GET /other HTTP/1.1\r\n\r\n')
+        self.assertTrue(response.startswith(b'HTTP/1.0 404'))
+        self.assertEqual(self.server.requests, 0)
+
+    def test_silent_client_is_dropped_after_timeout(self):
+        with socket.create_connection(('127.0.0.1', self.server.port)):
+            while not self.server.poll():
+                pass
+        self.assertEqual(self.server.requests, 0)
+        self.assertEqual(self.server.errors, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,197 @@
+import struct
+
+from obis_codes import describe
+from p1meter import calculate_crc
+
+# Cumulative registers kept while offline, as thousandths of the meter unit
+REGISTER_CODES = ('1-0:1.8.0', '1-0:2.8.0', '1-0:3.8.0', '1-0:4.8.0')
+MISSING = 0xFFFFFFFF
+
+# sequence, timestamp, registers, crc of the preceding fields
+RECORD_FORMAT = '<II' + 'I' * len(REGISTER_CODES) + 'H'
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+
+# Timestamp of a record taken before the clock was set from NTP
+UNSYNCED = 0
+
+# Bytes written at a time when the file is created, slots read between watchdog feeds
+CHUNK_SIZE = 512
+FEED_EVERY = 64
+
+# Appends between saves of the newest sequence, which spares the scan at boot
+HEAD_INTERVAL = 60
+
+
+def to_milli(state):
+    whole, _, fraction = state.partition('.')
+    return int(whole or '0') * 1000 + int((fraction + '000')[:3])
+
+
+def from_milli(value):
+    return f'{value // 1000}.{value % 1000:03d}'
+
+
+def registers(sensors, describe=describe):
+    """The cumulative registers of a telegram, MISSING where a code is absent or not a number"""
+    values = []
+    for obis_code in REGISTER_CODES:
+        sensor = sensors.get(describe(obis_code)[0])
+        try:
+            values.append(min(to_milli(sensor["state"]), MISSING))
+        except (TypeError, ValueError):
+            values.append(MISSING)
+    return values
+
+
+def backfill_payload(records, format_time, describe=describe):
+    """JSON payload for a batch of records, registers keyed by the sensor ids of describe"""
+    readings = []
+    for sequence, timestamp, values in records:
+        reading = {"timestamp": None if timestamp == UNSYNCED else format_time(timestamp)}
+        for obis_code, value in zip(REGISTER_CODES, values):
+            if value != MISSING:
+                reading[describe(obis_code)[0]] = from_milli(value)
+        readings.append(reading)
+    return {"readings": readings}
+
+
+class RingLog:
+    """Bounded log of fixed size records in a preallocated file, for readings that could not be published.
+
+    Record n is written to slot n % capacity, so every slot is written once
+    per lap and the file never grows. Records that were forwarded and the
+    newest sequence are tracked in a small <path>.sent file, written after a
+    successful backfill and every HEAD_INTERVAL appends. After a restart the
+    records following the saved sequence are followed to the newest one,
+    all slots are scanned only without a valid saved sequence. A record torn
+    by a reset fails its CRC and is skipped. feed is called while the file
+    is created or scanned, for the watchdog.
+    """
+
+    def __init__(self, path, capacity=1440, feed=None):
+        self.path = path
+        self.capacity = capacity
+        self.feed = feed or (lambda: None)
+        self.record = bytearray(RECORD_SIZE)
+        try:
+            self.file = open(path, 'r+b')
+            if self.file.seek(0, 2) != capacity * RECORD_SIZE:
+                self.file.close()
+                raise OSError('size')
+        except OSError:
+            self.file = open(path, 'w+b')
+            self.preallocate()
+        sent, head = self.load_sent()
+        self.sequence = self.follow(head) if head else self.scan()
+        self.sent = min(sent, self.sequence)
+
+    def close(self):
+        self.file.close()
+
+    def read_slot(self, slot):
+        """(sequence, timestamp, registers) stored in slot, None when empty or torn"""
+        self.file.seek(slot * RECORD_SIZE)
+        if self.file.readinto(self.record) != RECORD_SIZE:
+            return None
+        fields = struct.unpack(RECORD_FORMAT, self.record)
+        if not fields[0] or fields[-1] != calculate_crc(0, memoryview(self.record)[:RECORD_SIZE - 2]):
+            return None
+        return fields[0], fields[1], fields[2:-1]
+
+    def preallocate(self):
+        """Fill the file with empty slots a chunk at a time, a fragmented heap has no room for all at once"""
+        zeros = bytes(CHUNK_SIZE)
+        size = self.capacity * RECORD_SIZE
+        while size > 0:
+            self.file.write(zeros[:size] if size < CHUNK_SIZE else zeros)
+            size -= CHUNK_SIZE
+            self.feed()
+        self.file.flush()
+
+    def holds(self, sequence):
+        record = self.read_slot(sequence % self.capacity)
+        return record is not None and record[0] == sequence
+
+    def scan(self):
+        newest = 0
+        for slot in range(self.capacity):
+            if slot % FEED_EVERY == 0:
+                self.feed()
+            record = self.read_slot(slot)
+            if record and record[0] > newest:
+                newest = record[0]
+        return newest
+
+    def follow(self, head):
+        """The newest sequence from the saved one, one torn record is stepped over"""
+        if not self.holds(head):
+            return self.scan()
+        sequence = head
+        while sequence - head < self.capacity:
+            if (sequence - head) % FEED_EVERY == 0:
+                self.feed()
+            if self.holds(sequence + 1):
+                sequence += 1
+            elif self.holds(sequence + 2):
+                sequence += 2
+            else:
+                break
+        return sequence
+
+    def load_sent(self):
+        """(sent, head) from the .sent file, head is 0 when unknown"""
+        try:
+            with open(self.path + '.sent') as f:
+                fields = f.read().split()
+            return int(fields[0]), int(fields[1]) if len(fields) > 1 else 0
+        except (OSError, ValueError, IndexError):
+            return 0, 0
+
+    def save_sent(self):
+        with open(self.path + '.sent', 'w') as f:
+            f.write(f'{self.sent} {self.sequence}')
+
+    def append(self, timestamp, values):
+        self.sequence += 1
+        struct.pack_into(RECORD_FORMAT[:-1], self.record, 0, self.sequence, timestamp, *values)
+        struct.pack_into('<H', self.record, RECORD_SIZE - 2,
+                         calculate_crc(0, memoryview(self.record)[:RECORD_SIZE - 2]))
+        self.file.seek((self.sequence % self.capacity) * RECORD_SIZE)
+        self.file.write(self.record)
+        self.file.flush()
+        if self.sequence % HEAD_INTERVAL == 0:
+            self.save_sent()
+
+    def oldest_pending(self):
+        return max(self.sent + 1, self.sequence - self.capacity + 1)
+
+    def pending(self):
+        return self.sequence - self.oldest_pending() + 1
+
+    def read(self, limit):
+        """(records, last) with up to limit records not yet sent oldest first, last is the final sequence read"""
+        records = []
+        sequence = self.oldest_pending()
+        while sequence <= self.sequence and len(records) < limit:
+            record = self.read_slot(sequence % self.capacity)
+            if record and record[0] == sequence:
+                records.append(record)  # torn records are skipped
+            sequence += 1
+        return records, sequence - 1
+
+    def mark_sent(self, sequence):
+        self.sent = sequence
+        self.save_sent()
+
+    def drain(self, deliver, batch_size=60, max_batches=None):
+        """Pass batches of pending records to deliver until it returns False, returns the number sent"""
+        sent = 0
+        batches = 0
+        while self.pending() and (max_batches is None or batches < max_batches):
+            records, last = self.read(batch_size)
+            if records and not deliver(records):
+                break
+            self.mark_sent(last)
+            sent += len(records)
+            batches += 1
+        return sent
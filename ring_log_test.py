@@ -0,0 +1,147 @@
+import os
+import tempfile
+import unittest
+
+from obis_codes import describer
+from p1meter import TelegramParser, read_p1_meter
+from p1meter_test import p1_test_readline
+from ring_log import (HEAD_INTERVAL, MISSING, RECORD_SIZE, UNSYNCED, RingLog, backfill_payload, from_milli, registers,
+                      to_milli)
+
+
+class CountingLog(RingLog):
+
+    reads = 0
+
+    def read_slot(self, slot):
+        self.reads += 1
+        return super().read_slot(slot)
+
+
+class RingLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'offline.log')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_milli(self):
+        self.assertEqual(to_milli('00042741.128'), 42741128)
+        self.assertEqual(to_milli('12.5'), 12500)
+        self.assertEqual(to_milli('7'), 7000)
+        self.assertEqual(from_milli(42741128), '42741.128')
+        self.assertEqual(from_milli(5), '0.005')
+
+    def test_registers(self):
+        sensors, error_type = read_p1_meter(p1_test_readline())
+        values = registers(sensors)
+        self.assertEqual(values[0], 42741128)
+        self.assertEqual(len(values), 4)
+        self.assertEqual(registers({}), [MISSING] * 4)
+        heat_pump = describer('heat_pump')
+        self.assertEqual(registers(sensors, heat_pump), [MISSING] * 4)
+        sensors, error_type = read_p1_meter(p1_test_readline(), TelegramParser(describe=heat_pump))
+        self.assertEqual(registers(sensors, heat_pump), values)
+        payload = backfill_payload([(1, 0, values)], str, heat_pump)
+        self.assertEqual(payload['readings'][0]['sensor.heat_pump_total_energy_import'], '42741.128')
+
+    def test_preallocated_and_bounded(self):
+        log = RingLog(self.path, capacity=8)
+        self.assertEqual(os.path.getsize(self.path), 8 * RECORD_SIZE)
+        for i in range(20):
+            log.append(1000 + i, [i, i, i, MISSING])
+        self.assertEqual(os.path.getsize(self.path), 8 * RECORD_SIZE)
+        self.assertEqual(log.pending(), 8)
+        records, last = log.read(100)
+        self.assertEqual([timestamp for sequence, timestamp, values in records], list(range(1012, 1020)))
+        self.assertEqual(last, 20)
+        log.close()
+
+    def test_recovers_after_restart(self):
+        log = RingLog(self.path, capacity=8)
+        for i in range(11):
+            log.append(i, [i] * 4)
+        log.drain(lambda records: True, batch_size=3, max_batches=1)
+        log.close()
+
+        log = RingLog(self.path, capacity=8)
+        self.assertEqual(log.sequence, 11)
+        self.assertEqual(log.sent, 6)
+        records, last = log.read(100)
+        self.assertEqual([sequence for sequence, timestamp, values in records], [7, 8, 9, 10, 11])
+        log.close()
+
+    def test_torn_record_skipped(self):
+        log = RingLog(self.path, capacity=8)
+        for i in range(3):
+            log.append(i, [i] * 4)
+        log.close()
+        with open(self.path, 'r+b') as f:
+            f.seek(2 * RECORD_SIZE + 10)
+            f.write(b'\xff')
+
+        log = RingLog(self.path, capacity=8)
+        records, last = log.read(100)
+        self.assertEqual([sequence for sequence, timestamp, values in records], [1, 3])
+        self.assertEqual(last, 3)
+        log.close()
+
+    def test_backfill_after_outage(self):
+        log = RingLog(self.path, capacity=100)
+        sensors, error_type = read_p1_meter(p1_test_readline())
+        received = []
+        online = False
+
+        def deliver(records):
+            if online:
+                received.append(backfill_payload(records, str))
+            return online
+
+        for minute in range(130):
+            online = minute >= 120  # Wi-Fi back after two hours
+            if online:
+                log.drain(deliver, batch_size=30)
+            else:
+                log.append(minute * 60, registers(sensors))
+                self.assertEqual(log.drain(deliver), 0)
+
+        self.assertEqual(log.pending(), 0)
+        self.assertEqual(len(received), 4)  # the last 100 minutes in batches of 30
+        readings = [reading for payload in received for reading in payload["readings"]]
+        self.assertEqual(len(readings), 100)
+        self.assertEqual(readings[0]["timestamp"], str(20 * 60))
+        self.assertEqual(readings[-1]["sensor.dsmr_total_energy_import"], '42741.128')
+
+    def test_watchdog_fed_while_creating_and_scanning(self):
+        feeds = []
+        log = RingLog(self.path, capacity=1440, feed=lambda: feeds.append(1))
+        self.assertEqual(os.path.getsize(self.path), 1440 * RECORD_SIZE)
+        self.assertTrue(len(feeds) >= 1440 * RECORD_SIZE // 512)
+        log.close()
+        feeds.clear()
+        log = RingLog(self.path, capacity=1440, feed=lambda: feeds.append(1))
+        self.assertTrue(len(feeds) >= 1440 // 64)  # no saved sequence, every slot is scanned
+        log.close()
+
+    def test_restart_follows_saved_sequence(self):
+        log = RingLog(self.path, capacity=1440)
+        for i in range(HEAD_INTERVAL + 5):
+            log.append(i, [i] * 4)
+        log.close()
+
+        log = CountingLog(self.path, capacity=1440)
+        self.assertEqual(log.sequence, HEAD_INTERVAL + 5)
+        self.assertTrue(log.reads < 10)  # the records after the saved sequence, not all 1440 slots
+        log.close()
+
+    def test_unsynced_timestamp(self):
+        payload = backfill_payload([(1, UNSYNCED, [1000] * 4), (2, 60, [2000] * 4)], str)
+        self.assertIsNone(payload["readings"][0]["timestamp"])
+        self.assertEqual(payload["readings"][1]["timestamp"], '60')
+        self.assertEqual(payload["readings"][0]["sensor.dsmr_total_energy_import"], '1.000')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+try:
+    import asyncio
+except ImportError:
+    import uasyncio as asyncio
+
+from compat import ticks_ms, ticks_diff
+from p1meter import TelegramParser
+
+
+def sleep_ms(ms):
+    return asyncio.sleep_ms(ms) if hasattr(asyncio, 'sleep_ms') else asyncio.sleep(ms / 1000)
+
+
+class Mailbox:
+    """Holds only the latest value, a put replaces a value nobody took yet"""
+
+    def __init__(self):
+        self.value = None
+        self.event = asyncio.Event()
+
+    def put(self, value):
+        self.value = value
+        self.event.set()
+
+    def take(self):
+        value = self.value
+        self.value = None
+        self.event.clear()
+        return value
+
+    async def get(self):
+        await self.event.wait()
+        return self.take()
+
+
+async def read_telegrams(stream, on_telegram, on_exception, timeout_ms=1000, parser=None, chunk_size=512):
+    """Feed an asyncio stream to the parser, calling on_telegram(data, error_type) per telegram.
+
+    Everything the UART buffered is consumed in one go, so the reader keeps up
+    even when other tasks only yield briefly.
+    """
+    parser = parser or TelegramParser()
+    pending = b''
+    while True:
+        try:
+            try:
+                chunk = await asyncio.wait_for(stream.read(chunk_size), timeout_ms / 1000)
+            except asyncio.TimeoutError:
+                chunk = None
+
+            if not chunk:
+                pending = b''
+                parser.reset()
+                on_telegram(None, "timeout")
+                continue
+
+            pending += chunk
+            start = 0
+            end = pending.find(b'\n')
+            while end >= 0:
+                result = parser.feed(pending[start:end + 1])
+                if result:
+                    on_telegram(*result)
+                start = end + 1
+                end = pending.find(b'\n', start)
+            pending = pending[start:]
+        except Exception as e:
+            on_exception(e)
+            pending = b''
+            parser.reset()
+
+
+async def publish_periodically(mailbox, publish, interval_ms, on_exception):
+    """Every interval_ms await publish() with the latest value from the mailbox.
+
+    The previous value is published again when no new value arrived, None
+    before the first one.
+    """
+    latest = None
+    while True:
+        start = ticks_ms()
+        value = mailbox.take()
+        if value is not None:
+            latest = value
+        try:
+            await publish(latest)
+        except Exception as e:
+            on_exception(e)
+        await sleep_ms(max(0, interval_ms - ticks_diff(ticks_ms(), start)))
+
+
+async def publish_each(sensors, publish):
+    """Publish the sensors one at a time with publish({sensor_id: sensor_data}), yielding between posts.
+
+    Returns False at the first failed post. The reader task may commit the
+    next telegram meanwhile, so sensors must not be the parser's snapshot.
+    """
+    for sensor_id, sensor_data in sensors.items():
+        if not publish({sensor_id: sensor_data}):
+            return False
+        await asyncio.sleep(0)
+    return True
+
+
+async def poll_periodically(poll, interval_ms, on_exception):
+    """Calls the non-blocking poll() every interval_ms"""
+    while True:
+        try:
+            poll()
+        except Exception as e:
+            on_exception(e)
+        await sleep_ms(interval_ms)
+
+
+async def feed_watchdog(wdt, interval_ms=1000):
+    """Feeds the watchdog as long as the event loop keeps running"""
+    while True:
+        wdt.feed()
+        await sleep_ms(interval_ms)
+
+
+async def blink_led(led, is_connected, interval_ms=400):
+    """Solid LED while WiFi is connecting, blinking LED while it is connected"""
+    while True:
+        if is_connected():
+            led.toggle()
+        else:
+            led.on()
+        await sleep_ms(interval_ms)
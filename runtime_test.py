@@ -0,0 +1,149 @@
+import asyncio
+import time
+import unittest
+
+from p1meter import TelegramParser
+from p1meter_test import meter_sample
+from runtime import Mailbox, publish_each, read_telegrams, publish_periodically
+from snapshot import Snapshot
+
+telegram = ''.join(meter_sample).encode('utf-8')
+
+
+class FakeUart:
+    """Stream receiving a telegram every period_ms of wall clock time into a bounded rx buffer.
+
+    Like the hardware UART, bytes keep arriving while Python is blocked and
+    whatever does not fit in the buffer is lost.
+    """
+
+    def __init__(self, telegrams, period_ms, rxbuf=2048):
+        self.telegrams = telegrams
+        self.period = period_ms / 1000
+        self.rxbuf = rxbuf
+        self.buffer = b''
+        self.arrived = 0
+        self.dropped = 0
+        self.start = time.monotonic()
+
+    def receive(self):
+        due = min(self.telegrams, int((time.monotonic() - self.start) / self.period) + 1)
+        while self.arrived < due:
+            free = self.rxbuf - len(self.buffer)
+            self.dropped += max(0, len(telegram) - free)
+            self.buffer += telegram[:free]
+            self.arrived += 1
+
+    def done(self):
+        return self.arrived == self.telegrams and not self.buffer
+
+    async def read(self, n):
+        while True:
+            self.receive()
+            if self.buffer:
+                data, self.buffer = self.buffer[:n], self.buffer[n:]
+                return data
+            await asyncio.sleep(0.001)
+
+
+def run_meter(publish_sensor, telegrams=24, period_ms=50):
+    """Run reader and publisher tasks until all telegrams arrived, returns (uart, results)"""
+    uart = FakeUart(telegrams, period_ms)
+    results = []
+    mailbox = Mailbox()
+
+    def on_telegram(data, error_type):
+        results.append(error_type)
+        if data:
+            mailbox.put(data)
+
+    async def publish(sensors):
+        for sensor_id, sensor_data in (sensors or {}).items():
+            await publish_sensor(sensor_id, sensor_data)
+
+    def on_exception(e):
+        raise e
+
+    async def main():
+        reader = asyncio.create_task(read_telegrams(uart, on_telegram, on_exception))
+        publisher = asyncio.create_task(publish_periodically(mailbox, publish, 500, on_exception))
+        while not uart.done():
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.05)
+        reader.cancel()
+        publisher.cancel()
+
+    asyncio.run(main())
+    return uart, results
+
+
+class RuntimeTest(unittest.TestCase):
+
+    def test_mailbox_keeps_latest(self):
+        mailbox = Mailbox()
+        self.assertIsNone(mailbox.take())
+        mailbox.put(1)
+        mailbox.put(2)
+        self.assertEqual(mailbox.take(), 2)
+        self.assertIsNone(mailbox.take())
+
+    def test_no_telegrams_lost_during_slow_publish(self):
+        published = []
+
+        async def slow_post(sensor_id, sensor_data):
+            time.sleep(0.01)  # blocking HTTP post
+            published.append(sensor_id)
+            await asyncio.sleep(0)
+
+        uart, results = run_meter(slow_post)
+        self.assertEqual(uart.dropped, 0)
+        self.assertEqual(results, [None] * 24)
+        self.assertGreaterEqual(len(published), 27)
+
+    def test_blocking_publish_loses_telegrams(self):
+        async def blocking_post(sensor_id, sensor_data):
+            time.sleep(0.01)  # blocking HTTP post without yielding to the reader
+
+        uart, results = run_meter(blocking_post)
+        self.assertTrue(uart.dropped > 0)
+        self.assertIn("crc", results)
+
+    def test_telegram_committed_during_publish(self):
+        parser = TelegramParser(snapshot=Snapshot())
+        for line in meter_sample:
+            snapshot = parser.feed(line.encode())
+        snapshot = snapshot[0]
+        sensors = dict(snapshot.items())  # as main.prepare_publish copies it
+        sensors['sensor.smartmeter_uptime'] = {"state": "1", "attributes": {}}
+        published = {}
+        committed_after = []
+
+        def post(sensor):
+            published.update(sensor)
+            return True
+
+        async def reader():
+            while not published:
+                await asyncio.sleep(0)  # the first sensor is out, the publisher is suspended
+            for line in ("/XMX5LGBBFFB231157879", "1-0:1.8.0(00042741.128*kWh)", "1-0:2.8.0(00000001.234*kWh)",
+                         "!39B3"):
+                result = parser.feed(line.encode())
+            self.assertIsNone(result[1])
+            committed_after.append(len(published))
+
+        async def main():
+            task = asyncio.create_task(reader())
+            published_all = await publish_each(sensors, post)
+            await task
+            return published_all
+
+        self.assertTrue(asyncio.run(main()))
+        self.assertEqual(committed_after, [1])
+        self.assertEqual(len(snapshot), 2)
+        self.assertEqual(len(published), 28)
+        self.assertEqual(published['sensor.dsmr_total_energy_export']['state'], '00000000.001')
+        self.assertIn('sensor.smartmeter_uptime', published)
+
+
+if __name__ == '__main__':
+    unittest.main()
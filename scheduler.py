@@ -0,0 +1,54 @@
+from compat import ticks_diff
+from obis_codes import describe
+
+POWER_OBIS_CODE = '1-0:1.7.0'
+POWER_SENSOR_ID = describe(POWER_OBIS_CODE)[0]
+
+
+def instantaneous_power(sensors):
+    """Instantaneous power import in kW, None if the telegram does not have it"""
+    sensor = sensors.get(POWER_SENSOR_ID) if sensors else None
+    try:
+        return float(sensor["state"])
+    except (TypeError, ValueError):
+        return None
+
+
+class PublishScheduler:
+    """Publish interval between min_interval_ms and max_interval_ms driven by power swings.
+
+    The interval halves every telegram in which the instantaneous power is at
+    least power_swing away from the last published value, and doubles again
+    after each publish window in which every telegram stayed within that
+    range, a swing that returns to the published value keeps the interval.
+    """
+
+    def __init__(self, max_interval_ms, min_interval_ms=None, power_swing=None):
+        self.max_interval = max_interval_ms
+        self.min_interval = min_interval_ms or max_interval_ms
+        self.power_swing = power_swing
+        self.interval = max_interval_ms
+        self.last_publish = None
+        self.published_power = None
+        self.swung = False  # a telegram since the last publish swung
+
+    def due(self, now):
+        return self.last_publish is None or ticks_diff(now, self.last_publish) >= self.interval
+
+    def swing(self, power):
+        if power is None or self.published_power is None or not self.power_swing:
+            return None
+        return abs(power - self.published_power) >= self.power_swing
+
+    def observe(self, power):
+        """Track the power of a telegram read between publishes"""
+        if self.swing(power):
+            self.interval = max(self.min_interval, self.interval // 2)
+            self.swung = True
+
+    def published(self, now, power):
+        if self.swing(power) is False and not self.swung:
+            self.interval = min(self.max_interval, self.interval * 2)
+        self.last_publish = now
+        self.published_power = power
+        self.swung = False
@@ -0,0 +1,78 @@
+import unittest
+
+from p1meter import TelegramParser, read_p1_meter
+from p1meter_test import p1_test_readline
+from scheduler import POWER_OBIS_CODE, PublishScheduler, instantaneous_power
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def test_fixed_interval(self):
+        scheduler = PublishScheduler(60000)
+        self.assertTrue(scheduler.due(0))
+        scheduler.published(0, 1.0)
+        scheduler.observe(5.0)
+        self.assertFalse(scheduler.due(59999))
+        self.assertTrue(scheduler.due(60000))
+
+    def test_tightens_on_swing_and_relaxes_when_steady(self):
+        scheduler = PublishScheduler(60000, 10000, 0.5)
+        scheduler.published(0, 1.0)
+        scheduler.observe(1.2)
+        self.assertEqual(scheduler.interval, 60000)
+        scheduler.observe(2.0)
+        self.assertEqual(scheduler.interval, 30000)
+        scheduler.observe(2.0)
+        scheduler.observe(2.0)
+        self.assertEqual(scheduler.interval, 10000)
+        self.assertTrue(scheduler.due(10000))
+
+        scheduler.published(10000, 2.0)
+        self.assertEqual(scheduler.interval, 10000)  # still moved since the previous publish
+        scheduler.published(20000, 2.1)
+        self.assertEqual(scheduler.interval, 20000)
+        scheduler.published(40000, 2.1)
+        scheduler.published(80000, 2.1)
+        self.assertEqual(scheduler.interval, 60000)
+
+    def test_swing_that_returns_keeps_interval(self):
+        scheduler = PublishScheduler(60000, 10000, 0.5)
+        scheduler.published(0, 1.0)
+        scheduler.observe(2.0)
+        scheduler.observe(1.0)
+        self.assertEqual(scheduler.interval, 30000)
+        scheduler.published(30000, 1.0)
+        self.assertEqual(scheduler.interval, 30000)
+        scheduler.observe(1.1)
+        scheduler.published(60000, 1.0)
+        self.assertEqual(scheduler.interval, 60000)
+
+    def test_partial_parse(self):
+        parser = TelegramParser()
+        parser.wanted = (POWER_OBIS_CODE,)
+        s, error_type = read_p1_meter(p1_test_readline(), parser)
+        self.assertIsNone(error_type)
+        self.assertEqual(list(s.keys()), ['sensor.dsmr_instantaneous_power'])
+        self.assertEqual(instantaneous_power(s), 0.268)
+
+        parser.wanted = None
+        s, error_type = read_p1_meter(p1_test_readline(), parser)
+        self.assertEqual(len(s), 27)
+
+    def test_partial_parse_checks_crc(self):
+        sample = [
+            "/XMX5LGBBFFB231157879",
+            "1-0:1.8.0(00042741.128*kWh)",
+            "!0000"
+        ]
+        parser = TelegramParser()
+        parser.wanted = (POWER_OBIS_CODE,)
+        self.assertEqual(read_p1_meter(p1_test_readline(sample), parser), (None, "crc"))
+
+    def test_instantaneous_power_missing(self):
+        self.assertIsNone(instantaneous_power({}))
+        self.assertIsNone(instantaneous_power(None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+from array import array
+
+from compat import const
+from obis_codes import CODE, OBIS_TABLE, describe, slot_of
+from p1meter import line_attributes
+
+MISSING = const(0)
+NUMBER = const(1)
+TEXT = const(2)
+
+# Digits that always fit in the 32 bit scaled integer
+MAX_DIGITS = const(9)
+
+
+class Snapshot:
+    """Latest value of every OBIS code, stored in fixed slots instead of dicts of strings.
+
+    Decimal states such as '00042741.128' are kept as a scaled integer plus the
+    number of decimals and the width, so the exact string is rendered again
+    only when the sensors are read at publish time. Every row of OBIS_TABLE
+    has a slot. Attributes are shared with describe() unless a line carries
+    another unit or a timestamp, the sensor ids come from it too. Codes
+    without a slot and sensors added with update() are kept in a plain dict.
+
+    Reads return the sensors as {"state": ..., "attributes": ...} dicts, so
+    a Snapshot can be published like the dict returned by read_p1_meter.
+    """
+
+    def __init__(self, describe=describe):
+        n = len(OBIS_TABLE)
+        self.describe = describe
+        # sensor id -> slot for get(), the descriptors themselves stay with describe
+        self.slots = {describe(row[CODE])[0]: slot for slot, row in enumerate(OBIS_TABLE)}
+        self.kind = array('B', [MISSING] * n)
+        self.scaled = array('l', [0] * n)
+        self.decimals = array('B', [0] * n)
+        self.width = array('B', [0] * n)
+        self.texts = [None] * n
+        self.attributes = [None] * n
+        self.extra = {}
+
+    def clear(self):
+        """Forget the sensors of the previous telegram, the slots stay allocated"""
+        for slot in range(len(self.kind)):
+            self.kind[slot] = MISSING
+        self.extra.clear()
+
+    def set(self, obis_code, value, unit, timestamp):
+        sensor_id, attributes = self.describe(obis_code)
+        slot = slot_of(obis_code)
+        if slot is None:
+            self.extra[sensor_id] = {"state": value, "attributes": line_attributes(attributes, unit, timestamp)}
+            return
+
+        self.attributes[slot] = line_attributes(attributes, unit, timestamp)
+        dot = value.find('.')
+        digits = value.replace('.', '', 1) if dot >= 0 else value
+        if digits.isdigit() and len(digits) <= MAX_DIGITS and dot != len(value) - 1:
+            self.scaled[slot] = int(digits)
+            self.decimals[slot] = len(value) - dot - 1 if dot >= 0 else 0
+            self.width[slot] = len(digits)
+            self.kind[slot] = NUMBER
+            self.texts[slot] = None
+        else:
+            self.texts[slot] = value
+            self.kind[slot] = TEXT
+
+    def state(self, slot):
+        if self.kind[slot] == TEXT:
+            return self.texts[slot]
+        digits = str(self.scaled[slot])
+        digits = '0' * (self.width[slot] - len(digits)) + digits
+        decimals = self.decimals[slot]
+        if not decimals:
+            return digits
+        return digits[:-decimals] + '.' + digits[-decimals:]
+
+    def sensor(self, slot):
+        return {"state": self.state(slot), "attributes": self.attributes[slot]}
+
+    def __len__(self):
+        return sum(1 for kind in self.kind if kind) + len(self.extra)
+
+    def __contains__(self, sensor_id):
+        return self.get(sensor_id) is not None
+
+    def __getitem__(self, sensor_id):
+        sensor = self.get(sensor_id)
+        if sensor is None:
+            raise KeyError(sensor_id)
+        return sensor
+
+    def get(self, sensor_id, default=None):
+        slot = self.slots.get(sensor_id)
+        if slot is not None and self.kind[slot]:
+            return self.sensor(slot)
+        return self.extra.get(sensor_id, default)
+
+    def sensor_id(self, slot):
+        return self.describe(OBIS_TABLE[slot][CODE])[0]
+
+    def keys(self):
+        for slot, kind in enumerate(self.kind):
+            if kind:
+                yield self.sensor_id(slot)
+        for sensor_id in self.extra:
+            yield sensor_id
+
+    def __iter__(self):
+        return self.keys()
+
+    def items(self):
+        for slot, kind in enumerate(self.kind):
+            if kind:
+                yield self.sensor_id(slot), self.sensor(slot)
+        for item in self.extra.items():
+            yield item
+
+    def update(self, sensors):
+        self.extra.update(sensors)
@@ -0,0 +1,71 @@
+import unittest
+
+from p1meter import TelegramParser, read_p1_meter
+from p1meter_test import meter_sample, p1_test_readline
+from snapshot import Snapshot
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def test_same_sensors_as_dict(self):
+        expected, error_type = read_p1_meter(p1_test_readline())
+        snapshot, error_type = read_p1_meter(p1_test_readline(), TelegramParser(snapshot=Snapshot()))
+        self.assertIsNone(error_type)
+        self.assertIsInstance(snapshot, Snapshot)
+        self.assertEqual(len(snapshot), 27)
+        self.assertEqual(dict(snapshot.items()), expected)
+        self.assertEqual(snapshot['sensor.dsmr_total_energy_import']['state'], '00042741.128')
+        self.assertEqual(snapshot['sensor.dsmr_timestamp']['state'], '241030120019W')
+        self.assertIn('sensor.dsmr_current_voltage_l1', snapshot)
+        self.assertNotIn('sensor.dsmr_unknown', snapshot)
+
+    def test_states_round_trip(self):
+        snapshot = Snapshot()
+        for value in ('00042741.128', '0000.000', '228.9', '001', '', '.5', '4B384547303034303436333935353037',
+                      '1234567890.123', '12.'):
+            snapshot.set('1-0:1.8.0', value, 'kWh', None)
+            self.assertEqual(snapshot['sensor.dsmr_total_energy_import']['state'], value)
+
+    def test_values_stored_as_scaled_integers(self):
+        snapshot = Snapshot()
+        snapshot.set('1-0:1.7.0', '0000.268', 'kW', None)
+        slot = snapshot.slots['sensor.dsmr_instantaneous_power']
+        self.assertEqual(snapshot.scaled[slot], 268)
+        self.assertEqual(snapshot.decimals[slot], 3)
+        self.assertIsNone(snapshot.texts[slot])
+
+    def test_update_and_unknown_codes(self):
+        snapshot = Snapshot()
+        snapshot.set('1-0:99.9.9', '00012345.678', 'kWh', None)
+        snapshot.update({'sensor.smartmeter_uptime': {"state": "1", "attributes": {}}})
+        self.assertEqual(snapshot['sensor.dsmr_1_0_99_9_9']['state'], '00012345.678')
+        self.assertEqual(sorted(snapshot.keys()), ['sensor.dsmr_1_0_99_9_9', 'sensor.smartmeter_uptime'])
+
+    def test_full_telegram_replaces_previous(self):
+        parser = TelegramParser(snapshot=Snapshot())
+        sample = [
+            "/XMX5LGBBFFB231157879",
+            "1-0:1.8.0(00042741.128*kWh)",
+            "1-0:2.8.0(00000001.234*kWh)",
+            "!39B3"
+        ]
+        first, error_type = read_p1_meter(p1_test_readline(meter_sample), parser)
+        first.update({'sensor.smartmeter_uptime': {"state": "1", "attributes": {}}})
+        second, error_type = read_p1_meter(p1_test_readline(sample), parser)
+        self.assertIs(first, second)
+        self.assertEqual(sorted(second.keys()), ['sensor.dsmr_total_energy_export', 'sensor.dsmr_total_energy_import'])
+        self.assertEqual(second['sensor.dsmr_total_energy_export']['state'], '00000001.234')
+        self.assertNotIn('sensor.dsmr_instantaneous_power', second)
+        self.assertIsNone(second.get('sensor.dsmr_instantaneous_power'))
+
+    def test_partial_parse_keeps_other_codes(self):
+        parser = TelegramParser(snapshot=Snapshot())
+        first, error_type = read_p1_meter(p1_test_readline(meter_sample), parser)
+        parser.wanted = ('1-0:1.7.0',)
+        second, error_type = read_p1_meter(p1_test_readline(meter_sample), parser)
+        self.assertIsNone(error_type)
+        self.assertEqual(len(second), 27)
+
+
+if __name__ == '__main__':
+    unittest.main()
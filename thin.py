@@ -0,0 +1,136 @@
+import socket
+import struct
+
+from log import logger
+from p1meter import calculate_crc
+
+# Frame sent to the gateway: device id length and telegram length, then both
+HEADER = '>HH'
+HEADER_SIZE = 4
+MAX_TELEGRAM = 2048
+
+
+class TelegramFramer:
+    """Collects the raw bytes of a telegram from '/' to the CRC line and checks the CRC without parsing"""
+
+    def __init__(self, size=MAX_TELEGRAM):
+        self.buf = bytearray(size)
+        self.mv = memoryview(self.buf)
+        self.reset()
+
+    def reset(self):
+        self.length = 0
+        self.crc = 0
+        self.in_frame = False
+
+    def feed(self, line):
+        """Add one UART line, returns (telegram, error_type) at the end of a telegram and None before.
+
+        The telegram is a memoryview into the buffer, valid until the next feed.
+        """
+        if line[:1] == b'/':
+            self.reset()
+            self.in_frame = True
+        elif not self.in_frame:
+            return None  # noise between telegrams
+        end = self.length + len(line)
+        if end > len(self.buf):
+            self.reset()
+            return None, "format"  # format error
+        self.mv[self.length:end] = line
+        self.length = end
+
+        if line[:1] != b'!':
+            self.crc = calculate_crc(self.crc, line)
+            return None
+
+        self.in_frame = False
+        crc = calculate_crc(self.crc, b'!')
+        try:
+            expected = int(str(line[1:], 'utf-8').strip(), 16)
+        except (UnicodeError, ValueError):
+            expected = None
+        if expected != crc:
+            logger.warning('thin', 'CRC error: %s !%04X', bytes(line), crc)
+            return None, "crc"  # crc error
+        return self.mv[:end], None
+
+
+def read_frame(readline, framer):
+    """Blocks until a telegram is complete, returns (telegram, error_type) like read_p1_meter"""
+    framer.reset()
+    while True:
+        line = readline()
+        if line is None:
+            return None, "timeout"  # timeout
+        result = framer.feed(line)
+        if result:
+            return result
+
+
+class GatewayLink:
+    """Ships CRC checked telegrams to the gateway, over one TCP connection or as one UDP datagram each.
+
+    Frames are built in a buffer allocated once. The TCP connection is opened
+    on the first send and again after an error, which is reported to on_error.
+    """
+
+    def __init__(self, host, port, device_id, protocol='tcp', timeout=2, on_error=None):
+        self.host = host
+        self.port = port
+        self.protocol = protocol
+        self.timeout = timeout
+        self.on_error = on_error
+        self.address = None
+        self.sock = None
+        device_id = device_id.encode()
+        self.id_length = len(device_id)
+        self.frame = bytearray(HEADER_SIZE + self.id_length + MAX_TELEGRAM)
+        self.frame[HEADER_SIZE:HEADER_SIZE + self.id_length] = device_id
+        self.mv = memoryview(self.frame)
+        self.sent = 0
+
+    def close(self):
+        if self.sock:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+        self.sock = None
+
+    def open(self):
+        kind = socket.SOCK_DGRAM if self.protocol == 'udp' else socket.SOCK_STREAM
+        if self.address is None:
+            self.address = socket.getaddrinfo(self.host, self.port, 0, kind)[0][-1]
+        sock = socket.socket(socket.AF_INET, kind)
+        try:
+            sock.settimeout(self.timeout)
+            if kind == socket.SOCK_STREAM:
+                sock.connect(self.address)
+        except OSError:
+            sock.close()
+            self.address = None  # resolve again on the next attempt
+            raise
+        self.sock = sock
+
+    def send(self, telegram):
+        """Returns True when the telegram was handed to the network"""
+        start = HEADER_SIZE + self.id_length
+        end = start + len(telegram)
+        struct.pack_into(HEADER, self.frame, 0, self.id_length, len(telegram))
+        self.mv[start:end] = telegram
+        try:
+            if self.sock is None:
+                self.open()
+            if self.protocol == 'udp':
+                self.sock.sendto(self.mv[:end], self.address)
+            else:
+                self.sock.sendall(self.mv[:end])
+            self.sent += 1
+            return True
+        except OSError as e:
+            logger.warning('thin', 'Gateway send failed: %s', e)
+            self.close()
+            if self.on_error:
+                self.on_error(e)
+            return False
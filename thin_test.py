@@ -0,0 +1,80 @@
+import socket
+import struct
+import unittest
+
+from p1meter_test import meter_sample, p1_test_readline
+from thin import HEADER, HEADER_SIZE, GatewayLink, TelegramFramer, read_frame
+
+telegram = ''.join(meter_sample).encode('utf-8')
+
+
+class FramerTest(unittest.TestCase):
+
+    def test_raw_telegram(self):
+        data, error_type = read_frame(p1_test_readline(['noise\r\n'] + meter_sample), TelegramFramer())
+        self.assertIsNone(error_type)
+        self.assertEqual(bytes(data), telegram)
+
+    def test_crc_error(self):
+        sample = meter_sample[:-1] + ['!0000\r\n']
+        self.assertEqual(read_frame(p1_test_readline(sample), TelegramFramer()), (None, "crc"))
+
+    def test_too_long(self):
+        self.assertEqual(read_frame(p1_test_readline(meter_sample), TelegramFramer(size=512)), (None, "format"))
+
+    def test_timeout(self):
+        self.assertEqual(read_frame(p1_test_readline(meter_sample[:5]), TelegramFramer()), (None, "timeout"))
+
+    def test_restarts_on_header(self):
+        data, error_type = read_frame(p1_test_readline(meter_sample[:10] + meter_sample), TelegramFramer())
+        self.assertEqual(bytes(data), telegram)
+
+
+def read_frame_from(data):
+    id_length, telegram_length = struct.unpack_from(HEADER, data)
+    device_id = data[HEADER_SIZE:HEADER_SIZE + id_length].decode()
+    return device_id, data[HEADER_SIZE + id_length:HEADER_SIZE + id_length + telegram_length]
+
+
+class GatewayLinkTest(unittest.TestCase):
+
+    def test_udp_datagram_per_telegram(self):
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as receiver:
+            receiver.bind(('127.0.0.1', 0))
+            link = GatewayLink('127.0.0.1', receiver.getsockname()[1], 'meter_1', 'udp')
+            self.assertTrue(link.send(memoryview(telegram)))
+            self.assertEqual(read_frame_from(receiver.recv(4096)), ('meter_1', telegram))
+            link.close()
+
+    def test_tcp_stream_reconnects(self):
+        errors = []
+        with socket.create_server(('127.0.0.1', 0)) as server:
+            link = GatewayLink('127.0.0.1', server.getsockname()[1], 'meter_1', on_error=errors.append)
+            self.assertTrue(link.send(telegram))
+            connection, address = server.accept()
+            with connection:
+                received = b''
+                while len(received) < HEADER_SIZE + 7 + len(telegram):
+                    received += connection.recv(4096)
+            self.assertEqual(read_frame_from(received), ('meter_1', telegram))
+
+            # Sends right after the peer closed can still succeed, until the reset arrives
+            for _ in range(100):
+                if not link.send(telegram):
+                    break
+            self.assertEqual(len(errors), 1)
+            self.assertTrue(link.send(telegram))  # on a new connection
+            server.accept()[0].close()
+        link.close()
+
+    def test_refused(self):
+        with socket.create_server(('127.0.0.1', 0)) as server:
+            port = server.getsockname()[1]
+        errors = []
+        link = GatewayLink('127.0.0.1', port, 'meter_1', on_error=errors.append)
+        self.assertFalse(link.send(telegram))
+        self.assertEqual(len(errors), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
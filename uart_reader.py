@@ -0,0 +1,139 @@
+from compat import const
+from log import logger
+from p1meter import TelegramParser
+
+# Inlined into the scan loop on MicroPython
+SLASH = const(0x2F)  # '/'
+BANG = const(0x21)  # '!'
+NEWLINE = const(0x0A)  # '\n'
+
+
+class FrameReader:
+    """Reads the UART with readinto into a preallocated buffer and parses telegrams in place.
+
+    A pass over the received bytes finds the line ends. Every complete line
+    of a frame is added to the CRC with the parser's checksum hook, so it is
+    timed like the readline path, and the '/' and '!' frame boundaries are
+    tracked from its first byte. Bytes outside a frame are skipped without
+    decoding, data lines are only turned into strings for the tokenizer. A
+    partial line is moved to the front of the buffer when the end is reached.
+    """
+
+    def __init__(self, uart, parser=None, size=2048):
+        self.uart = uart
+        self.parser = parser or TelegramParser()
+        self.buf = bytearray(size)
+        self.mv = memoryview(self.buf)
+        self.reset()
+
+    def reset(self):
+        self.line_start = 0  # start of the line being scanned
+        self.scan = 0  # next byte to scan
+        self.end = 0  # end of the received bytes
+        self.in_frame = False
+        self.crc = 0
+        self.parser.reset()
+
+    def fill(self):
+        if self.end == len(self.buf):
+            if self.line_start == 0:
+                return None  # line does not fit in the buffer
+            n = self.end - self.line_start
+            self.mv[0:n] = self.mv[self.line_start:self.end]
+            self.scan -= self.line_start
+            self.line_start = 0
+            self.end = n
+        n = self.uart.readinto(self.mv[self.end:])
+        if n:
+            self.end += n
+        return n or 0
+
+    def finish(self, data, error_type):
+        self.in_frame = False
+        return self.parser.finish(data, error_type)
+
+    def check_trailer(self, start, end):
+        try:
+            expected = int(str(self.mv[start + 1:end], 'utf-8').strip(), 16)
+        except ValueError:
+            expected = None
+        if expected != self.crc:
+            logger.warning('uart', 'CRC error: %s !%04X', bytes(self.mv[start:end]), self.crc)
+            return self.finish(None, "crc")  # crc error
+        if self.parser.error_type:
+            return self.finish(None, self.parser.error_type)  # format error
+        return self.finish(self.parser.commit(), None)  # success
+
+    def line(self, start, end):
+        first = self.buf[start]
+        if first == SLASH:
+            self.in_frame = True
+            self.parser.reset()
+            self.crc = self.parser.checksum(0, self.mv[start:end])
+        elif not self.in_frame:
+            return None  # noise between telegrams
+        elif first == BANG:
+            self.crc = self.parser.checksum(self.crc, b'!')
+            return self.check_trailer(start, end)
+        else:
+            self.crc = self.parser.checksum(self.crc, self.mv[start:end])
+
+        try:
+            line = str(self.mv[start:end], 'utf-8').strip()
+        except UnicodeError:
+            logger.warning('uart', 'decode error: %s', bytes(self.mv[start:end]))
+            return self.finish(None, "decode")  # decode error
+
+        if not line:
+            return None  # blank line
+        if line[0] == '/':
+            self.parser.header = line
+        elif not self.parser.error_type:
+            self.parser.store(line)
+        return None
+
+    def process(self):
+        """Scan the received bytes, returns (data, error_type) once a telegram completes"""
+        buf = self.buf
+        line_start = self.line_start
+        i = self.scan
+        end = self.end
+        result = None
+        while i < end:
+            c = buf[i]
+            i += 1
+            if c == NEWLINE:
+                result = self.line(line_start, i)
+                line_start = i
+                if result:
+                    break
+        self.line_start = line_start
+        self.scan = i
+        return result
+
+    def poll(self):
+        """Scans what the UART received so far without waiting, returns (data, error_type) or None"""
+        result = self.process()
+        if result:
+            return result
+        n = self.fill()
+        if n is None:
+            self.reset()
+            logger.warning('uart', 'Line too long for the UART buffer')
+            return None, "format"  # format error
+        return self.process() if n else None
+
+    def read_telegram(self):
+        """Blocks until a telegram is complete, same (data, error_type) contract as read_p1_meter"""
+        while True:
+            result = self.process()
+            if result:
+                return result
+            n = self.fill()
+            if n is None:
+                self.reset()
+                logger.warning('uart', 'Line too long for the UART buffer')
+                return None, "format"  # format error
+            if not n:
+                self.reset()
+                return None, "timeout"  # timeout
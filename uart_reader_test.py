@@ -0,0 +1,88 @@
+import io
+import unittest
+
+from p1meter import TelegramParser, calculate_crc
+from p1meter_test import meter_sample
+from uart_reader import FrameReader
+
+telegram = ''.join(meter_sample).encode('utf-8')
+
+
+class FileUart:
+    """UART stand-in serving captured telegram bytes from a file, at most chunk bytes per readinto"""
+
+    def __init__(self, file, chunk=256):
+        self.file = file
+        self.chunk = chunk
+
+    def readinto(self, buf):
+        return self.file.readinto(buf[:self.chunk])
+
+
+def reader_for(data, chunk=256, size=2048):
+    return FrameReader(FileUart(io.BytesIO(data), chunk), size=size)
+
+
+class FrameReaderTest(unittest.TestCase):
+
+    def test_telegram(self):
+        s, error_type = reader_for(telegram).read_telegram()
+        self.assertIsNone(error_type)
+        self.assertEqual(len(s), 27)
+        self.assertEqual(s['sensor.dsmr_total_energy_import']['state'], '00042741.128')
+
+    def test_consecutive_telegrams_across_buffer_wrap(self):
+        for chunk in (1, 7, 100, 2048):
+            reader = reader_for(b'noise\r\n' + telegram * 5, chunk=chunk, size=1200)
+            for i in range(5):
+                s, error_type = reader.read_telegram()
+                self.assertIsNone(error_type)
+                self.assertEqual(len(s), 27)
+            self.assertEqual(reader.read_telegram(), (None, "timeout"))
+
+    def test_partial_telegram_resyncs(self):
+        reader = reader_for(telegram[300:] + telegram)
+        s, error_type = reader.read_telegram()
+        self.assertIsNone(error_type)
+        self.assertEqual(len(s), 27)
+
+    def test_crc_error(self):
+        reader = reader_for(telegram.replace(b'!F5D8', b'!0000') + telegram)
+        self.assertEqual(reader.read_telegram(), (None, "crc"))
+        s, error_type = reader.read_telegram()
+        self.assertIsNone(error_type)
+
+    def test_decode_error(self):
+        reader = reader_for(telegram.replace(b'1-0:2.8.0', b'\xff\xfe:2.8.0'))
+        self.assertEqual(reader.read_telegram(), (None, "decode"))
+
+    def test_line_too_long(self):
+        reader = reader_for(b'/' + b'x' * 600 + b'\r\n' + telegram, size=512)
+        self.assertEqual(reader.read_telegram(), (None, "format"))
+
+    def test_poll_returns_none_until_complete(self):
+        reader = reader_for(telegram * 2, chunk=100)
+        results = [reader.poll() for _ in range(40)]
+        telegrams = [r for r in results if r is not None]
+        self.assertEqual(len(telegrams), 2)
+        self.assertTrue(all(error_type is None for s, error_type in telegrams))
+        self.assertTrue(results.index(telegrams[0]) >= len(telegram) // 100 - 1)
+        self.assertIsNone(results[-1])  # nothing left to read is not a timeout
+
+    def test_crc_through_parser_checksum(self):
+        calls = []
+
+        def checksum(crc, buf):
+            calls.append(bytes(buf))
+            return calculate_crc(crc, buf)
+
+        parser = TelegramParser()
+        parser.checksum = checksum
+        reader = FrameReader(FileUart(io.BytesIO(b'noise\r\n' + telegram)), parser)
+        s, error_type = reader.read_telegram()
+        self.assertIsNone(error_type)
+        self.assertEqual(b''.join(calls), telegram[:telegram.index(b'!') + 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+try:
+    from random import getrandbits
+except ImportError:
+    from urandom import getrandbits
+
+from compat import ticks_diff
+from log import logger
+
+IDLE = 'idle'
+CONNECTING = 'connecting'
+CONNECTED = 'connected'
+BACKOFF = 'backoff'
+
+
+def random_jitter(limit_ms):
+    return (getrandbits(16) * limit_ms) >> 16
+
+
+def backoff_delay(failures, backoff_ms, max_backoff_ms, jitter):
+    """backoff_ms doubled per earlier failure up to max_backoff_ms, plus up to half of it as jitter"""
+    delay = min(max_backoff_ms, backoff_ms << min(failures, 16))
+    return delay + jitter(delay // 2)
+
+
+class WifiManager:
+    """Non-blocking Wi-Fi connection state machine, advanced by calling poll() from the main loop.
+
+    idle -> connecting when the link is down, connecting -> connected once
+    the WLAN reports a connection, connecting -> backoff when it takes longer
+    than connect_timeout_ms and backoff -> connecting when the delay passed.
+    The delay doubles with every failed attempt up to max_backoff_ms, plus up
+    to half of it as random jitter. A lost connection goes back to idle.
+    """
+
+    def __init__(self, wlan, ssid, password, on_connected=None, connect_timeout_ms=10000,
+                 backoff_ms=1000, max_backoff_ms=60000, jitter=random_jitter):
+        self.wlan = wlan
+        self.ssid = ssid
+        self.password = password
+        self.on_connected = on_connected
+        self.connect_timeout_ms = connect_timeout_ms
+        self.backoff_ms = backoff_ms
+        self.max_backoff_ms = max_backoff_ms
+        self.jitter = jitter
+        self.state = IDLE
+        self.since = 0
+        self.delay = 0
+        self.failures = 0
+
+    def enter(self, state, now):
+        self.state = state
+        self.since = now
+
+    def start_connecting(self, now):
+        logger.info('wifi', 'Connecting to WiFi...')
+        self.wlan.active(True)
+        self.wlan.connect(self.ssid, self.password)
+        self.enter(CONNECTING, now)
+
+    def back_off(self, now):
+        self.delay = backoff_delay(self.failures, self.backoff_ms, self.max_backoff_ms, self.jitter)
+        self.failures += 1
+        logger.warning('wifi', 'Failed to connect to WiFi: Timeout, retry in %d ms', self.delay)
+        # Resetting the module is spread over the backoff instead of sleeping
+        self.wlan.disconnect()
+        self.wlan.active(False)
+        self.enter(BACKOFF, now)
+
+    def poll(self, now):
+        """Advance the state machine at ticks_ms() now, returns the state"""
+        connected = self.wlan.isconnected()
+        if self.state == CONNECTED:
+            if not connected:
+                logger.warning('wifi', 'WiFi connection lost')
+                self.enter(IDLE, now)
+        elif connected:
+            self.failures = 0
+            self.enter(CONNECTED, now)
+            if self.on_connected:
+                self.on_connected()
+
+        if self.state == IDLE:
+            self.start_connecting(now)
+        elif self.state == CONNECTING:
+            if ticks_diff(now, self.since) >= self.connect_timeout_ms:
+                self.back_off(now)
+        elif self.state == BACKOFF:
+            if ticks_diff(now, self.since) >= self.delay:
+                self.start_connecting(now)
+        return self.state
+
+    def isconnected(self):
+        return self.state == CONNECTED
+
+
+class Retry:
+    """When to try a failing action such as the NTP sync again, with the backoff of WifiManager.
+
+    due() is true at once after reset() and after every failed() only once
+    the backoff delay passed, so a blocking action that keeps failing runs
+    ever more rarely instead of on every loop iteration.
+    """
+
+    def __init__(self, backoff_ms=10000, max_backoff_ms=900000, jitter=random_jitter):
+        self.backoff_ms = backoff_ms
+        self.max_backoff_ms = max_backoff_ms
+        self.jitter = jitter
+        self.reset()
+
+    def reset(self):
+        self.failures = 0
+        self.since = 0
+        self.delay = 0
+
+    def due(self, now):
+        return not self.failures or ticks_diff(now, self.since) >= self.delay
+
+    def failed(self, now):
+        self.delay = backoff_delay(self.failures, self.backoff_ms, self.max_backoff_ms, self.jitter)
+        self.failures += 1
+        self.since = now
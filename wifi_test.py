@@ -0,0 +1,128 @@
+import unittest
+
+from wifi import BACKOFF, CONNECTED, CONNECTING, IDLE, Retry, WifiManager
+
+
+class FakeWlan:
+    """network.WLAN stand-in that associates connect_ms after connect() while the access point is up"""
+
+    def __init__(self, clock, connect_ms=3000):
+        self.clock = clock
+        self.connect_ms = connect_ms
+        self.ap_up = True
+        self.is_active = False
+        self.connect_time = None
+        self.connects = 0
+        self.resets = 0
+
+    def active(self, is_active):
+        self.is_active = is_active
+        if not is_active:
+            self.connect_time = None
+            self.resets += 1
+
+    def connect(self, ssid, password):
+        self.connects += 1
+        self.connect_time = self.clock.now
+
+    def disconnect(self):
+        self.connect_time = None
+
+    def isconnected(self):
+        return (self.is_active and self.ap_up and self.connect_time is not None and
+                self.clock.now - self.connect_time >= self.connect_ms)
+
+    def drop(self):
+        self.connect_time = None
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 0
+
+
+class WifiTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.wlan = FakeWlan(self.clock)
+        self.connected = 0
+        self.wifi = WifiManager(self.wlan, 'ssid', 'password', on_connected=self.on_connected,
+                                jitter=lambda limit: limit)
+
+    def on_connected(self):
+        self.connected += 1
+
+    def advance(self, ms, step=100):
+        """Poll every step ms for ms, returns the states seen in order"""
+        states = []
+        for _ in range(ms // step):
+            self.clock.now += step
+            state = self.wifi.poll(self.clock.now)
+            if not states or states[-1] != state:
+                states.append(state)
+        return states
+
+    def test_connects(self):
+        self.assertEqual(self.wifi.state, IDLE)
+        self.assertEqual(self.advance(5000), [CONNECTING, CONNECTED])
+        self.assertEqual(self.connected, 1)
+        self.assertEqual(self.wlan.connects, 1)
+        self.assertTrue(self.wifi.isconnected())
+
+    def test_exponential_backoff_with_jitter(self):
+        self.wlan.ap_up = False
+        delays = []
+        for _ in range(8):
+            while self.wifi.poll(self.clock.now) != BACKOFF:
+                self.clock.now += 100
+            delays.append(self.wifi.delay)
+            while self.wifi.poll(self.clock.now) == BACKOFF:
+                self.clock.now += 100
+        # 1 s doubling up to 60 s, plus half of it as jitter
+        self.assertEqual(delays, [1500, 3000, 6000, 12000, 24000, 48000, 90000, 90000])
+        self.assertEqual(self.wlan.resets, 8)
+        self.assertEqual(self.connected, 0)
+
+    def test_recovers_and_resets_backoff(self):
+        self.wlan.ap_up = False
+        self.advance(30000)
+        self.assertTrue(self.wifi.failures > 1)
+        self.wlan.ap_up = True
+        self.advance(60000)
+        self.assertEqual(self.wifi.state, CONNECTED)
+        self.assertEqual(self.wifi.failures, 0)
+        self.assertEqual(self.connected, 1)
+
+    def test_reconnects_after_lost_connection(self):
+        self.advance(5000)
+        self.wlan.drop()
+        self.assertEqual(self.advance(5000), [CONNECTING, CONNECTED])
+        self.assertEqual(self.connected, 2)
+        self.assertEqual(self.wlan.connects, 2)
+
+    def test_already_connected(self):
+        self.wlan.is_active = True
+        self.wlan.connect_time = -self.wlan.connect_ms
+        self.assertEqual(self.wifi.poll(0), CONNECTED)
+        self.assertEqual(self.wlan.connects, 0)
+        self.assertEqual(self.connected, 1)
+
+
+class RetryTest(unittest.TestCase):
+
+    def test_backoff_until_reset(self):
+        retry = Retry(backoff_ms=10000, max_backoff_ms=40000, jitter=lambda limit: 0)
+        attempts = []
+        for now in range(0, 200000, 1000):
+            if retry.due(now):
+                attempts.append(now)
+                retry.failed(now)
+        self.assertEqual(attempts, [0, 10000, 30000, 70000, 110000, 150000, 190000])
+        retry.reset()
+        self.assertTrue(retry.due(190500))
+
+
+if __name__ == '__main__':
+    unittest.main()